@@ -14,23 +14,24 @@
 """
 import signal
 import sys
-import os
 import readline
-from rich.console import Console
 import modules.env_vars as ev
 import modules.dispatch as dp
 import modules.process_input as pi
 import modules.output_fun as of
+import modules.cancel as cx
+import modules.history as hi
+import modules.journal as jr
 import modules.connection as cn
-import modules.snippets as sn
+import modules.result_cache as rc
+import modules.sessions as ss
 
 
 def signal_handler(sig, frame):
-    """Handle the case of control c to kill a query"""
+    """Handle the case of control c to kill a query, the cancel
+    itself is sent by the watcher thread in modules.cancel"""
     of.write_logfile(f"{sig} caught:{frame}", options)
-    cn.disconnect(options)
     options["SIG_INT"] = True  # Set a flag to let other routines know
-    cn.connect(options)
 
 
 # Start of main program
@@ -39,11 +40,10 @@ def signal_handler(sig, frame):
 readline.parse_and_bind("set editing-mode vi")
 
 options = ev.build_options()
-options["CACHE"] = sn.get_snippet_list(options)
-
-console = Console()
 
 of.set_logger(options)
+jr.start(options)
+hi.start(options)
 of.write_logfile(f"Starting isql with {sys.argv}", options, no_print=True)
 
 # Establish connection
@@ -51,6 +51,7 @@ cn.connect(options, True)
 
 # Install our signal handler for Control C
 signal.signal(signal.SIGINT, signal_handler)
+cx.install(options)
 
 # Set up our dispatch table object for internal commands
 dispatch_table = dp.DispatchTable()
@@ -81,12 +82,13 @@ while IN_LINE.lower() != "exit":
     # Prompt user for input
     # The rich input is acting weird, so I'm not using it right now
     #if options["OUTPUT_METHOD"] == "rich":
-    #    IN_LINE = console.input(f"[i bold]{cn.get_prompt(options)}[/]")
+    #    IN_LINE = of.get_console().input(f"[i bold]{cn.get_prompt(options)}[/]")
     #else:
     IN_LINE = input(f"{cn.get_prompt(options)}")
 
 # Clean up
+ss.close_all(options)
 cn.disconnect(options)
-if "RESULTS_CACHE_NAME" in options:
-    os.remove(options["RESULTS_CACHE_NAME"])
+rc.clear(options)
+hi.close(options)
 of.write_logfile("Exiting isql.py", options, no_print=True)
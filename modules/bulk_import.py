@@ -0,0 +1,253 @@
+""" Load a csv file in to a table using the fastest path each driver has """
+import csv
+import time
+from typing import Any, Dict, Iterator, List, TextIO, Tuple
+import modules.connection as cn
+import modules.output_fun as of
+import modules.query_cache as qc
+
+
+class ProgressReader:
+    """Wrap the input file so COPY can report progress as it reads,
+    and end each COPY after rows rows when we commit as we go"""
+
+    def __init__(
+        self, infile: TextIO, options: Dict, state: Dict, rows: int = 0
+    ) -> None:
+        self.infile = infile
+        self.options = options
+        self.state = state
+        self.rows = rows
+        self.sent = 0
+        self.quoted = False  # Inside a quoted field that spans lines
+        self.ended = False
+
+    def read(self, size: int = -1) -> str:
+        """Hand COPY the next chunk, counting the lines as rows"""
+        if self.rows == 0:
+            data = self.infile.read(size)
+            self.state["rows"] += data.count("\n")
+            progress(self.options, self.state)
+            return data
+        # Whole rows only, so a row never spans two COPYs
+        lines = []
+        length = 0
+        while self.sent < self.rows and (size < 0 or length < size):
+            line = self.infile.readline()
+            if not line:
+                self.ended = True
+                break
+            lines.append(line)
+            length += len(line)
+            # An odd number of quotes opens or closes a quoted field
+            if line.count('"') % 2:
+                self.quoted = not self.quoted
+            if self.quoted is False:
+                self.sent += 1
+                self.state["rows"] += 1
+        progress(self.options, self.state)
+        return "".join(lines)
+
+    def readline(self, size: int = -1) -> str:
+        """COPY may also read by line"""
+        data = self.infile.readline(size)
+        self.state["rows"] += 1 if data else 0
+        progress(self.options, self.state)
+        return data
+
+
+def parse_import(line: str, options: Dict) -> Tuple[str, str, Dict]:
+    """<file> into <table> [batch n] [commit n]"""
+    usage = "Usage: @import <file> into <table> [batch n] [commit n]"
+    tokens = line.split()
+    if len(tokens) < 3 or tokens[1].lower() != "into":
+        raise ValueError(usage)
+    settings = {"batch": options["IMPORT_BATCH"], "commit": options["IMPORT_COMMIT"]}
+    pos = 3
+    while pos < len(tokens):
+        name = tokens[pos].lower()
+        if name not in settings or pos + 1 == len(tokens):
+            raise ValueError(usage)
+        if tokens[pos + 1].isdigit() is False:
+            raise ValueError(f"Invalid {name} size {tokens[pos + 1]}")
+        settings[name] = int(tokens[pos + 1])
+        pos += 2
+    settings["batch"] = max(settings["batch"], 1)
+
+    return tokens[0], tokens[2], settings
+
+
+def progress(options: Dict, state: Dict, final: bool = False) -> None:
+    """Show rows and rows/sec every IMPORT_PROGRESS seconds"""
+    now = time.perf_counter()
+    if final is False and now - state["last"] < options["IMPORT_PROGRESS"]:
+        return
+    state["last"] = now
+    elapsed = now - state["start"]
+    rate = state["rows"] / elapsed if elapsed > 0 else 0
+    if options["ARGS"].quiet is not True:
+        print(f"\rRows = {state['rows']}  Rows/sec = {rate:.0f}  ", end="", flush=True)
+        if final is True:
+            print()
+
+
+def insert_sql(table: str, names: List, servertype: str, rows: int = 1) -> str:
+    """Insert statement for rows rows of names columns"""
+    values = "(" + ", ".join(
+        cn.placeholder(servertype, pos) for pos in range(1, len(names) + 1)
+    ) + ")"
+    return (
+        f"INSERT INTO {table} ({', '.join(names)}) VALUES "
+        + ", ".join([values] * rows)
+    )
+
+
+def write_batch(
+    cursor: Any, servertype: str, table: str, names: List, batch: List
+) -> List[str]:
+    """Insert one batch the fastest way the driver allows,
+    returns messages for any rows the server rejected"""
+    errors = []
+    if servertype == "ORACLE":
+        # Bad rows are reported back rather than failing the batch
+        cursor.executemany(
+            insert_sql(table, names, servertype), batch, batcherrors=True
+        )
+        for error in cursor.getbatcherrors():
+            errors.append(f"row {error.offset + 1} of batch: {error.message}")
+    elif servertype in ("MSSQL", "MYSQL"):
+        # Multi row inserts, MSSQL takes at most 1000 rows per VALUES
+        per_stmt = 1000 if servertype == "MSSQL" else len(batch)
+        for start in range(0, len(batch), per_stmt):
+            chunk = batch[start : start + per_stmt]
+            cursor.execute(
+                insert_sql(table, names, servertype, len(chunk)),
+                tuple(value for rec in chunk for value in rec),
+            )
+    elif servertype == "PSQL":
+        import psycopg2.extras
+
+        psycopg2.extras.execute_values(
+            cursor,
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES %s",
+            batch,
+            page_size=len(batch),
+        )
+    else:
+        cursor.executemany(insert_sql(table, names, servertype), batch)
+
+    return errors
+
+
+def chunks(reader: Iterator[List], size: int) -> Iterator[List]:
+    """Group the csv rows in to batches, empty fields are nulls"""
+    batch = []
+    for rec in reader:
+        batch.append(tuple(None if value == "" else value for value in rec))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_psql(
+    infile: TextIO, table: str, settings: Dict, options: Dict, state: Dict
+) -> None:
+    """PSQL streams the file straight in with COPY, one COPY per commit
+    rows (autocommit commits each one) or a single COPY for commit 0"""
+    names = next(csv.reader([infile.readline()]))
+    sql = f"COPY {table} ({', '.join(names)}) FROM STDIN WITH (FORMAT csv)"
+    reader = ProgressReader(infile, options, state, settings["commit"])
+    cursor = options["CONN"].cursor()
+    committed = 0
+    try:
+        while reader.ended is False:
+            reader.sent = 0
+            cursor.copy_expert(sql, reader, size=options["WRITE_BUFFER"])
+            committed += max(cursor.rowcount, 0)
+            state["rows"] = committed
+            if settings["commit"] == 0:
+                break
+    except Exception:
+        # Only the COPYs that finished are in the table
+        state["rows"] = committed
+        raise
+    finally:
+        cursor.close()
+
+
+def load_batches(
+    infile: TextIO, table: str, settings: Dict, options: Dict, state: Dict
+) -> List[str]:
+    """Insert the file in batches, committing every commit rows"""
+    servertype = options["ARGS"].servertype
+    conn = options["CONN"]
+    reader = csv.reader(infile)
+    names = next(reader)
+    errors = []
+    cursor = conn.cursor()
+    cn.set_autocommit(conn, servertype, False)
+    since_commit = 0
+    try:
+        for batch in chunks(reader, settings["batch"]):
+            errors.extend(write_batch(cursor, servertype, table, names, batch))
+            state["rows"] += len(batch)
+            since_commit += len(batch)
+            # SQLITE loads everything in a single transaction
+            if servertype != "SQLITE" and 0 < settings["commit"] <= since_commit:
+                conn.commit()
+                since_commit = 0
+            progress(options, state)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cn.set_autocommit(conn, servertype, True)
+        cursor.close()
+
+    return errors
+
+
+def import_file(line: str, options: Dict) -> None:
+    """@import file.csv into schema.table [batch n] [commit n]"""
+    try:
+        filename, table, settings = parse_import(line, options)
+    except ValueError as err:
+        print(f"Error: {err}")
+        return
+
+    now = time.perf_counter()
+    state = {"start": now, "last": now, "rows": 0}
+    errors: List[str] = []
+    try:
+        with open(filename, "r", encoding="utf-8", newline="") as infile:
+            if options["ARGS"].servertype == "PSQL":
+                copy_psql(infile, table, settings, options, state)
+            else:
+                errors = load_batches(infile, table, settings, options, state)
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        progress(options, state, final=True)
+        of.write_logfile(f"Error: {err}", options, iserr=True)
+        of.write_logfile(
+            f"Import of {filename} stopped, uncommitted rows rolled back",
+            options,
+            iserr=True,
+        )
+        return
+    finally:
+        # Rows committed before a failure count too
+        qc.invalidate(options)
+
+    progress(options, state, final=True)
+    elapsed = time.perf_counter() - state["start"]
+    rate = state["rows"] / elapsed if elapsed > 0 else 0
+    of.write_logfile(
+        f"Imported {state['rows']} rows into {table}\tElapsed = {elapsed:.4f}"
+        f"\tRows/sec = {rate:.0f}\tRejected = {len(errors)}",
+        options,
+    )
+    for error in errors[:10]:
+        of.write_logfile(f"Rejected {error}", options, iserr=True)
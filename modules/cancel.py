@@ -0,0 +1,70 @@
+""" Cancel the running query on Ctrl-C with each driver's own cancel,
+keeping the connection and whatever rows were already fetched """
+import signal
+import socket
+import threading
+from typing import Dict
+import modules.connection as cn
+import modules.output_fun as of
+
+# How each server is asked to stop a statement from another connection
+KILL_SQL = {"MYSQL": "KILL QUERY {}", "MSSQL": "KILL {}"}
+
+
+def kill(options: Dict) -> None:
+    """KILL our statement from a second connection"""
+    conn = cn.open_connection(options)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            KILL_SQL[options["ARGS"].servertype].format(int(options["BACKEND_ID"]))
+        )
+    finally:
+        conn.close()
+    if options["ARGS"].servertype == "MSSQL":
+        # MSSQL can only kill the whole session, so we reconnect after
+        options["CANCEL_RECONNECT"] = True
+
+
+def cancel_query(options: Dict) -> None:
+    """Ask the server to stop the running statement"""
+    servertype = options["ARGS"].servertype
+    of.write_logfile("Cancelling query", options)
+    try:
+        if servertype in ("PSQL", "ORACLE"):
+            options["CONN"].cancel()
+        elif servertype == "SQLITE":
+            options["CONN"].interrupt()
+        elif servertype in KILL_SQL and options.get("BACKEND_ID") is not None:
+            kill(options)
+    except Exception as err:
+        of.write_logfile(f"Error: cancel failed: {err}", options, iserr=True)
+
+
+def after_cancel(options: Dict) -> None:
+    """Back on the main thread once the query has stopped"""
+    if options.pop("CANCEL_RECONNECT", False):
+        cn.connect(options)
+
+
+def watch(options: Dict, reader: socket.socket) -> None:
+    """The signal module writes each signal number to our socket as soon
+    as it arrives, even while the driver holds the main thread in C,
+    so the cancel goes out straight away"""
+    while True:
+        try:
+            data = reader.recv(64)
+        except OSError:
+            return
+        if signal.SIGINT in data and options.get("QUERY_RUNNING") is True:
+            options["SIG_INT"] = True  # Set a flag to let other routines know
+            cancel_query(options)
+
+
+def install(options: Dict) -> None:
+    """Start the watcher thread and route SIGINT to it"""
+    reader, writer = socket.socketpair()
+    writer.setblocking(False)
+    signal.set_wakeup_fd(writer.fileno(), warn_on_full_buffer=False)
+    options["CANCEL_SOCKETS"] = (reader, writer)
+    threading.Thread(target=watch, args=(options, reader), daemon=True).start()
@@ -0,0 +1,141 @@
+""" Map the cursor description type codes of each driver on to a
+common set of column kinds that the exporters can work with """
+import datetime
+import decimal
+from typing import Any, Iterable, List, Optional
+
+# PSQL type codes are the pg_type oids
+PSQL_KINDS = {
+    16: "bool",
+    17: "bytes",
+    20: "int",
+    21: "int",
+    23: "int",
+    26: "int",
+    700: "float",
+    701: "float",
+    1700: "decimal",
+    19: "str",
+    25: "str",
+    114: "str",
+    1042: "str",
+    1043: "str",
+    2950: "str",
+    3802: "str",
+    1082: "date",
+    1114: "datetime",
+    1184: "datetime",
+    1083: "time",
+    1266: "time",
+}
+
+# mysql.connector FieldType values
+MYSQL_KINDS = {
+    0: "decimal",
+    1: "int",
+    2: "int",
+    3: "int",
+    4: "float",
+    5: "float",
+    7: "datetime",
+    8: "int",
+    9: "int",
+    10: "date",
+    12: "datetime",
+    13: "int",
+    14: "date",
+    15: "str",
+    245: "str",
+    246: "decimal",
+    247: "str",
+    248: "str",
+    253: "str",
+    254: "str",
+}
+
+# pymssql only hands back the DB-API type groups
+MSSQL_KINDS = {
+    1: "str",
+    2: "bytes",
+    4: "datetime",
+    5: "decimal",
+}
+
+# oracledb type codes are DbType objects, we go by their name
+ORACLE_KINDS = {
+    "DB_TYPE_BINARY_DOUBLE": "float",
+    "DB_TYPE_BINARY_FLOAT": "float",
+    "DB_TYPE_BINARY_INTEGER": "int",
+    "DB_TYPE_BOOLEAN": "bool",
+    "DB_TYPE_CHAR": "str",
+    "DB_TYPE_CLOB": "str",
+    "DB_TYPE_DATE": "datetime",
+    "DB_TYPE_LONG": "str",
+    "DB_TYPE_NCHAR": "str",
+    "DB_TYPE_NCLOB": "str",
+    "DB_TYPE_NVARCHAR": "str",
+    "DB_TYPE_VARCHAR": "str",
+    "DB_TYPE_RAW": "bytes",
+    "DB_TYPE_LONG_RAW": "bytes",
+    "DB_TYPE_BLOB": "bytes",
+    "DB_TYPE_TIMESTAMP": "datetime",
+    "DB_TYPE_TIMESTAMP_LTZ": "datetime",
+    "DB_TYPE_TIMESTAMP_TZ": "datetime",
+}
+
+
+def value_kind(value: Any) -> str:
+    """Work out the kind from a python value"""
+    # bool is an int and datetime is a date, so order matters
+    for kind, types in (
+        ("bool", bool),
+        ("int", int),
+        ("float", float),
+        ("decimal", decimal.Decimal),
+        ("str", str),
+        ("bytes", (bytes, bytearray, memoryview)),
+        ("datetime", datetime.datetime),
+        ("date", datetime.date),
+        ("time", datetime.time),
+    ):
+        if isinstance(value, types):
+            return kind
+    return "str"
+
+
+def code_kind(head: Iterable, servertype: str) -> Optional[str]:
+    """Look up the kind from the description entry, None if unknown"""
+    code = head[1]
+    if servertype == "PSQL":
+        return PSQL_KINDS.get(code)
+    if servertype == "MYSQL":
+        return MYSQL_KINDS.get(code)
+    if servertype == "MSSQL":
+        return MSSQL_KINDS.get(code)
+    if servertype == "ORACLE":
+        name = getattr(code, "name", "")
+        if name == "DB_TYPE_NUMBER":
+            # Whole numbers have a precision and no scale
+            if head[4] and head[5] == 0:
+                return "int"
+            return "decimal"
+        return ORACLE_KINDS.get(name)
+    # SQLITE doesn't give us type codes at all
+    return None
+
+
+def column_kinds(headers: List, servertype: str, sample: List) -> List[str]:
+    """Kinds for each column, from the type codes when the driver
+    gives them and otherwise from the first non null value in sample"""
+    kinds = []
+    for i, head in enumerate(headers):
+        kind = code_kind(head, servertype)
+        if kind is None:
+            kind = "str"
+            for rec in sample:
+                if rec[i] is not None:
+                    kind = value_kind(rec[i])
+                    break
+        kinds.append(kind)
+
+    return kinds
@@ -1,13 +1,13 @@
 """ Manage connections to databases """
+import importlib
 import sys
+from collections import OrderedDict
 from collections.abc import Callable
 from typing import Any, Dict, Iterable
-import sqlite3
-import pymssql
-import psycopg2
-import mysql.connector
-import oracledb
 import modules.output_fun as of
+import modules.query_cache as qc
+import modules.server_stats as sx
+import modules.sql_text as st
 
 
 def build_msg_handler(opts: Dict) -> Callable[[int, int, str, bytes, int, bytes], None]:
@@ -30,6 +30,10 @@ def build_msg_handler(opts: Dict) -> Callable[[int, int, str, bytes, int, bytes]
             return
         if tokens[0] == "Changed":  # Changing database, no need to say it
             return
+        if opts["SERVER_MESSAGES"] is not None and sx.is_statistics(d_msgtext):
+            # STATISTICS IO and TIME output for :serverstats
+            opts["SERVER_MESSAGES"].append(d_msgtext)
+            return
 
         if msgstate != 0 and severity != 0:
             of.write_message(f"state={msgstate}, sev={severity}", opts)
@@ -44,6 +48,9 @@ def parameters(opts: Dict) -> Dict:
     if opts["ARGS"].servertype == "SQLITE":
         ret_val = {
             "database": opts["ARGS"].sqlitedb,
+            # Worker threads may open and close their own connections
+            "check_same_thread": False,
+            "cached_statements": max(opts["PREPARE_SIZE"], 1),
         }
     else:
         std_args = {
@@ -77,53 +84,135 @@ class ConnectionDispatchTable:
     """This is effectively a switch/case statement
     to build the connection string based on the servertype"""
 
+    # The driver modules are only imported for the servertype we use
     dispatch = {
-        "MSSQL": pymssql.connect,
-        "MYSQL": mysql.connector.connect,
-        "PSQL": psycopg2.connect,
-        "SQLITE": sqlite3.connect,
-        "ORACLE": oracledb.connect,
+        "MSSQL": "pymssql",
+        "MYSQL": "mysql.connector",
+        "PSQL": "psycopg2",
+        "SQLITE": "sqlite3",
+        "ORACLE": "oracledb",
     }
 
     def list_supported_type(self) -> Iterable:
         """ Return the supported connection types """
         return self.dispatch.keys()
 
-    def run(self, cmd: str, opts: Dict) -> Any:
-        """exec the function pointed to by cmd in dispatch"""
+    def run(self, cmd: str, opts: Dict, fatal: bool = True) -> Any:
+        """exec the function pointed to by cmd in dispatch,
+        extra connections pass fatal=False to get the error back"""
         if cmd in self.dispatch.keys():
             try:
                 params = parameters(opts)
-                return self.dispatch[cmd](**params)
+                return driver(cmd).connect(**params)
             except Exception as err:
                 of.write_logfile(f"Error: {err}", opts)
+                if fatal is False:
+                    raise
                 sys.exit(1)
         else:
             print(f"Unknown connection type: {cmd}")
             sys.exit(1)
 
 
-def connect(options: Dict, value: bool = False) -> None:
-    """connect to database server and create a cursor"""
-    of.write_logfile("Establishing connection to server", options, no_print=value)
-    dispatch = ConnectionDispatchTable()
-    options["CONN"] = dispatch.run(options["ARGS"].servertype, options)
+def driver(servertype: str) -> Any:
+    """The driver module for servertype, imported the first time it is used"""
+    return importlib.import_module(ConnectionDispatchTable.dispatch[servertype])
 
-    # Set connection parameters
+
+def configure(conn: Any, options: Dict) -> Any:
+    """Set the connection parameters we expect on a new connection"""
     if options["ARGS"].servertype == "SQLITE":
-        sqlite3.paramstyle = "named"
+        driver("SQLITE").paramstyle = "named"
     elif options["ARGS"].servertype == "MSSQL":
-        options["CONN"].autocommit(True)
-        options["CONN"]._conn.set_msghandler(build_msg_handler(options))
+        conn.autocommit(True)
+        conn._conn.set_msghandler(build_msg_handler(options))
     elif options["ARGS"].servertype == "PSQL":
-        options["CONN"].autocommit = True
+        conn.autocommit = True
     elif options["ARGS"].servertype == "ORACLE":
-        options["CONN"].autocommit = True
+        conn.autocommit = True
+        # Statements run again skip the parse
+        conn.stmtcachesize = options["PREPARE_SIZE"]
     elif options["ARGS"].servertype == "MYSQL":
         # No extra options for MYSQL
         pass
 
+    return conn
+
+
+def open_connection(options: Dict) -> Any:
+    """Open an extra connection with the current settings,
+    errors are raised back to the caller rather than exiting"""
+    dispatch = ConnectionDispatchTable()
+    conn = dispatch.run(options["ARGS"].servertype, options, fatal=False)
+    return configure(conn, options)
+
+
+def backend_id(options: Dict) -> Any:
+    """The server's id for our connection, needed to KILL from a side
+    connection.  MYSQL knows it already, MSSQL costs one round trip"""
+    if options["ARGS"].servertype == "MYSQL":
+        return options["CONN"].connection_id
+    if options["ARGS"].servertype == "MSSQL":
+        options["CURSOR"].execute("select @@spid")
+        return options["CURSOR"].fetchall()[0][0]
+    return None
+
+
+def connect(options: Dict, value: bool = False) -> None:
+    """connect to database server and create a cursor"""
+    of.write_logfile("Establishing connection to server", options, no_print=value)
+    dispatch = ConnectionDispatchTable()
+    options["CONN"] = configure(
+        dispatch.run(options["ARGS"].servertype, options), options
+    )
     options["CURSOR"] = options["CONN"].cursor()
+    options["BACKEND_ID"] = backend_id(options)
+    # Prepared statements went with the old connection, and the cached
+    # results may be from another server or database
+    options["PREPARED"] = OrderedDict()
+    qc.invalidate(options)
+    mark_session(options)
+
+
+def large_cursor(options: Dict, sql: str) -> Any:
+    """Build a cursor that keeps the result set on the server side
+    and streams it to us in FETCH_SIZE batches"""
+    if options["ARGS"].servertype == "PSQL" and st.declares_cursor(sql):
+        # A named cursor is a server side cursor, it has to survive
+        # the autocommit so we declare it WITH HOLD.  DECLARE only takes a
+        # query, anything else (SHOW, EXPLAIN, DML) runs on a plain cursor
+        cursor = options["CONN"].cursor(name="isql_large", withhold=True)
+        cursor.itersize = options["FETCH_SIZE"]
+    elif options["ARGS"].servertype == "MYSQL":
+        # Unbuffered, rows are read off the wire as we fetch them
+        cursor = options["CONN"].cursor(buffered=False)
+    elif options["ARGS"].servertype == "ORACLE":
+        cursor = options["CONN"].cursor()
+        cursor.arraysize = options["FETCH_SIZE"]
+        cursor.prefetchrows = options["FETCH_SIZE"]
+    else:
+        # MSSQL and SQLITE already hand back rows as we iterate
+        cursor = options["CONN"].cursor()
+
+    return cursor
+
+
+def set_autocommit(conn: Any, servertype: str, value: bool) -> None:
+    """Switch autocommit on or off for bulk work"""
+    if servertype == "MSSQL":
+        conn.autocommit(value)
+    elif servertype in ("PSQL", "ORACLE", "MYSQL"):
+        conn.autocommit = value
+    # SQLITE starts a transaction on the first write and waits for commit
+
+
+def placeholder(servertype: str, pos: int) -> str:
+    """The bind placeholder for the pos'th (from 1) value"""
+    if servertype == "SQLITE":
+        return "?"
+    if servertype == "ORACLE":
+        return f":{pos}"
+    return "%s"
 
 
 def disconnect(options: Dict) -> None:
@@ -133,31 +222,52 @@ def disconnect(options: Dict) -> None:
     options["CONN"].close()
 
 
-def get_dbname(options: Dict) -> str:
-    """Get the current database"""
-    database = ""
-    select_stmt = ""
-    if options["ARGS"].servertype == "MSSQL":
-        select_stmt = "select db_name()"
-    elif options["ARGS"].servertype == "PSQL":
-        select_stmt = "select current_database()"
-    elif options["ARGS"].servertype == "MYSQL":
-        select_stmt = "select database()"
-    elif options["ARGS"].servertype == "ORACLE":
-        select_stmt = "select sys_context('userenv', 'instance_name') from dual"
+# One round trip for the database, session user and schema
+SESSION_SQL = {
+    "MSSQL": "select db_name(), suser_sname(), schema_name()",
+    "PSQL": "select current_database(), current_user, current_schema()",
+    "MYSQL": "select database(), current_user(), database()",
+    "ORACLE": "select sys_context('userenv', 'instance_name'), user,"
+    " sys_context('userenv', 'current_schema') from dual",
+}
+
+
+def mark_session(options: Dict) -> None:
+    """The session may have changed, ask the server again next prompt"""
+    options["SESSION"]["stale"] = True
 
+
+def refresh_session(options: Dict) -> None:
+    """Fetch the session state the prompt shows from the server"""
+    session = {
+        "database": "",
+        "user": options["ARGS"].user or "",
+        "schema": "",
+        "stale": False,
+    }
+    select_stmt = SESSION_SQL.get(options["ARGS"].servertype, "")
     if select_stmt != "":
         try:
             options["CURSOR"].execute(select_stmt)
             rows = options["CURSOR"].fetchall()
-            if rows[0][0] is not None:
-                database = rows[0][0]
+            for key, value in zip(("database", "user", "schema"), rows[0]):
+                if value is not None:
+                    session[key] = value
         except Exception:  # If we get an exception here, we've lost connection
+            session["stale"] = True
             if options["ERROR"]:
                 options["ERROR"] = False
                 connect(options)
 
-    return database
+    options["SESSION"] = session
+
+
+def get_dbname(options: Dict) -> str:
+    """Get the current database, only going to the server when
+    something may have changed it"""
+    if options["SESSION"]["stale"] is True:
+        refresh_session(options)
+    return options["SESSION"]["database"]
 
 
 def get_prompt(options: Dict) -> str:
@@ -172,7 +282,10 @@ def get_prompt(options: Dict) -> str:
         "t": options["ARGS"].servertype,
         "n": str(options["LINE_NO"]),
         "u": options["ARGS"].user,
+        "w": options["SESSION"]["user"],
+        "c": options["SESSION"]["schema"],
         "f": options["OUTPUT_METHOD"],
+        "a": options["SESSION_NAME"],
     }
 
     pos = 0
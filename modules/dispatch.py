@@ -1,14 +1,22 @@
 """ base dispatcher for cli of isql.py """
+import csv
+import sys
+import time
 from typing import Dict, List, Iterable
-from rich.console import Console
 import modules.env_vars as ev
+import modules.explain as xp
 import modules.connection as cn
 import modules.helpfile as hf
+import modules.history as hi
+import modules.journal as jr
 import modules.process_input as pi
+import modules.execute_query as eq
 import modules.output_fun as of
-
-
-console = Console()
+import modules.prepared as ps
+import modules.result_cache as rc
+import modules.sessions as ss
+import modules.table_copy as tc
+import modules.timing as tm
 
 
 def do_reparse(opts: Dict, _) -> None:
@@ -30,22 +38,50 @@ def do_connect(opts: Dict, t_list: List) -> None:
     cn.connect(opts)
 
 
-def do_redisplay(opts: Dict, _) -> None:
-    """Get the results of the last query and show them again"""
-    if opts["PAGER"] is True:
-        with console.pager():
-            console.print(of.read_cache(opts))
-    else:
-        if opts["OUTPUT_METHOD"] == "pretty":
-            print(of.read_cache(opts))
-        else:
-            console.print(of.read_cache(opts))
-
-
-def do_history(opts: Dict, _) -> None:
-    """Show the history buffer to the user"""
-    for i in range(len(opts["HISTORY"])):
-        console.print(f"{i} = {opts['HISTORY'][i]}")
+def do_redisplay(opts: Dict, t_list: List) -> None:
+    """Re-render a cached result without running the query again
+    redisplay [list | n] [rich|pretty|default|csv]"""
+    index = 1
+    method = opts["OUTPUT_METHOD"]
+    for token in t_list[1:]:
+        if token.lower() == "list":
+            for i, entry in enumerate(rc.entries(opts), start=1):
+                sql = " ".join(entry["sql"].split())
+                of.get_console().print(
+                    f"{i} = {time.strftime('%H:%M:%S', time.localtime(entry['time']))}"
+                    f" rows={entry['rows']} bytes={entry['size']} {sql[:60]}"
+                )
+            return
+        if token.isdigit():
+            index = int(token)
+        elif token.lower() in ("rich", "pretty", "default", "csv"):
+            method = token.lower()
+        elif token != "":
+            print(f"Unknown redisplay option {token}")
+            return
+
+    entry = rc.lookup(opts, index)
+    if entry is None:
+        print("No results to redisplay")
+        return
+
+    print("** Fetching from cache **")
+    if method == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(entry["names"])
+        for batch in rc.read(entry):
+            writer.writerows(batch)
+        return
+
+    # Redisplay only goes to the screen
+    saved = (opts["OUTPUT_METHOD"], opts["OUTPUT_CSV"], opts["ARGS"].output)
+    opts["OUTPUT_METHOD"] = method
+    opts["OUTPUT_CSV"] = False
+    opts["ARGS"].output = None
+    try:
+        eq.render_cached(opts, entry)
+    finally:
+        opts["OUTPUT_METHOD"], opts["OUTPUT_CSV"], opts["ARGS"].output = saved
 
 
 class DispatchTable:
@@ -64,7 +100,13 @@ class DispatchTable:
         "redisplay": do_redisplay,
         "dump": ev.print_opts,
         "help": hf.provide_help,
-        "history": do_history,
+        "history": hi.history_command,
+        "timing": tm.set_timing,
+        "copy": tc.copy_table,
+        "session": ss.session_command,
+        "prepared": ps.prepared_command,
+        "stats": jr.stats_command,
+        "explain": xp.explain_command,
     }
 
     def list_keys(self) -> Iterable:
@@ -2,12 +2,15 @@
 import sys
 import os
 import argparse
+import copy
 import getpass
 import shutil
-from typing import Dict
+import threading
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
 from configparser import ConfigParser
-from rich.console import Console
-from prettytable import DEFAULT, MSWORD_FRIENDLY, PLAIN_COLUMNS
+import modules.output_fun as of
+import modules.prepared as ps
 
 
 # We need to find where our stuff is so we can set up the personal copy
@@ -31,13 +34,15 @@ if os.path.exists(LOG_PATH) is False:
     os.makedirs(LOG_PATH)
 
 
-def pretty_options(parse_val: str) -> int:
+# The table styles we support, named after the prettytable styles
+PRETTY_STYLES = ("DEFAULT", "MSWORD_FRIENDLY", "PLAIN_COLUMNS")
+
+
+def pretty_options(parse_val: str) -> str:
     """Need to convert the text into a value"""
-    ret_val = DEFAULT
-    if parse_val.upper() == "MSWORD_FRIENDLY":
-        ret_val = MSWORD_FRIENDLY
-    if parse_val.upper() == "PLAIN_COLUMNS":
-        ret_val = PLAIN_COLUMNS
+    ret_val = "DEFAULT"
+    if parse_val.upper() in PRETTY_STYLES:
+        ret_val = parse_val.upper()
 
     return ret_val
 
@@ -53,10 +58,25 @@ def build_options() -> Dict:
         "HOME": HOME,  # Path to home directory
         "CODE_DIR": code_dir,
         "LOG_PATH": LOG_PATH,  # Path to log files
+        # Size in MB the log and journal rotate at, and the old files kept
+        "LOG_SIZE": parser.getint("log", "size", fallback=1) * 1048576,
+        "LOG_BACKUPS": parser.getint("log", "backups", fallback=5),
+        "JOURNAL_ON": parser.getboolean("log", "journal", fallback=True),
+        "JOURNAL_SIZE": parser.getint("log", "journalsize", fallback=64) * 1048576,
+        "JOURNAL": None,  # Logger for the query journal
         "SNIPPETS_PATH": parser.get("general", "snippets"),
         "SQL_BUFFER": "",  # This is buffer used to hold the query
         "LINE_NO": 1,  # We start at line 1 for user friendliness
         "HISTORY": [],  # Our history list
+        # Keep the history in a sqlite database, the entries loaded at
+        # start and the number history and history search show
+        "HISTORY_SAVE": parser.getboolean("history", "save", fallback=True),
+        "HISTORY_FILE": os.path.expanduser(
+            parser.get("history", "file", fallback=f"{ISQL_PATH}/history.db")
+        ),
+        "HISTORY_LOAD": parser.getint("history", "load", fallback=1000),
+        "HISTORY_SHOW": parser.getint("history", "show", fallback=50),
+        "HISTORY_DB": None,  # Connection to the history database
         "OUTPUT_STYLE": pretty_options(parser.get("output", "style").upper()),
         "OUTPUT_ALIGN": parser.get("output", "align"),
         "OUTPUT_HEADER": parser.getboolean("output", "header"),
@@ -64,12 +84,87 @@ def build_options() -> Dict:
         "HEADER_STYLE": parser.get("output", "hcaps"),
         "OUTPUT_METHOD": parser.get("output", "method"),
         "OUTPUT_CSV": parser.getboolean("output", "csv"),
+        "EXPORT_FORMAT": parser.get("output", "format", fallback="auto").lower(),
+        "EXPORT_SET": 0,  # Result set of the query being exported
         "PAGER": parser.getboolean("output", "pager"),
+        "PAGER_TYPE": parser.get("output", "pagertype", fallback="rich").lower(),
+        "FETCH_SIZE": parser.getint("output", "fetchsize", fallback=5000),
+        # Batches fetched ahead of the renderer on the reader thread, 0 is off
+        "PIPELINE_DEPTH": parser.getint("output", "pipeline", fallback=4),
+        "WRITE_BUFFER": parser.getint("output", "writebuffer", fallback=1048576),
+        "LARGE_RESULTS": parser.getboolean("output", "large", fallback=False),
+        # Rows shown of each result (0 is all), rows go preview shows when
+        # maxrows is 0, and whether the limit is added to the sql
+        "MAX_ROWS": parser.getint("output", "maxrows", fallback=0),
+        "PREVIEW_ROWS": parser.getint("output", "preview", fallback=100),
+        "ROW_PUSHDOWN": parser.getboolean("output", "pushdown", fallback=False),
+        "ROW_LIMIT": 0,  # Row limit of the running query
+        "ROW_LIMIT_PUSHED": False,  # Was it added to the sql
+        "MORE_ROWS": False,  # Did the running query have rows past the limit
         "PROMPT": parser.get("prompt", "format", fallback=""),
+        # Rows per insert batch, rows between commits and seconds between
+        # progress updates for @import
+        "IMPORT_BATCH": parser.getint("import", "batch", fallback=1000),
+        "IMPORT_COMMIT": parser.getint("import", "commit", fallback=10000),
+        "IMPORT_PROGRESS": parser.getfloat("import", "progress", fallback=1.0),
+        # Batches the copy command may have read ahead of the writer
+        "COPY_QUEUE": parser.getint("import", "queue", fallback=4),
+        # Statements between commits for @run and whether it keeps
+        # going past a failing statement
+        "SCRIPT_COMMIT": parser.getint("script", "commit", fallback=1000),
+        "SCRIPT_CONTINUE": parser.getboolean("script", "continue", fallback=False),
+        # Results kept for redisplay and their total size budget in MB
+        "CACHE_ENTRIES": parser.getint("cache", "entries", fallback=10),
+        "CACHE_SIZE": parser.getint("cache", "size", fallback=256) * 1048576,
+        # Opt in reuse of read only query results
+        "QUERY_CACHE": parser.getboolean("cache", "query", fallback=False),
+        "QUERY_CACHE_TTL": parser.getint("cache", "ttl", fallback=60),
+        "QUERY_CACHE_SIZE": parser.getint("cache", "querysize", fallback=64)
+        * 1048576,
+        "QCACHE": OrderedDict(),  # The cached query results
+        "QCACHE_STATS": {"hits": 0, "misses": 0, "invalidations": 0, "bytes": 0},
+        # Statements kept prepared on the server, 0 turns it off
+        "PREPARE_SIZE": parser.getint("cache", "statements", fallback=100),
+        "PREPARED": OrderedDict(),  # The prepared statements by sql text
+        "PREPARE_STATS": ps.new_stats(),
+        "PREPARE_SEQ": 1,  # Numbers the PSQL statement names
+        "BIND_VALUES": None,  # The sql and values prompted for this go
+        "SESSION_NAME": "default",  # Name of the current session
+        "SESSIONS": {},  # The other open sessions, by name
+        "SESSION_LOCK": threading.Lock(),  # Held while touching SESSIONS
+        # Seconds a session may sit idle before we ping it, 0 is off
+        "SESSION_KEEPALIVE": parser.getint("session", "keepalive", fallback=300),
         "CONN": None,  # Current connection
         "CURSOR": None,  # Current cursor
+        "BACKEND_ID": None,  # The server's id for our connection
+        "QUERY_RUNNING": False,  # Is there a query that Ctrl-C should cancel
+        # Database, user and schema the prompt shows, stale means ask the server
+        "SESSION": {"database": "", "user": "", "schema": "", "stale": True},
         "SIG_INT": False,  # Did someone hit control c?
         "ERROR": False,  # Did we get an error?
+        "GO_PARALLEL": 0,  # Connections used by go N parallel K
+        "GO_SAMPLE": False,  # Show sample results of a parallel go
+        "GO_DISCARD": False,  # Fetch and throw away the results
+        "GO_TTL": None,  # Query cache ttl for this go
+        "GO_ON": None,  # Server list go on runs the buffer against
+        "GO_WITH": None,  # Parameter file go with runs the buffer for
+        "GO_PREVIEW": None,  # Rows go preview shows
+        # Parameter rows per batch for go with
+        "GO_BATCH": parser.getint("import", "batch", fallback=1000),
+        "GO_LIMIT": 0,  # Servers go on runs at the same time, 0 for FAN_OUT_LIMIT
+        "FAN_OUT_LIMIT": parser.getint("fanout", "limit", fallback=8),
+        # [servers.<name>] sections, label = connection flags
+        "SERVER_LISTS": {
+            section[len("servers."):]: dict(parser.items(section))
+            for section in parser.sections()
+            if section.startswith("servers.")
+        },
+        "TIMING_ON": parser.getboolean("output", "timing", fallback=False),
+        # Report the server's counters for each query
+        "SERVER_STATS": parser.getboolean("output", "serverstats", fallback=False),
+        "SERVER_MESSAGES": None,  # MSSQL statistics messages being collected
+        "TIMING": {},  # Phase timings of the current query
+        "TIMING_TOTALS": {},  # Running totals across executions
     }
 
     parse_args(opts)
@@ -115,22 +210,55 @@ def parse_args(options: Dict) -> None:
 
     # Get our default port if none was provided
     if options["ARGS"].port is None:
-        if options["ARGS"].servertype == "MSSQL":
-            options["ARGS"].port = "1433"
-        elif options["ARGS"].servertype == "PSQL":
-            options["ARGS"].port = "5432"
-        elif options["ARGS"].servertype == "MYSQL":
-            options["ARGS"].port = "3306"
-        elif options["ARGS"].servertype == "ORACLE":
-            options["ARGS"].port = "1521"
-        else:
-            pass  # We're assuming SQLITE
+        options["ARGS"].port = default_port(options["ARGS"].servertype)
 
         if options["ARGS"].quiet is None:
             print(f"Defaulting to port {options['ARGS'].port}")
 
 
+def default_port(servertype: str) -> Optional[str]:
+    """The usual port for the servertype"""
+    ports = {"MSSQL": "1433", "PSQL": "5432", "MYSQL": "3306", "ORACLE": "1521"}
+    return ports.get(servertype)  # We're assuming SQLITE otherwise
+
+
+# Command line flags that can be given to commands opening another connection
+CONNECTION_FLAGS = {
+    "-T": "servertype",
+    "-S": "server",
+    "-U": "user",
+    "-P": "password",
+    "-D": "database",
+    "-p": "port",
+    "-F": "sqlitedb",
+}
+
+
+def connection_args(options: Dict, tokens: List) -> Tuple[argparse.Namespace, List]:
+    """Copy the current connection arguments and override them with any
+    connection flags in tokens, returns the arguments and the other tokens"""
+    args = copy.copy(options["ARGS"])
+    rest = []
+    pos = 0
+    while pos < len(tokens):
+        flag = tokens[pos]
+        if flag in CONNECTION_FLAGS:
+            if pos + 1 == len(tokens):
+                raise ValueError(f"Missing value for {flag}")
+            setattr(args, CONNECTION_FLAGS[flag], tokens[pos + 1])
+            pos += 2
+        else:
+            if flag != "":
+                rest.append(flag)
+            pos += 1
+    if args.servertype is not None:
+        args.servertype = args.servertype.upper()
+    if "-p" not in tokens and args.servertype != options["ARGS"].servertype:
+        args.port = default_port(args.servertype)
+
+    return args, rest
+
+
 def print_opts(opts: Dict) -> None:
     """Dump options info out to the screen"""
-    console = Console()
-    console.print(opts)
+    of.get_console().print(opts)
@@ -1,138 +1,404 @@
 """ process the query and display the output """
+import sys
 import time
-from typing import Iterable, Dict
-from prettytable import from_db_cursor
-from rich.console import Console
-from rich.table import Table
+from typing import Iterable, Iterator, Dict, List, Optional
+import modules.cancel as cx
+import modules.connection as cn
+import modules.export as ex
+import modules.journal as jr
 import modules.output_fun as of
+import modules.pager as pg
+import modules.pipeline as pl
+import modules.prepared as ps
+import modules.preview as pv
+import modules.query_cache as qc
+import modules.result_cache as rc
+import modules.server_stats as sx
+import modules.sql_text as st
 import modules.substitute_vars as sv
-
-console = Console()
+import modules.text_table as tt
+import modules.timing as tm
 
 
 def formatted_output(options: Dict) -> None:
-    """Common code for formatted output via csv, pretty or rich"""
+    """Common code for formatted output via csv, pretty, rich or default"""
     headers = options["CURSOR"].description
     if headers is not None:
+        options["EXPORT_SET"] = 0
         while True:
-            if options["OUTPUT_CSV"] is True:
-                csv_output(headers, options)
-            elif options["OUTPUT_METHOD"] == "pretty":
-                pretty_output(headers, options)
-            elif options["OUTPUT_METHOD"] == "rich":
-                rich_output(headers, options)
+            rc.start(options, headers)
+            qc.start_set(options, headers)
+            render(headers, options)
+            rc.finish(options)
 
+            if options["SIG_INT"] is True or options["MORE_ROWS"] is True:
+                # Cancelled or cut short, the rest of the results are gone
+                break
             if options["ARGS"].servertype == "MSSQL":
                 # Handle multiple result sets under MSSQL
                 if not options["CURSOR"].nextset():
                     break
                 headers = options["CURSOR"].description
+                options["EXPORT_SET"] += 1
             else:
                 break
+        options["EXPORT_SET"] = 0
 
 
-def csv_output(headers: Iterable, options: Dict) -> None:
-    """Handle the output to csv file"""
-    headerline = []
-    for head in headers:
-        headerline.append(head[0])
-    test = of.write_output_file(headerline, options)
-    records = options["CURSOR"].fetchall()
-    if test != 100:  # 100 is a magic number & means we have no output file
-        for rec in records:
-            of.write_output_file(rec, options)
-        console.print("Output written to output file", style="b r")
-
-
-def pretty_output(_, options: Dict) -> None:
-    """Send output to pretty printer"""
-    tbl = from_db_cursor(options["CURSOR"])
-    # Make sure we have results to format
-    if tbl is not None:
-        tbl.set_style(options["OUTPUT_STYLE"])
-        tbl.align = options["OUTPUT_ALIGN"]
-        tbl.header = options["OUTPUT_HEADER"]
-        tbl.border = options["OUTPUT_BORDER"]
-        tbl.header_style = options["HEADER_STYLE"]
-        if options["PAGER"] is True:
-            # We aren't using the rich format, just the pager
-            with console.pager():
-                console.print(str(tbl))
-        else:
-            print(tbl)
-        of.write_cache(str(tbl), options)
-        if options["ARGS"].output is not None:
-            of.write_output_file(str(tbl), options)
-
-
-def rich_output(headers: Iterable, options: Dict) -> None:
-    """Send output to the rich console"""
-    records = options["CURSOR"].fetchall()
-    table = Table()
-    for head in headers:
-        table.add_column(head[0])
-    for rec in records:
-        # We don't support writing rich out to output file
-        # We have to map str on to rec tuple and then unpack it
-        table.add_row(*map(str, rec))
-    of.write_cache(str(table), options)
-    if options["PAGER"] is True:
-        with console.pager():
-            console.print(table)
+def render(headers: List, options: Dict, cached: Optional[Iterator] = None) -> None:
+    """Hand the result set to the renderer for the current settings,
+    cached holds batches from the result cache instead of the cursor"""
+    if options["OUTPUT_CSV"] is True or ex.output_format(options) != "text":
+        export_output(headers, cached or stream_batches(options), options)
+    elif use_lazy_pager(options):
+        paged = lazy_output(headers, cached or fetch_batches(options), options)
+        if paged is False and cached is None:
+            skip_rows(options)
+    elif options["OUTPUT_METHOD"] == "pretty":
+        pretty_output(headers, cached or result_batches(options), options)
+    elif options["OUTPUT_METHOD"] == "rich":
+        rich_output(headers, cached or result_batches(options), options)
     else:
-        console.print(table)
+        record_output(headers, cached or result_batches(options), options)
 
 
-def default_output(options: Dict) -> None:
-    """Just print the column name and value for each result"""
-    headers = options["CURSOR"].description
-    records = options["CURSOR"].fetchall()
-    buffer = ""
-    row_sep = "-----------------------------"
-    for rec in records:
-        for i, value in enumerate(rec):
-            if options["PAGER"] is True:
-                # We have to buffer to use the pager
-                buffer += f"{headers[i][0]} :: {value}\n"
+def fetch(options: Dict, size: int = 0) -> List:
+    """Fetch size rows from the cursor, or all of them for 0,
+    timing the fetch and counting the rows"""
+    with tm.phase(options, "fetch"):
+        try:
+            if size == 0:
+                rows = options["CURSOR"].fetchall()
             else:
-                print(f"{headers[i][0]} :: {value}")
-            if options["ARGS"].output is not None:
-                of.write_output_file(f"{headers[i][0]} :: {value}\n", options)
-        # Write the row boundary marker
-        if options["PAGER"] is True:
-            buffer += row_sep + "\n"
-        else:
-            print(row_sep)
-        if options["ARGS"].output is not None:
-            of.write_output_file(row_sep + "\n", options)
+                rows = options["CURSOR"].fetchmany(size)
+        except Exception:
+            if options["SIG_INT"] is False:
+                raise
+            # Cancelled part way, end the result set with what we have
+            # and don't let the query cache keep it
+            rows = []
+            options["PARTIAL"] = True
+            options["QCACHE_KEY"] = None
+    tm.count_rows(options, len(rows))
+    rc.add(options, rows)
+    qc.capture(options, rows, size == 0 or not rows)
+    return rows
+
+
+def fetch_batches(options: Dict) -> Iterator[List]:
+    """Pull the results from the cursor FETCH_SIZE rows at a time,
+    stopping at ROW_LIMIT rows when there is one"""
+    limit = options["ROW_LIMIT"]
+    left = limit
+    prefetch = options.pop("PREFETCH", [])
+    if prefetch:
+        # This was fetched before the cache entry was opened
+        rc.add(options, prefetch)
+        qc.capture(options, prefetch, False)
+        left -= len(prefetch)
+        yield prefetch
+    while True:
+        size = options["FETCH_SIZE"]
+        if limit > 0:
+            if left <= 0:
+                with tm.phase(options, "fetch"):
+                    options["MORE_ROWS"] = pv.more_rows(options)
+                if options["MORE_ROWS"] is True:
+                    pv.abandon(options)
+                break
+            size = min(size, left)
+        batch = fetch(options, size)
+        if not batch:
+            break
+        left -= len(batch)
+        yield batch
+
+
+def stream_batches(options: Dict) -> Iterator[List]:
+    """FETCH_SIZE batches fetched on a reader thread, so the server and
+    network wait overlaps with rendering or writing the earlier batches.
+    Time spent waiting on the reader is its own phase, so it isn't
+    counted again in the render or file phase around us"""
+    batches = pl.background(fetch_batches(options), options["PIPELINE_DEPTH"])
+    try:
+        while True:
+            with tm.phase(options, "fetch_wait"):
+                batch = next(batches, None)
+            if batch is None:
+                return
+            yield batch
+    finally:
+        # Stop the reader now if the renderer stopped early
+        batches.close()
+
+
+def result_batches(options: Dict) -> Iterator[List]:
+    """Hand the renderers the result set as it is fetched.
+    We always yield at least one batch so the headers get printed"""
+    empty = True
+    for batch in stream_batches(options):
+        empty = False
+        yield batch
+    if empty:
+        yield []
+
 
-    if options["PAGER"] is True:
-        # We aren't using the rich format, just the pager
+def use_lazy_pager(options: Dict) -> bool:
+    """The built in pager only fetches what you page through, so it
+    can't be used when everything must go to an output file, or when
+    there is no terminal to page on"""
+    return (
+        options["PAGER"] is True
+        and options["PAGER_TYPE"] == "lazy"
+        and options["ARGS"].output is None
+        and sys.stdin.isatty()
+        and sys.stdout.isatty()
+    )
+
+
+def lazy_output(headers: Iterable, batches: Iterator[List], options: Dict) -> bool:
+    """Page the results with the built in pager, fetching as we go,
+    False if we quit before the last row"""
+    headers = list(headers)
+    if options["OUTPUT_METHOD"] == "pretty":
+        header, lines = pg.table_lines(
+            headers, batches, options, options["OUTPUT_STYLE"]
+        )
+    elif options["OUTPUT_METHOD"] == "rich":
+        header, lines = pg.table_lines(headers, batches, options, "RICH")
+    else:
+        header, lines = [], pg.record_lines(headers, batches, options)
+    return pg.page(header, lines)
+
+
+def skip_rows(options: Dict) -> None:
+    """Read and drop the rows we quit the pager before, MYSQL won't
+    run another statement until they are read"""
+    if options["ARGS"].servertype != "MYSQL":
+        return
+    with tm.phase(options, "fetch"):
+        while options["CURSOR"].fetchmany(options["FETCH_SIZE"]):
+            pass
+
+
+def export_output(headers: Iterable, batches: Iterator[List], options: Dict) -> None:
+    """Stream the output to the output file in csv or one of the
+    export formats without holding the result set"""
+    if options["ARGS"].output is None:
+        print("No output file defined")
+        return
+
+    fmt = ex.output_format(options)
+    path = ex.export_path(options, fmt)
+    # Parquet and arrow files are replaced rather than added to
+    before = 0 if fmt in ("parquet", "arrow") else ex.file_size(path)
+    start = time.perf_counter()
+    with tm.phase(options, "file"):
+        rows = ex.export(list(headers), batches, options, fmt)
+    elapsed = time.perf_counter() - start
+    written = ex.file_size(path) - before
+    if fmt != "csv":
+        tm.count_bytes(options, written)
+    of.get_console().print("Output written to output file", style="b r")
+    if options["ARGS"].quiet is not True:
+        rate = rows / elapsed if elapsed > 0 else 0
+        of.write_logfile(
+            f"Rows written = {rows}\tBytes written = {written}"
+            f"\tFormat = {fmt}\tRows/sec = {rate:.0f}",
+            options,
+        )
+
+
+def text_output(chunks: Iterator[str], options: Dict, to_file: bool) -> None:
+    """Print the rendered text and write the same text to the output file"""
+    if options["PAGER"] is True and options["LARGE_RESULTS"] is False:
+        # We have to hold it all to use the pager
+        text = "\n".join(chunks)
+        console = of.get_console()
         with console.pager():
-            console.print(buffer)
+            console.print(text, markup=False, highlight=False)
+        if to_file:
+            write_text(text, options)
+        return
+    for chunk in chunks:
+        sys.stdout.write(chunk + "\n")
+        if to_file:
+            write_text(chunk, options)
+    sys.stdout.flush()
+
+
+def write_text(chunk: str, options: Dict) -> None:
+    """Append a block of rendered lines to the output file"""
+    with tm.phase(options, "file"), open(
+        options["ARGS"].output, "a", encoding="utf-8", buffering=options["WRITE_BUFFER"]
+    ) as outfile:
+        tm.count_bytes(options, outfile.write(chunk + "\n"))
+
+
+def pretty_output(headers: Iterable, batches: Iterator[List], options: Dict) -> None:
+    """Send output to pretty printer, in large result mode each batch
+    is printed as it arrives"""
+    chunks = tt.table_text(
+        list(headers),
+        batches,
+        options,
+        options["OUTPUT_STYLE"],
+        options["LARGE_RESULTS"],
+    )
+    text_output(chunks, options, options["ARGS"].output is not None)
+
+
+def rich_output(headers: Iterable, batches: Iterator[List], options: Dict) -> None:
+    """Draw the table in rich's box, we don't support writing rich
+    out to the output file"""
+    chunks = tt.table_text(
+        list(headers), batches, options, "RICH", options["LARGE_RESULTS"]
+    )
+    text_output(chunks, options, False)
+
+
+def record_output(headers: Iterable, batches: Iterator[List], options: Dict) -> None:
+    """Just print the column name and value for each result"""
+    chunks = tt.record_text(list(headers), batches, options)
+    text_output(chunks, options, options["ARGS"].output is not None)
+
+
+def describe(names: List) -> List:
+    """A cursor style description for results that come from a cache"""
+    return [(name, None, None, None, None, None, None) for name in names]
+
+
+def render_cached(options: Dict, entry: Dict) -> None:
+    """Re-render a result set from the cache"""
+    headers = describe(entry["names"])
+    large = options["LARGE_RESULTS"]
+    # Render it in the shape it was fetched in
+    options["LARGE_RESULTS"] = entry["large"]
+    batches = rc.read(entry)
+    if entry["large"] is False:
+        batches = iter([[rec for batch in batches for rec in batch]])
+    try:
+        render(headers, options, batches)
+    finally:
+        options["LARGE_RESULTS"] = large
+
+
+def query_cache_output(options: Dict, entry: Dict) -> None:
+    """Serve the query from the query cache instead of the server"""
+    age = time.time() - entry["time"]
+    of.write_logfile(
+        f"** Cached result, age {age:.1f}s, ttl {entry['ttl']}s **", options
+    )
+    limit = options["ROW_LIMIT"]
+    for number, (names, rows) in enumerate(qc.result_sets(entry)):
+        options["EXPORT_SET"] = number
+        if limit > 0 and len(rows) > limit:
+            rows = rows[:limit]
+            options["MORE_ROWS"] = True
+        tm.count_rows(options, len(rows))
+        render(describe(names), options, iter([rows]))
+        if options["MORE_ROWS"] is True:
+            break
+    options["EXPORT_SET"] = 0
+
+
+def prime_cursor(options: Dict) -> None:
+    """A PSQL named cursor doesn't describe its results until the
+    first fetch, so we pull the first batch and hold on to it"""
+    if options["CURSOR"].description is None and getattr(
+        options["CURSOR"], "name", None
+    ):
+        size = options["FETCH_SIZE"]
+        if options["ROW_LIMIT"] > 0:
+            size = min(size, options["ROW_LIMIT"])
+        options["PREFETCH"] = fetch(options, size)
+
+
+def discard_output(options: Dict) -> None:
+    """Fetch everything and throw it away to time the server and network"""
+    rows = 0
+    while options["CURSOR"].description is not None:
+        for batch in fetch_batches(options):
+            rows += len(batch)
+        if options["ARGS"].servertype != "MSSQL" or not options["CURSOR"].nextset():
+            break
+    print(f"Rows discarded = {rows}")
+
+
+def more_rows_note(options: Dict) -> None:
+    """Tell the user the result was cut short"""
+    if options["MORE_ROWS"] is True:
+        of.write_logfile(
+            f"** First {options['ROW_LIMIT']} rows shown, more rows available **",
+            options,
+        )
+
+
+def limit_rows(options: Dict) -> str:
+    """Set the row limit for this execution, returns the sql to run,
+    with the limit added to it when pushdown is on"""
+    sql = options["SQL_BUFFER"]
+    options["MORE_ROWS"] = False
+    options["ROW_LIMIT_PUSHED"] = False
+    options["ROW_LIMIT"] = pv.row_limit(options) if st.returns_rows(sql) else 0
+    if options["ROW_LIMIT"] > 0 and options["ROW_PUSHDOWN"] is True:
+        # One extra row tells us if there are more
+        pushed = pv.push_down(
+            sql, options["ARGS"].servertype, options["ROW_LIMIT"] + 1
+        )
+        if pushed is not None:
+            options["ROW_LIMIT_PUSHED"] = True
+            sql = pushed
+    return sql
 
 
 def submit_query(options: Dict) -> None:
     """A basic query execution function"""
-    values = sv.analyze_query(options)
+    tm.start_query(options)
+    with tm.phase(options, "substitute"):
+        values = sv.analyze_query(options)
     of.write_logfile(options["SQL_BUFFER"], options, no_print=True)
+    sql = limit_rows(options)
+    cached = qc.check(options, options["SQL_BUFFER"], values)
+    if cached is not None:
+        with tm.phase(options, "render"):
+            query_cache_output(options, cached)
+        more_rows_note(options)
+        options["ROW_LIMIT"] = 0
+        tm.finish_query(options)
+        jr.record(options, options["SQL_BUFFER"], cached=True)
+        return
+    sx.begin(options)
+    base_cursor = options["CURSOR"]
+    if options["LARGE_RESULTS"] is True:
+        options["CURSOR"] = cn.large_cursor(options, sql)
+    elif options["ROW_LIMIT"] > 0 and options["ROW_LIMIT_PUSHED"] is False:
+        # Stream it, so we can leave the rows we don't show on the server
+        options["CURSOR"] = pv.open_cursor(options, sql)
     start = time.perf_counter()
+    error = None
+    options["QUERY_RUNNING"] = True
     try:
-        if not values:
-            options["CURSOR"].execute(options["SQL_BUFFER"])
-        else:
-            # We found variables that needed to be substituted
-            options["CURSOR"].execute(options["SQL_BUFFER"], values)
+        with tm.phase(options, "execute"):
+            ps.execute(options, sql, values)
+        if st.changes_session(options["SQL_BUFFER"]):
+            cn.mark_session(options)
+        if options["CURSOR"] is not base_cursor:
+            prime_cursor(options)
         querystop = time.perf_counter()
 
-        if (
-            options["OUTPUT_CSV"] is True
-            or options["OUTPUT_METHOD"] == "pretty"
-            or options["OUTPUT_METHOD"] == "rich"
-        ):
-            formatted_output(options)
-        else:
-            default_output(options)
+        # Fetching, cache and file writes inside are timed on their own
+        with tm.phase(options, "render"):
+            if options["GO_DISCARD"] is True:
+                discard_output(options)
+            else:
+                formatted_output(options)
+        qc.store(options)
+        more_rows_note(options)
+        if options.pop("PARTIAL", False):
+            of.write_logfile(
+                "Query cancelled, showing the rows fetched so far", options
+            )
 
         if options["ARGS"].quiet is not True:
             final = time.perf_counter()
@@ -145,9 +411,37 @@ def submit_query(options: Dict) -> None:
                 options,
             )
     except Exception as err:
-        # We have to be generic because we support multiple DBMS libraries
-        of.write_logfile(f"Error: {err}", options, iserr=True)
-        of.write_logfile(
-            f"Error generated by {options['SQL_BUFFER']}", options, iserr=True
-        )
-        options["ERROR"] = True
+        options["QCACHE_KEY"] = None
+        error = "Cancelled" if options["SIG_INT"] is True else str(err).strip()
+        if options["SIG_INT"] is True:
+            of.write_logfile("Query cancelled", options)
+        else:
+            # We have to be generic because we support multiple DBMS libraries
+            of.write_logfile(f"Error: {err}", options, iserr=True)
+            of.write_logfile(
+                f"Error generated by {options['SQL_BUFFER']}", options, iserr=True
+            )
+            options["ERROR"] = True
+            cn.mark_session(options)
+    finally:
+        options["QUERY_RUNNING"] = False
+        options.pop("PARTIAL", None)
+        if options["CURSOR"] is not base_cursor:
+            # Release the server side cursor and go back to our own,
+            # a prepared cursor stays open in the statement cache
+            options.pop("PREFETCH", None)
+            if options.pop("PREPARED_CURSOR", False) is False:
+                try:
+                    options["CURSOR"].close()
+                except Exception as err:
+                    of.write_logfile(f"Error: {err}", options, no_print=True)
+            options["CURSOR"] = base_cursor
+        pv.finish(options)
+        sx.end(options, error is None)
+        options["ROW_LIMIT"] = 0
+        # Keep whatever we fetched before an error
+        rc.finish(options)
+        tm.finish_query(options)
+        jr.record(options, options["SQL_BUFFER"], error)
+        if options["SIG_INT"] is True:
+            cx.after_cancel(options)
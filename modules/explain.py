@@ -0,0 +1,533 @@
+""" explain [analyze], capture the plan of the buffer the way each server
+offers it, turn it in to a tree and show where the time goes """
+import json
+import re
+import time
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import modules.connection as cn
+import modules.output_fun as of
+import modules.process_input as pi
+import modules.sql_text as st
+import modules.substitute_vars as sv
+
+# How many of the most expensive nodes are highlighted
+HOT_NODES = 3
+
+# Estimated rows this many times out from the actual rows is a miss
+MISS_RATIO = 10.0
+
+# Longest condition shown beside a node
+DETAIL_CHARS = 60
+
+# Statements a rollback undoes everywhere.  MYSQL and ORACLE commit
+# anything else (DDL) as they run it
+DML_KEYWORDS = {
+    "select",
+    "with",
+    "values",
+    "table",
+    "insert",
+    "update",
+    "delete",
+    "merge",
+    "replace",
+}
+
+# The MSSQL showplan namespace and the name of the result set holding it
+SHOWPLAN_NS = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+SHOWPLAN_COLUMN = "Microsoft SQL Server 2005 XML Showplan"
+
+# PSQL keys holding a node's condition, the first one found is shown
+PSQL_DETAILS = (
+    "Index Cond",
+    "Hash Cond",
+    "Merge Cond",
+    "Join Filter",
+    "Recheck Cond",
+    "Filter",
+    "Sort Key",
+    "Group Key",
+)
+
+# A line of MYSQL's EXPLAIN ANALYZE tree
+MYSQL_TREE_RE = re.compile(
+    r"^(?P<indent> *)-> (?P<label>.*?)"
+    r"(?: +\(cost=(?P<cost>[\d.e+]+) rows=(?P<rows>[\d.e+]+)\))?"
+    r"(?: +\(actual time=[\d.e+]+\.\.(?P<time>[\d.e+]+)"
+    r" rows=(?P<actual>[\d.e+]+) loops=(?P<loops>\d+)\))?"
+    r"(?: +\(never executed\))?$"
+)
+
+ORACLE_PLAN_SQL = (
+    "select id, parent_id, operation, options, object_name, cost, cardinality"
+    " from plan_table where statement_id = :id order by id"
+)
+
+ORACLE_STATS_SQL = (
+    "select id, parent_id, operation, options, object_name, cost, cardinality,"
+    " last_output_rows, last_elapsed_time, last_starts"
+    " from v$sql_plan_statistics_all where sql_id = :sql_id"
+    " and child_number = :child order by id"
+)
+
+
+def new_node(label: str) -> Dict:
+    """A plan node, cost and time include the node's children"""
+    return {
+        "label": label,
+        "detail": "",
+        "cost": None,
+        "rows": None,  # Estimated rows per loop
+        "actual": None,  # Actual rows per loop
+        "loops": None,
+        "time": None,  # Milliseconds
+        "children": [],
+    }
+
+
+def number(value: Any) -> Optional[float]:
+    """The value as a float, None when it isn't there"""
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def tree_from_parents(rows: List[Tuple], build: Any) -> List[Dict]:
+    """Nodes from (id, parent id, ...) rows, returns the roots"""
+    nodes = {}
+    roots = []
+    for row in rows:
+        nodes[row[0]] = build(row)
+    for row in rows:
+        parent = nodes.get(row[1])
+        if parent is None or row[1] == row[0]:
+            roots.append(nodes[row[0]])
+        else:
+            parent["children"].append(nodes[row[0]])
+    return roots
+
+
+def psql_node(plan: Dict) -> Dict:
+    """A node from EXPLAIN (FORMAT JSON)"""
+    label = plan["Node Type"]
+    if "Join Type" in plan and plan["Join Type"] != "Inner":
+        label += f" ({plan['Join Type']})"
+    if "Relation Name" in plan:
+        label += f" on {plan['Relation Name']}"
+        if plan.get("Alias", plan["Relation Name"]) != plan["Relation Name"]:
+            label += f" {plan['Alias']}"
+    if "Index Name" in plan:
+        label += f" using {plan['Index Name']}"
+    node = new_node(label)
+    node["detail"] = next((plan[key] for key in PSQL_DETAILS if key in plan), "")
+    if isinstance(node["detail"], list):
+        node["detail"] = ", ".join(node["detail"])
+    node["cost"] = number(plan.get("Total Cost"))
+    node["rows"] = number(plan.get("Plan Rows"))
+    if "Actual Loops" in plan:
+        node["loops"] = plan["Actual Loops"]
+        node["actual"] = number(plan.get("Actual Rows"))
+        node["time"] = (plan.get("Actual Total Time") or 0.0) * plan["Actual Loops"]
+        if plan.get("Shared Read Blocks"):
+            read = f"read={plan['Shared Read Blocks']}"
+            node["detail"] = f"{read} {node['detail']}".strip()
+    node["children"] = [psql_node(child) for child in plan.get("Plans", [])]
+    return node
+
+
+def psql_plan(cursor: Any, sql: str, values: Any, analyze: bool) -> List[Dict]:
+    """EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)"""
+    wrapper = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    execute(cursor, f"EXPLAIN ({wrapper}) {sql}", values)
+    doc = cursor.fetchall()[0][0]
+    if isinstance(doc, str):
+        doc = json.loads(doc)
+    roots = []
+    for item in doc:
+        root = psql_node(item["Plan"])
+        if "Execution Time" in item:
+            root["detail"] = (
+                f"planning {item.get('Planning Time', 0):.3f}ms"
+                f" execution {item['Execution Time']:.3f}ms"
+            )
+        roots.append(root)
+    return roots
+
+
+def mssql_children(elem: ET.Element) -> Iterator[ET.Element]:
+    """The RelOps directly under this one, they are wrapped in
+    operator specific elements"""
+    for child in elem:
+        if child.tag == f"{SHOWPLAN_NS}RelOp":
+            yield child
+        else:
+            yield from mssql_children(child)
+
+
+def mssql_node(relop: ET.Element) -> Dict:
+    """A node from a showplan RelOp"""
+    label = relop.get("PhysicalOp", "")
+    if relop.get("LogicalOp") not in (None, label):
+        label += f" ({relop.get('LogicalOp')})"
+    # The object read is in the operator element, not in a child RelOp
+    for child in relop:
+        found = child.find(f"{SHOWPLAN_NS}Object")
+        if found is not None:
+            label += " on " + ".".join(
+                found.get(part, "").strip("[]")
+                for part in ("Table", "Index")
+                if found.get(part)
+            )
+            break
+    node = new_node(label)
+    node["cost"] = number(relop.get("EstimatedTotalSubtreeCost"))
+    node["rows"] = number(relop.get("EstimateRows"))
+    threads = relop.findall(f"{SHOWPLAN_NS}RunTimeInformation/")
+    if threads:
+        executions = sum(int(item.get("ActualExecutions", 0)) for item in threads)
+        rows = sum(int(item.get("ActualRows", 0)) for item in threads)
+        node["loops"] = executions
+        node["actual"] = rows / executions if executions else 0.0
+        elapsed = [number(item.get("ActualElapsedms")) for item in threads]
+        if any(value is not None for value in elapsed):
+            node["time"] = max(value or 0.0 for value in elapsed)
+    node["children"] = [mssql_node(child) for child in mssql_children(relop)]
+    return node
+
+
+def mssql_roots(showplan: str) -> List[Dict]:
+    """A tree for each statement in the showplan xml"""
+    roots = []
+    for stmt in ET.fromstring(showplan).iter(f"{SHOWPLAN_NS}StmtSimple"):
+        root = new_node(" ".join(stmt.get("StatementText", "").split())[:80])
+        plan = stmt.find(f"{SHOWPLAN_NS}QueryPlan")
+        if plan is not None:
+            root["children"] = [mssql_node(child) for child in mssql_children(plan)]
+        roots.append(root)
+    return roots
+
+
+def mssql_plan(cursor: Any, sql: str, values: Any, analyze: bool) -> List[Dict]:
+    """SET SHOWPLAN_XML estimates the plan, STATISTICS XML runs it"""
+    setting = "STATISTICS XML" if analyze else "SHOWPLAN_XML"
+    cursor.execute(f"SET {setting} ON")
+    plans = []
+    try:
+        execute(cursor, sql, values)
+        while True:
+            if cursor.description is not None:
+                rows = cursor.fetchall()
+                if cursor.description[0][0] == SHOWPLAN_COLUMN:
+                    plans.extend(row[0] for row in rows)
+            if not cursor.nextset():
+                break
+    finally:
+        cursor.execute(f"SET {setting} OFF")
+    return [root for plan in plans for root in mssql_roots(plan)]
+
+
+def mysql_node(label: str, block: Dict) -> Dict:
+    """A node from EXPLAIN FORMAT=JSON, every nested block becomes
+    a child, tables are the leaves that carry the costs"""
+    info = block.get("cost_info", {})
+    if "table_name" in block:
+        label = f"{block.get('access_type', 'table')} {block['table_name']}"
+        if block.get("key"):
+            label += f" using {block['key']}"
+    elif "select_id" in block:
+        label = f"{label} #{block['select_id']}"
+    node = new_node(label.replace("_", " "))
+    node["detail"] = block.get("attached_condition", "")
+    node["rows"] = number(block.get("rows_examined_per_scan"))
+    if "query_cost" in info:
+        node["cost"] = number(info["query_cost"])
+    elif "read_cost" in info:
+        node["cost"] = (number(info["read_cost"]) or 0.0) + (
+            number(info.get("eval_cost")) or 0.0
+        )
+    for key, value in block.items():
+        if key == "cost_info":
+            continue
+        if isinstance(value, dict):
+            node["children"].append(mysql_node(key, value))
+        elif isinstance(value, list) and value and isinstance(value[0], dict):
+            group = new_node(key.replace("_", " "))
+            for item in value:
+                for name, inner in item.items():
+                    if isinstance(inner, dict):
+                        group["children"].append(mysql_node(name, inner))
+            node["children"].append(group)
+    return node
+
+
+def mysql_tree(text: str) -> List[Dict]:
+    """Nodes from EXPLAIN ANALYZE's indented tree"""
+    roots: List[Dict] = []
+    stack: List[Tuple[int, Dict]] = []
+    for line in text.splitlines():
+        match = MYSQL_TREE_RE.match(line)
+        if match is None:
+            continue
+        node = new_node(match["label"])
+        node["cost"] = number(match["cost"])
+        node["rows"] = number(match["rows"])
+        if match["loops"] is not None:
+            node["loops"] = int(match["loops"])
+            node["actual"] = number(match["actual"])
+            node["time"] = (number(match["time"]) or 0.0) * node["loops"]
+        depth = len(match["indent"])
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if stack:
+            stack[-1][1]["children"].append(node)
+        else:
+            roots.append(node)
+        stack.append((depth, node))
+    return roots
+
+
+def mysql_plan(cursor: Any, sql: str, values: Any, analyze: bool) -> List[Dict]:
+    """EXPLAIN FORMAT=JSON, or EXPLAIN ANALYZE's tree"""
+    if analyze:
+        execute(cursor, f"EXPLAIN ANALYZE {sql}", values)
+        return mysql_tree("\n".join(row[0] for row in cursor.fetchall()))
+    execute(cursor, f"EXPLAIN FORMAT=JSON {sql}", values)
+    doc = json.loads(cursor.fetchall()[0][0])
+    return [mysql_node("query_block", doc["query_block"])]
+
+
+def oracle_node(row: Tuple) -> Dict:
+    """A node from a plan_table or v$sql_plan_statistics_all row"""
+    label = " ".join(part for part in row[2:5] if part)
+    node = new_node(label)
+    node["cost"] = number(row[5])
+    node["rows"] = number(row[6])
+    if len(row) > 7 and row[9]:
+        node["loops"] = row[9]
+        node["actual"] = (row[7] or 0) / row[9]
+        node["time"] = (row[8] or 0) / 1000.0
+    return node
+
+
+def oracle_plan(cursor: Any, sql: str, values: Any, analyze: bool) -> List[Dict]:
+    """EXPLAIN PLAN in to the plan table, or run it with row source
+    statistics on, the same sources DBMS_XPLAN formats"""
+    if not analyze:
+        statement_id = f"isql_{int(time.time() * 1000)}"
+        cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {sql}")
+        try:
+            cursor.execute(ORACLE_PLAN_SQL, {"id": statement_id})
+            return tree_from_parents(cursor.fetchall(), oracle_node)
+        finally:
+            cursor.execute(
+                "delete from plan_table where statement_id = :id", {"id": statement_id}
+            )
+
+    cursor.execute("alter session set statistics_level = all")
+    try:
+        execute(cursor, sql, values)
+        if cursor.description is not None:
+            cursor.fetchall()
+        cursor.execute(
+            "select prev_sql_id, prev_child_number from v$session"
+            " where sid = sys_context('userenv', 'sid')"
+        )
+        sql_id, child = cursor.fetchall()[0]
+        cursor.execute(ORACLE_STATS_SQL, {"sql_id": sql_id, "child": child})
+        return tree_from_parents(cursor.fetchall(), oracle_node)
+    finally:
+        cursor.execute("alter session set statistics_level = typical")
+
+
+def sqlite_plan(cursor: Any, sql: str, values: Any, analyze: bool) -> List[Dict]:
+    """EXPLAIN QUERY PLAN, analyze runs the query to time it and
+    count its rows since sqlite doesn't give per node figures"""
+    execute(cursor, f"EXPLAIN QUERY PLAN {sql}", values)
+    root = new_node("QUERY PLAN")
+    root["children"] = tree_from_parents(
+        [(row[0], row[1], row[3]) for row in cursor.fetchall()],
+        lambda row: new_node(row[2]),
+    )
+    if analyze:
+        start = time.perf_counter()
+        execute(cursor, sql, values)
+        rows = len(cursor.fetchall()) if cursor.description is not None else 0
+        root["time"] = (time.perf_counter() - start) * 1000
+        root["actual"] = float(rows)
+        root["loops"] = 1
+    return [root]
+
+
+PLANNERS = {
+    "PSQL": psql_plan,
+    "MSSQL": mssql_plan,
+    "MYSQL": mysql_plan,
+    "ORACLE": oracle_plan,
+    "SQLITE": sqlite_plan,
+}
+
+
+def execute(cursor: Any, sql: str, values: Union[Dict, Tuple]) -> None:
+    """Execute with the buffer's variables when it has any"""
+    if not values:
+        cursor.execute(sql)
+    else:
+        cursor.execute(sql, values)
+
+
+def totals(node: Dict) -> None:
+    """Fill in the inclusive cost of nodes without one and work out each
+    node's own cost and time, what's left after its children"""
+    for child in node["children"]:
+        totals(child)
+    for key in ("cost", "time"):
+        below = sum(child[key] or 0.0 for child in node["children"])
+        if node[key] is None and node["children"]:
+            node[key] = below if any(
+                child[key] is not None for child in node["children"]
+            ) else None
+        node[f"self_{key}"] = max((node[key] or 0.0) - below, 0.0)
+
+
+def walk(nodes: List[Dict]) -> Iterator[Dict]:
+    """Every node in the trees"""
+    for node in nodes:
+        yield node
+        yield from walk(node["children"])
+
+
+def hot_nodes(roots: List[Dict]) -> Tuple[str, Dict[int, float]]:
+    """The measure we rank by and the share of it taken by each of the
+    most expensive nodes, by id"""
+    nodes = list(walk(roots))
+    timed = any(node["time"] is not None for node in nodes)
+    key = "self_time" if timed else "self_cost"
+    total = sum(node[key] for node in nodes)
+    if total <= 0:
+        return key, {}
+    ranked = [node for node in nodes if node[key] > 0]
+    if len(ranked) < 2:
+        # One node with figures, all of it is in that node
+        return key, {}
+    ranked.sort(key=lambda node: node[key], reverse=True)
+    return key, {id(node): node[key] / total for node in ranked[:HOT_NODES]}
+
+
+def miss(node: Dict) -> Optional[float]:
+    """How far out the row estimate was, None when it wasn't a miss"""
+    if node["rows"] is None or node["actual"] is None or not node["loops"]:
+        return None
+    high = max(node["rows"], node["actual"])
+    low = max(min(node["rows"], node["actual"]), 1.0)
+    ratio = high / low
+    return ratio if ratio >= MISS_RATIO else None
+
+
+def node_text(node: Dict, hot: Dict[int, float], key: str) -> Any:
+    """The label and figures for a node, hot nodes in red and
+    estimate misses in yellow"""
+    from rich.text import Text
+
+    share = hot.get(id(node))
+    text = Text(node["label"], style="bold red" if share is not None else "bold")
+    figures = []
+    if node["cost"] is not None:
+        figures.append(f"cost={node['cost']:.2f}")
+    if node["rows"] is not None:
+        figures.append(f"rows={node['rows']:g}")
+    if node["actual"] is not None:
+        figures.append(f"actual={node['actual']:g}")
+    if node["loops"] not in (None, 1):
+        figures.append(f"loops={node['loops']}")
+    if node["time"] is not None:
+        figures.append(f"time={node['time']:.3f}ms")
+    if figures:
+        text.append("  " + " ".join(figures), style="cyan")
+    if share is not None:
+        measure = "time" if key == "self_time" else "cost"
+        text.append(f"  {share * 100:.0f}% of {measure}", style="bold red")
+    ratio = miss(node)
+    if ratio is not None:
+        text.append(f"  rows estimate off x{ratio:.0f}", style="bold yellow")
+    if node["detail"]:
+        text.append(f"  {str(node['detail'])[:DETAIL_CHARS]}", style="dim")
+    return text
+
+
+def render_plan(roots: List[Dict]) -> None:
+    """Print the plan trees with rich"""
+    from rich.tree import Tree
+
+    for root in roots:
+        totals(root)
+    key, hot = hot_nodes(roots)
+
+    def add(branch: Any, node: Dict) -> None:
+        for child in node["children"]:
+            add(branch.add(node_text(child, hot, key)), child)
+
+    for root in roots:
+        tree = Tree(node_text(root, hot, key), guide_style="dim")
+        add(tree, root)
+        of.get_console().print(tree)
+
+
+def plan(options: Dict, analyze: bool) -> List[Dict]:
+    """Capture the plan of the buffer.  Analyze runs the statement,
+    anything that may write is rolled back afterwards"""
+    servertype = options["ARGS"].servertype
+    buffer = options["SQL_BUFFER"]
+    try:
+        values = sv.analyze_query(options)
+        sql = options["SQL_BUFFER"].strip().rstrip(";")
+    finally:
+        # Leave the buffer as it was for the go that usually follows
+        options["SQL_BUFFER"] = buffer
+        options["BIND_VALUES"] = None
+
+    writes = analyze and not st.is_read_only(sql)
+    if writes and servertype in ("MYSQL", "ORACLE"):
+        if st.first_keyword(sql) not in DML_KEYWORDS:
+            raise ValueError(
+                f"explain analyze would run this on {servertype} and it commits"
+                " as it runs, only the plan can be shown"
+            )
+    cursor = options["CONN"].cursor()
+    if writes:
+        cn.set_autocommit(options["CONN"], servertype, False)
+        if servertype == "SQLITE" and not options["CONN"].in_transaction:
+            # sqlite3 only opens a transaction itself for DML, not DDL
+            cursor.execute("BEGIN")
+    try:
+        return PLANNERS[servertype](cursor, sql, values, analyze)
+    finally:
+        if writes:
+            options["CONN"].rollback()
+            cn.set_autocommit(options["CONN"], servertype, True)
+        cursor.close()
+
+
+def explain_command(options: Dict, tokens: List) -> None:
+    """explain [analyze], show the plan of the buffer.  A line that
+    goes on to more sql is part of the buffer instead"""
+    words = [token for token in tokens[1:] if token != ""]
+    if len(words) > 1 or (words and words[0].lower() != "analyze"):
+        pi.process_input(options, tokens)
+        return
+    if options["SQL_BUFFER"].strip() == "":
+        print("Nothing in the buffer to explain")
+        return
+    if options["ARGS"].servertype not in PLANNERS:
+        print(f"explain doesn't support {options['ARGS'].servertype}")
+        return
+    try:
+        roots = plan(options, bool(words))
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        of.write_logfile(f"Error: {err}", options, iserr=True)
+        return
+    if not roots:
+        print("The server didn't return a plan")
+        return
+    render_plan(roots)
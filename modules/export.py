@@ -0,0 +1,293 @@
+""" Write result sets to the output file in columnar, line or
+compressed formats, streaming the batches as they are fetched """
+import csv
+import datetime
+import decimal
+import gzip
+import io
+import itertools
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, TextIO
+import modules.column_types as ct
+import modules.output_fun as of
+
+# File extensions we recognise when FORMAT is auto
+EXTENSIONS = (
+    (".csv.gz", "csv.gz"),
+    (".gz", "csv.gz"),
+    (".csv.zst", "csv.zst"),
+    (".zst", "csv.zst"),
+    (".csv", "csv"),
+    (".jsonl", "jsonl"),
+    (".ndjson", "jsonl"),
+    (".parquet", "parquet"),
+    (".arrow", "arrow"),
+    (".feather", "arrow"),
+    (".ipc", "arrow"),
+)
+
+FORMATS = ("auto", "text", "csv", "csv.gz", "csv.zst", "jsonl", "parquet", "arrow")
+
+
+def output_format(options: Dict) -> str:
+    """Decide how the output file is written, text is the
+    original rendered table output"""
+    if options["ARGS"].output is None:
+        return "text"
+    fmt = options["EXPORT_FORMAT"]
+    if fmt == "auto":
+        fmt = "text"
+        name = options["ARGS"].output.lower()
+        for ext, ext_fmt in EXTENSIONS:
+            if name.endswith(ext):
+                fmt = ext_fmt
+                break
+    if fmt == "text" and options["OUTPUT_CSV"] is True:
+        fmt = "csv"
+
+    return fmt
+
+
+def open_compressed(path: str, fmt: str, options: Dict) -> TextIO:
+    """Open a text stream on to a gzip or zstd compressed file"""
+    if fmt == "csv.gz":
+        return gzip.open(path, "at", encoding="utf-8")
+    try:
+        import zstandard
+    except ImportError as err:
+        raise RuntimeError("zstd output needs the zstandard module") from err
+    raw = open(path, "ab", buffering=options["WRITE_BUFFER"])
+    writer = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+    return io.TextIOWrapper(writer, encoding="utf-8")
+
+
+def write_csv(
+    path: str, names: List, batches: Iterator[List], options: Dict, fmt: str
+) -> int:
+    """gzip or zstd compressed csv, one stream for the whole export"""
+    rows = 0
+    with open_compressed(path, fmt, options) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(names)
+        for batch in batches:
+            writer.writerows(batch)
+            rows += len(batch)
+
+    return rows
+
+
+def json_default(value: Any) -> Any:
+    """Convert the values json doesn't know about"""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def write_jsonl(path: str, names: List, batches: Iterator[List], options: Dict) -> int:
+    """One json object per row"""
+    rows = 0
+    with open(
+        path, "a", encoding="utf-8", buffering=options["WRITE_BUFFER"]
+    ) as outfile:
+        for batch in batches:
+            outfile.write(
+                "".join(
+                    json.dumps(dict(zip(names, rec)), default=json_default) + "\n"
+                    for rec in batch
+                )
+            )
+            rows += len(batch)
+
+    return rows
+
+
+# Arrow types for our column kinds, decimals get their own from the
+# precision and scale the driver describes
+ARROW_TYPES = {
+    "bool": "bool_",
+    "int": "int64",
+    "float": "float64",
+    "str": "string",
+    "bytes": "binary",
+    "date": "date32",
+}
+
+
+def arrow_type(pa: Any, kind: str, head: List) -> Any:
+    """The arrow type for a column"""
+    if kind == "decimal":
+        precision, scale = head[4], head[5]
+        if precision and 0 < precision <= 38 and scale is not None:
+            if 0 <= scale <= precision:
+                return pa.decimal128(precision, scale)
+        # An unconstrained NUMERIC, text keeps every digit
+        return pa.string()
+    if kind == "datetime":
+        return pa.timestamp("us")
+    if kind == "time":
+        return pa.time64("us")
+    return getattr(pa, ARROW_TYPES[kind])()
+
+
+def arrow_schema(pa: Any, headers: List, kinds: List[str]) -> Any:
+    """Build the arrow schema from our column kinds"""
+    return pa.schema(
+        [(head[0], arrow_type(pa, kind, head)) for head, kind in zip(headers, kinds)]
+    )
+
+
+def to_str(value: Any) -> Any:
+    """Anything we don't have a type for goes out as text"""
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def to_bytes(value: Any) -> Any:
+    """memoryview and bytearray go out as bytes"""
+    return None if value is None else bytes(value)
+
+
+def converter(pa: Any, arrow: Any) -> Callable[[Any], Any]:
+    """Values that arrow won't take as they come from the driver"""
+    if arrow == pa.string():
+        return to_str
+    if arrow == pa.binary():
+        return to_bytes
+    return lambda value: value
+
+
+def open_arrow(path: str, schema: Any, fmt: str) -> Any:
+    """A parquet or arrow ipc writer on the file"""
+    import pyarrow
+
+    if fmt == "parquet":
+        import pyarrow.parquet
+
+        return pyarrow.parquet.ParquetWriter(path, schema)
+    import pyarrow.ipc
+
+    return pyarrow.ipc.new_file(path, schema)
+
+
+def rewrite_arrow(writer: Any, path: str, schema: Any, fmt: str) -> Any:
+    """A column changed type part way through.  Read back what we wrote,
+    cast it to the wider schema and carry on in a new file"""
+    import pyarrow as pa
+
+    writer.close()
+    if fmt == "parquet":
+        import pyarrow.parquet
+
+        table = pyarrow.parquet.read_table(path)
+    else:
+        with pa.OSFile(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    writer = open_arrow(path, schema, fmt)
+    writer.write_table(table.cast(schema))
+    return writer
+
+
+def write_arrow(
+    path: str, headers: List, batches: Iterator[List], options: Dict, fmt: str
+) -> int:
+    """Parquet or arrow ipc, each fetched batch is a row group.  The types
+    come from the first batch, a column whose later values don't fit is
+    widened to text"""
+    try:
+        import pyarrow as pa
+    except ImportError as err:
+        raise RuntimeError(f"{fmt} output needs the pyarrow module") from err
+
+    first = next(batches, [])
+    kinds = ct.column_kinds(headers, options["ARGS"].servertype, first)
+    schema = arrow_schema(pa, headers, kinds)
+    converters = [converter(pa, field.type) for field in schema]
+    # Written beside the output and moved over it once complete, so a
+    # failure doesn't leave a broken file behind
+    part = f"{path}.part"
+    writer = None
+    rows = 0
+    try:
+        for batch in itertools.chain([first], batches):
+            if not batch:
+                continue
+            columns = []
+            for i, column in enumerate(zip(*batch)):
+                try:
+                    columns.append(
+                        pa.array(
+                            [converters[i](value) for value in column],
+                            type=schema.field(i).type,
+                        )
+                    )
+                except (TypeError, ValueError, OverflowError):
+                    # Mixed types, SQLITE columns can hold anything
+                    schema = schema.set(i, pa.field(schema.field(i).name, pa.string()))
+                    converters[i] = to_str
+                    columns.append(pa.array([to_str(value) for value in column]))
+                    if writer is not None:
+                        writer = rewrite_arrow(writer, part, schema, fmt)
+            record_batch = pa.RecordBatch.from_arrays(columns, schema=schema)
+            if writer is None:
+                writer = open_arrow(part, schema, fmt)
+            if fmt == "parquet":
+                writer.write_batch(record_batch, row_group_size=len(batch))
+            else:
+                writer.write_batch(record_batch)
+            rows += len(batch)
+        if writer is None:
+            # No rows, the file still has the columns
+            writer = open_arrow(part, schema, fmt)
+        writer.close()
+        writer = None
+        os.replace(part, path)
+    finally:
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception as err:
+                # The error that got us here is the one to report
+                of.write_logfile(f"Error: {err}", options, no_print=True)
+        if os.path.exists(part):
+            os.remove(part)
+
+    return rows
+
+
+def export_path(options: Dict, fmt: str) -> str:
+    """The output file.  Parquet and arrow files hold one result set, so
+    the second and later sets of a query go to name.2.parquet and on"""
+    path = options["ARGS"].output
+    number = options["EXPORT_SET"]
+    if number == 0 or fmt not in ("parquet", "arrow"):
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{number + 1}{ext}"
+
+
+def export(headers: List, batches: Iterator[List], options: Dict, fmt: str) -> int:
+    """Stream the batches to the output file in format fmt,
+    returns the number of rows written"""
+    path = export_path(options, fmt)
+    names = [head[0] for head in headers]
+    if fmt == "csv":
+        rows, _ = of.write_csv_stream(names, batches, options)
+        return rows
+    if fmt in ("csv.gz", "csv.zst"):
+        return write_csv(path, names, batches, options, fmt)
+    if fmt == "jsonl":
+        return write_jsonl(path, names, batches, options)
+    if fmt in ("parquet", "arrow"):
+        return write_arrow(path, headers, batches, options, fmt)
+    raise ValueError(f"Unknown output format {fmt}")
+
+
+def file_size(path: str) -> int:
+    """Size of the file or 0 if it isn't there yet"""
+    if os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
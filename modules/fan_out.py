@@ -0,0 +1,169 @@
+""" Run the buffer on a list of servers at the same time and merge
+the results into one table with a server column """
+import concurrent.futures
+import os
+import time
+from typing import Any, Dict, List, Tuple, Union
+import modules.connection as cn
+import modules.env_vars as ev
+import modules.execute_query as eq
+import modules.output_fun as of
+import modules.query_cache as qc
+import modules.sql_text as st
+
+
+def read_servers(options: Dict, name: str) -> List[Tuple[str, str]]:
+    """(label, connection flags) for each server, from a file with one
+    server's flags per line or from the [servers.<name>] config section"""
+    if os.path.isfile(name):
+        servers = []
+        with open(name, "r", encoding="utf-8") as server_file:
+            for line in server_file:
+                line = line.strip()
+                if line != "" and line[0] != "#":
+                    servers.append(("", line))
+        return servers
+    if name in options["SERVER_LISTS"]:
+        return list(options["SERVER_LISTS"][name].items())
+    raise ValueError(f"No server list file or [servers.{name}] section called {name}")
+
+
+def host_options(options: Dict, label: str, flags: str) -> Tuple[str, Dict]:
+    """The options to connect to one server, labelled by its server name
+    (or sqlite file) when the list doesn't give it one"""
+    args, rest = ev.connection_args(options, flags.split())
+    if rest:
+        raise ValueError(f"Unknown connection flags: {' '.join(rest)}")
+    if args.servertype not in cn.ConnectionDispatchTable.dispatch:
+        raise ValueError(f"Unknown connection type: {args.servertype}")
+    if label == "":
+        label = args.sqlitedb if args.servertype == "SQLITE" else args.server
+    # Connection errors are reported in the summary, not as they happen
+    args.quiet = True
+    host = dict(options)
+    host["ARGS"] = args
+    return label, host
+
+
+def run_host(host: Dict, sql: str, values: Union[Dict, Tuple]) -> Dict:
+    """Connect, run and fetch on one server, on a worker thread"""
+    result: Dict[str, Any] = {"names": [], "rows": [], "error": None}
+    start = time.perf_counter()
+    conn = None
+    try:
+        conn = cn.open_connection(host)
+        cursor = conn.cursor()
+        if not values:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql, values)
+        if cursor.description is not None:
+            result["names"] = [head[0] for head in cursor.description]
+            result["rows"] = cursor.fetchall()
+        if host["ARGS"].servertype == "SQLITE":
+            conn.commit()
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        result["error"] = str(err).strip()
+    finally:
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+async def run_all(
+    options: Dict, hosts: List[Tuple[str, Dict]], values: Union[Dict, Tuple], limit: int
+) -> List[Dict]:
+    """Run every host, at most limit at a time, the blocking drivers
+    run on a thread pool"""
+    import asyncio
+
+    sql = options["SQL_BUFFER"]
+    loop = asyncio.get_running_loop()
+    gate = asyncio.Semaphore(limit)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=limit) as pool:
+
+        async def one(label: str, host: Dict) -> Dict:
+            async with gate:
+                if options["SIG_INT"] is True:
+                    # Ctrl-C, don't start on any more servers
+                    result = {"names": [], "rows": [], "error": "Cancelled"}
+                    result["latency"] = 0
+                else:
+                    result = await loop.run_in_executor(
+                        pool, run_host, host, sql, values
+                    )
+            result["label"] = label
+            return result
+
+        return await asyncio.gather(*(one(label, host) for label, host in hosts))
+
+
+def merge(results: List[Dict]) -> Tuple[List, List]:
+    """One result set with the server as the first column, hosts whose
+    columns don't match the first one's get an error instead"""
+    names: List = []
+    rows = []
+    for result in results:
+        if result["error"] is not None or not result["names"]:
+            continue
+        if not names:
+            names = ["server"] + result["names"]
+        elif ["server"] + result["names"] != names:
+            result["error"] = "Columns differ from the other servers"
+            continue
+        rows.extend((result["label"],) + tuple(rec) for rec in result["rows"])
+    return names, rows
+
+
+def run_fan_out(options: Dict, values: Union[Dict, Tuple]) -> None:
+    """go on <list> [limit k], run the buffer on every server in the list"""
+    hosts = []
+    for label, flags in read_servers(options, options["GO_ON"]):
+        try:
+            hosts.append(host_options(options, label, flags))
+        except ValueError as err:
+            of.write_logfile(f"Error: {label or flags}: {err}", options, iserr=True)
+    if not hosts:
+        return
+    limit = max(min(options["GO_LIMIT"] or options["FAN_OUT_LIMIT"], len(hosts)), 1)
+
+    of.write_logfile(
+        f"Running on {len(hosts)} servers, {limit} at a time", options, no_print=True
+    )
+    start = time.perf_counter()
+    # asyncio takes tens of milliseconds to import, only go on needs it
+    import asyncio
+
+    results = asyncio.run(run_all(options, hosts, values, limit))
+    elapsed = time.perf_counter() - start
+    if not st.is_read_only(options["SQL_BUFFER"]) and any(
+        qc.same_server(options, host) for _, host in hosts
+    ):
+        qc.invalidate(options)
+
+    names, rows = merge(results)
+    if names:
+        eq.render(eq.describe(names), options, iter([rows]))
+    width = max(len(str(result["label"])) for result in results)
+    for result in results:
+        status = "ok" if result["error"] is None else "error"
+        print(
+            f"{result['label']:<{width}}  {status:<5}  rows = {len(result['rows']):<8}"
+            f"  latency = {result['latency'] * 1000:.1f} ms"
+        )
+    for result in results:
+        if result["error"] is not None:
+            of.write_logfile(
+                f"Error: {result['label']}: {result['error']}", options, iserr=True
+            )
+    failed = sum(1 for result in results if result["error"] is not None)
+    of.write_logfile(
+        f"Servers = {len(results)}\tFailed = {failed}\tRows = {len(rows)}"
+        f"\tElapsed = {elapsed:.4f}",
+        options,
+    )
@@ -0,0 +1,224 @@
+""" Command history kept in a sqlite database with a full text index,
+so it survives restarts and can be searched """
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+import modules.output_fun as of
+
+# Characters like treats as wildcards, and its escape
+LIKE_RE = re.compile(r"[\\%_]")
+
+USAGE = "Usage: history [n] | history search <terms>"
+
+SCHEMA = (
+    """create table if not exists history (
+        id integer primary key,
+        ts real not null,
+        servertype text,
+        server text,
+        database text,
+        session text,
+        duration real,
+        rows integer,
+        runs integer not null default 1,
+        sql text not null
+    )""",
+    # External content, the text is only stored once
+    """create virtual table if not exists history_fts
+        using fts5(sql, content='history', content_rowid='id')""",
+    """create trigger if not exists history_ai after insert on history begin
+        insert into history_fts(rowid, sql) values (new.id, new.sql);
+    end""",
+    """create trigger if not exists history_ad after delete on history begin
+        insert into history_fts(history_fts, rowid, sql)
+            values ('delete', old.id, old.sql);
+    end""",
+)
+
+
+def start(options: Dict) -> None:
+    """Open the history database and load the most recent entries"""
+    options["HISTORY_DB"] = None
+    options["HISTORY_FTS"] = False
+    if options["HISTORY_SAVE"] is False:
+        return
+    try:
+        conn = sqlite3.connect(options["HISTORY_FILE"], timeout=1)
+        # Another isql may be writing to it, and a lost entry or two
+        # on a crash is better than waiting on every go
+        conn.execute("pragma journal_mode = wal")
+        conn.execute("pragma synchronous = normal")
+        try:
+            for sql in SCHEMA:
+                conn.execute(sql)
+            options["HISTORY_FTS"] = True
+        except sqlite3.OperationalError as err:
+            # No fts5 in this sqlite, search falls back to like
+            of.write_logfile(
+                f"History search isn't indexed: {err}", options, no_print=True
+            )
+            conn.execute(SCHEMA[0])
+        conn.commit()
+    except sqlite3.Error as err:
+        of.write_logfile(f"Error: history database: {err}", options)
+        return
+    options["HISTORY_DB"] = conn
+    # Only the newest entries are held in memory, search finds the rest
+    options["HISTORY"] = [
+        sql for _, sql in reversed(recent(options, options["HISTORY_LOAD"]))
+    ]
+
+
+def recent(options: Dict, count: int) -> List[Tuple[int, str]]:
+    """The id and text of the last count entries, newest first"""
+    cursor = options["HISTORY_DB"].execute(
+        "select id, sql from history order by id desc limit ?", (count,)
+    )
+    return cursor.fetchall()
+
+
+def add(options: Dict, sql: str, duration: float, rows: int) -> None:
+    """Record a buffer we ran, a repeat of the last entry updates it"""
+    if sql.strip() == "":
+        return
+    if not options["HISTORY"] or options["HISTORY"][-1] != sql:
+        options["HISTORY"].append(sql)
+    conn = options["HISTORY_DB"]
+    if conn is None:
+        return
+    args = options["ARGS"]
+    server = args.sqlitedb if args.servertype == "SQLITE" else args.server
+    database = options["SESSION"]["database"] or args.database
+    try:
+        last = recent(options, 1)
+        if last and last[0][1] == sql:
+            conn.execute(
+                "update history set ts = ?, servertype = ?, server = ?,"
+                " database = ?, session = ?, duration = ?, rows = ?,"
+                " runs = runs + 1 where id = ?",
+                (
+                    time.time(),
+                    args.servertype,
+                    server,
+                    database,
+                    options["SESSION_NAME"],
+                    duration,
+                    rows,
+                    last[0][0],
+                ),
+            )
+        else:
+            conn.execute(
+                "insert into history (ts, servertype, server, database, session,"
+                " duration, rows, sql) values (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(),
+                    args.servertype,
+                    server,
+                    database,
+                    options["SESSION_NAME"],
+                    duration,
+                    rows,
+                    sql,
+                ),
+            )
+        conn.commit()
+    except sqlite3.Error as err:
+        # History is a convenience, don't let it get in the way of the query
+        of.write_logfile(f"Error: history database: {err}", options, no_print=True)
+
+
+def match_expression(terms: List[str]) -> str:
+    """Each term as a quoted prefix, so punctuation in sql doesn't
+    trip up the fts5 query syntax"""
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+
+def search(options: Dict, terms: List[str], limit: int) -> List[Tuple]:
+    """Entries holding every term, newest first"""
+    conn = options["HISTORY_DB"]
+    columns = "h.id, h.ts, h.server, h.database, h.duration, h.rows, h.runs, h.sql"
+    if options["HISTORY_FTS"] is True:
+        # fts5 walks its matches newest first and stops at the limit
+        try:
+            return conn.execute(
+                f"select {columns} from history h join (select rowid"
+                " from history_fts where history_fts match ?"
+                " order by rowid desc limit ?) f on h.id = f.rowid"
+                " order by h.id desc",
+                (match_expression(terms), limit),
+            ).fetchall()
+        except sqlite3.OperationalError as err:
+            # Terms the index can't search for, like a lone *
+            of.write_logfile(f"Error: {err}", options, no_print=True)
+    likes = " and ".join(["h.sql like ? escape '\\'"] * len(terms))
+    patterns = ["%" + LIKE_RE.sub(r"\\\g<0>", term) + "%" for term in terms]
+    return conn.execute(
+        f"select {columns} from history h where {likes} order by h.id desc limit ?",
+        (*patterns, limit),
+    ).fetchall()
+
+
+def latest_match(options: Dict, terms: List[str]) -> Optional[str]:
+    """The text of the newest entry holding every term"""
+    if options["HISTORY_DB"] is None:
+        # Only what this session has run
+        for sql in reversed(options["HISTORY"]):
+            if all(term.lower() in sql.lower() for term in terms):
+                return sql
+        return None
+    for rec in search(options, terms, 1):
+        return rec[7]
+    return None
+
+
+def print_matches(options: Dict, terms: List[str]) -> None:
+    """Show the entries matching the search terms"""
+    if options["HISTORY_DB"] is None:
+        print("History isn't being saved, see history.save in isql.cfg")
+        return
+    found = 0
+    for rec_id, stamp, server, database, duration, rows, runs, sql in search(
+        options, terms, options["HISTORY_SHOW"]
+    ):
+        found += 1
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(stamp))
+        text = " ".join(sql.split())
+        of.get_console().print(
+            f"{rec_id:>7} {when} {server or ''}/{database or ''}"
+            f" {duration or 0:.3f}s rows={rows} runs={runs}  {text[:80]}",
+            markup=False,
+            highlight=False,
+        )
+    if found == 0:
+        print("No history matches")
+
+
+def history_command(options: Dict, tokens: List) -> None:
+    """history [n] | history search <terms>"""
+    words = [token for token in tokens[1:] if token != ""]
+    history = options["HISTORY"]
+    if words and words[0].lower() == "search":
+        if len(words) < 2:
+            print(USAGE)
+            return
+        print_matches(options, words[1:])
+        return
+    if len(words) > 1 or (words and not words[0].isdigit()):
+        print(USAGE)
+        return
+    # The last n entries, numbered the way ! recalls them
+    count = int(words[0]) if words else options["HISTORY_SHOW"]
+    for i in range(max(len(history) - count, 0), len(history)):
+        of.get_console().print(f"{i} = {history[i]}", markup=False, highlight=False)
+
+
+def close(options: Dict) -> None:
+    """Close the history database, used on exit"""
+    if options.get("HISTORY_DB") is not None:
+        try:
+            options["HISTORY_DB"].close()
+        except sqlite3.Error as err:
+            of.write_logfile(f"Error: {err}", options, no_print=True)
+        options["HISTORY_DB"] = None
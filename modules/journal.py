@@ -0,0 +1,230 @@
+""" A journal of every query run, one json record per execution, and
+the stats command that aggregates it by query fingerprint """
+import glob
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import time
+from typing import Dict, Iterator, List, Optional
+import modules.output_fun as of
+import modules.sql_text as st
+import modules.timing as tm
+
+USAGE = (
+    "Usage: stats [n] [by total|avg|max|count|errors] [days d] [like text]"
+    " | stats regress [n] [days d]"
+)
+
+# Longest query text kept in a record
+QUERY_CHARS = 1000
+
+# How stats can sort, and the column it sorts on
+SORT_KEYS = {
+    "total": lambda agg: agg["sum"],
+    "avg": lambda agg: agg["sum"] / agg["count"],
+    "max": lambda agg: agg["max"],
+    "count": lambda agg: agg["count"],
+    "errors": lambda agg: agg["errors"],
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """The record's message is the dict to write"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, default=str)
+
+
+def start(options: Dict) -> None:
+    """Open the journal, written by a background thread"""
+    if options["JOURNAL_ON"] is False:
+        options["JOURNAL"] = None
+        return
+    options["JOURNAL_FILENAME"] = f"{options['LOG_PATH']}/journal.jsonl"
+    handler = logging.handlers.RotatingFileHandler(
+        filename=options["JOURNAL_FILENAME"],
+        maxBytes=options["JOURNAL_SIZE"],
+        backupCount=options["LOG_BACKUPS"],
+    )
+    handler.setFormatter(JsonFormatter())
+    options["JOURNAL"] = of.queue_logger("Journal", handler)
+
+
+def record(
+    options: Dict, sql: str, error: Optional[str] = None, cached: bool = False
+) -> None:
+    """Journal one execution, using the timings tm collected for it"""
+    if options["JOURNAL"] is None:
+        return
+    args = options["ARGS"]
+    timing = options["TIMING"]
+    text = st.fingerprint(sql)
+    entry = {
+        "ts": round(time.time(), 3),
+        "session": options["SESSION_NAME"],
+        "servertype": args.servertype,
+        "server": args.sqlitedb if args.servertype == "SQLITE" else args.server,
+        "database": options["SESSION"]["database"] or args.database,
+        "user": args.user,
+        "fingerprint": hashlib.sha1(text.encode("utf-8")).hexdigest()[:16],
+        "query": text[:QUERY_CHARS],
+        "rows": timing["rows"],
+        "cached": cached,
+        "error": error,
+    }
+    counters = options.pop("SERVER_COUNTERS", None)
+    if counters:
+        entry["server_stats"] = counters
+    for name in tm.PHASES + ("total",):
+        if name in timing["phases"]:
+            entry[f"{name}_ms"] = round(timing["phases"][name] * 1000, 3)
+    options["JOURNAL"].info(entry)
+
+
+def read_journal(options: Dict) -> Iterator[Dict]:
+    """Every record in the journal, the rotated files first"""
+    filename = f"{options['LOG_PATH']}/journal.jsonl"
+    rotated = sorted(
+        glob.glob(f"{filename}.*"),
+        key=lambda name: int(name.rsplit(".", 1)[1]) if name[-1].isdigit() else 0,
+        reverse=True,
+    )
+    for name in rotated + [filename]:
+        if not os.path.isfile(name):
+            continue
+        with open(name, "r", encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+
+
+def aggregate(records: Iterator[Dict], since: float, like: str) -> Dict[str, Dict]:
+    """Per fingerprint totals of the records since the given time,
+    with the average before and after it for spotting regressions"""
+    stats: Dict[str, Dict] = {}
+    for rec in records:
+        if like and like not in rec.get("query", ""):
+            continue
+        agg = stats.get(rec["fingerprint"])
+        if agg is None:
+            agg = {
+                "query": rec.get("query", ""),
+                "count": 0,
+                "errors": 0,
+                "sum": 0.0,
+                "max": 0.0,
+                "rows": 0,
+                "last": 0.0,
+                "before_sum": 0.0,
+                "before_count": 0,
+            }
+            stats[rec["fingerprint"]] = agg
+        total = rec.get("total_ms", 0.0)
+        if rec["ts"] < since:
+            agg["before_sum"] += total
+            agg["before_count"] += 1
+            continue
+        agg["count"] += 1
+        agg["errors"] += 1 if rec.get("error") else 0
+        agg["sum"] += total
+        agg["max"] = max(agg["max"], total)
+        agg["rows"] += rec.get("rows", 0)
+        agg["last"] = max(agg["last"], rec["ts"])
+
+    return stats
+
+
+def top_lines(stats: Dict[str, Dict], top: int, sort: str) -> List[str]:
+    """The top queries by the sort column"""
+    ranked = sorted(
+        (agg for agg in stats.values() if agg["count"] > 0),
+        key=SORT_KEYS[sort],
+        reverse=True,
+    )
+    lines = [
+        f"{'count':>7}{'errors':>7}{'avg ms':>11}{'max ms':>11}{'total ms':>12}"
+        f"{'avg rows':>10}  {'last run':<16}  query"
+    ]
+    for agg in ranked[:top]:
+        last = time.strftime("%Y-%m-%d %H:%M", time.localtime(agg["last"]))
+        lines.append(
+            f"{agg['count']:>7}{agg['errors']:>7}{agg['sum'] / agg['count']:>11.3f}"
+            f"{agg['max']:>11.3f}{agg['sum']:>12.3f}"
+            f"{agg['rows'] / agg['count']:>10.0f}  {last:<16}  {agg['query'][:60]}"
+        )
+    return lines
+
+
+def regress_lines(stats: Dict[str, Dict], top: int) -> List[str]:
+    """Queries whose average in the recent window is slower than before it"""
+    ranked = []
+    for agg in stats.values():
+        if agg["count"] == 0 or agg["before_count"] == 0:
+            continue
+        before = agg["before_sum"] / agg["before_count"]
+        recent = agg["sum"] / agg["count"]
+        if before > 0 and recent > before:
+            ranked.append((recent / before, before, recent, agg))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+
+    lines = [f"{'before ms':>11}{'recent ms':>11}{'ratio':>8}{'runs':>7}  query"]
+    for ratio, before, recent, agg in ranked[:top]:
+        lines.append(
+            f"{before:>11.3f}{recent:>11.3f}{ratio:>8.2f}{agg['count']:>7}"
+            f"  {agg['query'][:60]}"
+        )
+    if not ranked:
+        lines.append("No query is slower than it was before")
+    return lines
+
+
+def stats_command(options: Dict, tokens: List) -> None:
+    """stats [n] [by col] [days d] [like text] | stats regress [n] [days d]"""
+    words = [token for token in tokens[1:] if token != ""]
+    regress = bool(words) and words[0].lower() == "regress"
+    if regress:
+        words = words[1:]
+    top = 20
+    sort = "total"
+    days = None
+    like = ""
+    pos = 0
+    try:
+        while pos < len(words):
+            word = words[pos].lower()
+            if word.isdigit():
+                top = int(word)
+                pos += 1
+            elif word == "by" and pos + 1 < len(words):
+                sort = words[pos + 1].lower()
+                if sort not in SORT_KEYS:
+                    raise ValueError(USAGE)
+                pos += 2
+            elif word == "days" and pos + 1 < len(words):
+                days = float(words[pos + 1])
+                pos += 2
+            elif word == "like" and pos + 1 < len(words):
+                like = " ".join(words[pos + 1 :]).lower()
+                pos = len(words)
+            else:
+                raise ValueError(USAGE)
+    except ValueError:
+        print(USAGE)
+        return
+
+    if regress and days is None:
+        # The last day against everything before it
+        days = 1.0
+    since = time.time() - days * 86400 if days is not None else 0.0
+    stats = aggregate(read_journal(options), since, like)
+    if regress:
+        print("\n".join(regress_lines(stats, top)))
+    elif stats:
+        print("\n".join(top_lines(stats, top, sort)))
+    else:
+        print("The journal is empty")
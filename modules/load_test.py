@@ -0,0 +1,140 @@
+""" Run the buffer concurrently to see how a query behaves under load """
+import concurrent.futures
+import math
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple, Union
+import modules.connection as cn
+import modules.output_fun as of
+import modules.query_cache as qc
+import modules.sql_text as st
+import modules.text_table as tt
+
+
+def percentile(latencies: List[float], pct: float) -> float:
+    """Nearest rank percentile of an already sorted list"""
+    if not latencies:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(latencies)), 1)
+    return latencies[rank - 1]
+
+
+def histogram(latencies: List[float], width: int = 40) -> List[str]:
+    """Bucket the latencies by powers of two milliseconds"""
+    buckets: Counter = Counter()
+    for latency in latencies:
+        msecs = max(latency * 1000, 0.001)
+        buckets[math.ceil(math.log2(msecs))] += 1
+
+    lines = []
+    most = max(buckets.values(), default=0)
+    for power in range(min(buckets, default=0), max(buckets, default=-1) + 1):
+        count = buckets[power]
+        bar = "#" * math.ceil(count / most * width) if count else ""
+        lines.append(f"  <= {2 ** power:>10.3f} ms | {count:>7} {bar}")
+
+    return lines
+
+
+def run_parallel(
+    options: Dict, repeat: int, pause: int, values: Union[Dict, Tuple]
+) -> None:
+    """Run the buffer repeat times spread across GO_PARALLEL connections"""
+    workers = options["GO_PARALLEL"]
+    sql = options["SQL_BUFFER"]
+    local = threading.local()
+    lock = threading.Lock()
+    conns: List[Any] = []
+    sample: List = []
+
+    def get_cursor() -> Any:
+        """Each worker thread gets its own connection"""
+        if not hasattr(local, "cursor"):
+            conn = cn.open_connection(options)
+            with lock:
+                conns.append(conn)
+            local.cursor = conn.cursor()
+        return local.cursor
+
+    def execute_once(_: int) -> Tuple[float, int]:
+        """Execute and drain the results, returns latency and rows"""
+        if options["SIG_INT"] is True:
+            raise InterruptedError("Cancelled")
+        cursor = get_cursor()
+        start = time.perf_counter()
+        if not values:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql, values)
+        rows = 0
+        if cursor.description is not None:
+            while True:
+                batch = cursor.fetchmany(options["FETCH_SIZE"])
+                if not batch:
+                    break
+                rows += len(batch)
+                if options["GO_SAMPLE"] is True and not sample:
+                    with lock:
+                        if not sample:
+                            sample.append(cursor.description)
+                            sample.append(batch)
+        if options["ARGS"].servertype == "SQLITE":
+            # The other drivers autocommit, sqlite3 holds the write lock
+            # until we commit
+            cursor.connection.commit()
+        latency = time.perf_counter() - start
+        if pause > 0:
+            time.sleep(pause)
+        return latency, rows
+
+    of.write_logfile(
+        f"Running {repeat} executions across {workers} connections", options
+    )
+    latencies = []
+    errors: Counter = Counter()
+    total_rows = 0
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(execute_once, i) for i in range(repeat)]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                latency, rows = future.result()
+                latencies.append(latency)
+                total_rows += rows
+            except Exception as err:
+                errors[str(err).strip()] += 1
+    elapsed = time.perf_counter() - start
+    if not st.is_read_only(sql):
+        qc.invalidate(options)
+
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception as err:
+            of.write_logfile(f"Error: {err}", options, no_print=True)
+
+    if sample:
+        rich = options["OUTPUT_METHOD"] == "rich"
+        style = "RICH" if rich else options["OUTPUT_STYLE"]
+        for chunk in tt.table_text(sample[0], iter([sample[1]]), options, style, False):
+            print(chunk)
+
+    latencies.sort()
+    rate = len(latencies) / elapsed if elapsed > 0 else 0
+    of.write_logfile(
+        f"Executions = {len(latencies)}\tErrors = {sum(errors.values())}"
+        f"\tRows = {total_rows}\tElapsed = {elapsed:.4f}\tExec/sec = {rate:.2f}",
+        options,
+    )
+    if latencies:
+        of.write_logfile(
+            f"Latency p50 = {percentile(latencies, 50) * 1000:.3f} ms"
+            f"\tp95 = {percentile(latencies, 95) * 1000:.3f} ms"
+            f"\tp99 = {percentile(latencies, 99) * 1000:.3f} ms"
+            f"\tmax = {latencies[-1] * 1000:.3f} ms",
+            options,
+        )
+        print("\n".join(histogram(latencies)))
+    for message, count in errors.most_common(5):
+        of.write_logfile(f"Error ({count}x): {message}", options, iserr=True)
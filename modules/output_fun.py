@@ -1,34 +1,69 @@
 """ output functions """
-import datetime as dt
-from typing import Union, Dict, List
+import atexit
+import os
+import queue
+from typing import Any, Dict, List, Iterable, Optional, Tuple
 import logging
 import logging.handlers
-import tempfile
 import csv
-import pickle
-from rich.console import Console
-from rich.panel import Panel
+import functools
+import modules.timing as tm
 
-console = Console()
+
+@functools.lru_cache(maxsize=None)
+def get_console(style: Optional[str] = None) -> Any:
+    """The shared rich console, rich is only imported the first time
+    something is printed with it"""
+    from rich.console import Console
+
+    return Console(style=style)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Queue the record as it is, the formatting is left to
+    the listener's thread along with the write"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def queue_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    """A logger that only queues its records, handler writes them
+    on a background thread that is flushed on exit"""
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.handlers.clear()
+    logger.addHandler(RecordQueueHandler(records))
+    return logger
 
 
 def set_logger(options: Dict) -> None:
     """set up the logger"""
     options["LOG_FILENAME"] = f"{options['LOG_PATH']}/isql.log"
 
-    isql_log = logging.getLogger("Logger")
-    isql_log.setLevel(logging.DEBUG)
     handler = logging.handlers.RotatingFileHandler(
-        filename=options["LOG_FILENAME"], maxBytes=65536, backupCount=5,
+        filename=options["LOG_FILENAME"],
+        maxBytes=options["LOG_SIZE"],
+        backupCount=options["LOG_BACKUPS"],
+    )
+    handler.setFormatter(
+        logging.Formatter("%(asctime)s.%(msecs)03d:%(message)s", "%Y-%m-%d %H:%M:%S")
     )
-    isql_log.addHandler(handler)
-    options["LOG_HANDLER"] = isql_log
+    options["LOG_HANDLER"] = queue_logger("Logger", handler)
 
 
 def write_message(text: str, options: Dict) -> None:
     """write messages but never to log"""
     if options["OUTPUT_METHOD"] == "rich":
-        console.print(Panel(text, expand=False, border_style="white"))
+        from rich.panel import Panel
+
+        get_console().print(Panel(text, expand=False, border_style="white"))
     else:
         print(text)
 
@@ -41,53 +76,39 @@ def write_logfile(
         if options["OUTPUT_METHOD"] == "rich":
             if iserr is False:
                 if options["ARGS"].quiet is False:
-                    console.print(text, style="bold")
+                    get_console().print(text, style="bold")
             else:
-                error_console = Console(style="bold italic red")
-                error_console.print(Panel(text, expand=False, border_style="red"))
+                from rich.panel import Panel
+
+                get_console("bold italic red").print(
+                    Panel(text, expand=False, border_style="red")
+                )
         else:
             if options["ARGS"].quiet is False:
                 print(text)
-    timestamp = dt.datetime.today()
-    line = f"{timestamp}:{options['ARGS'].user}:{text}"
-    options["LOG_HANDLER"].info(line)
-
-
-def write_output_file(buffer: Union[List, str], options: Dict) -> int:
-    """handle -o flag output"""
-    if options["ARGS"].output is None:
-        print("No output file defined")
-        return 100
-
-    if options["OUTPUT_CSV"] is True:
-        with open(options["ARGS"].output, "a", encoding="utf-8") as outfile:
-            writer = csv.writer(outfile)
-            writer.writerow(buffer)
-    else:
-        with open(options["ARGS"].output, "a", encoding="utf-8") as outfile:
-            outfile.write(str(buffer))
-
-    return 0
-
-
-def write_cache(data: str, options: Dict) -> None:
-    """write results to a cache that we can reuse"""
-    if "RESULTS_CACHE_NAME" not in options:
-        with tempfile.NamedTemporaryFile(mode="w+b", delete=False) as t_file:
-            options["RESULTS_CACHE_NAME"] = t_file.name
-
-    with open(options["RESULTS_CACHE_NAME"], "wb", encoding=None) as t_file:
-        pickle.dump(data, t_file)
-
-
-def read_cache(options: Dict) -> str:
-    """read cache and return the results"""
-    if "RESULTS_CACHE_NAME" not in options:
-        print("No results to redisplay")
-        res = ""
-    else:
-        print("** Fetching from cache **")
-        with open(options["RESULTS_CACHE_NAME"], "rb", encoding=None) as cache:
-            res = pickle.load(cache)
-
-    return res
+    # The timestamp is added when the background thread writes it
+    options["LOG_HANDLER"].info(f"{options['ARGS'].user}:{text}")
+
+
+def write_csv_stream(
+    headers: List, batches: Iterable, options: Dict
+) -> Tuple[int, int]:
+    """Stream batches of rows to the output file through a single handle,
+    returns the rows and bytes written"""
+    before = 0
+    if os.path.exists(options["ARGS"].output):
+        before = os.path.getsize(options["ARGS"].output)
+
+    rows = 0
+    with tm.phase(options, "file"), open(
+        options["ARGS"].output, "a", encoding="utf-8", buffering=options["WRITE_BUFFER"]
+    ) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(headers)
+        for batch in batches:
+            writer.writerows(batch)
+            rows += len(batch)
+
+    written = os.path.getsize(options["ARGS"].output) - before
+    tm.count_bytes(options, written)
+    return rows, written
@@ -1,6 +1,10 @@
 """ allow the user to change behavior and actions of the output """
 from typing import Dict, Iterable, List
-from prettytable import PLAIN_COLUMNS, MSWORD_FRIENDLY, DEFAULT
+import modules.env_vars as ev
+import modules.export as ex
+import modules.preview as pv
+import modules.query_cache as qc
+import modules.server_stats as sx
 
 
 def set_method(tokens: List, options: Dict) -> None:
@@ -20,19 +24,10 @@ def set_method(tokens: List, options: Dict) -> None:
 def set_style(tokens: List, options: Dict) -> None:
     """For pretty output only
     Allow the user to change options around the output"""
-    lookup = {
-        MSWORD_FRIENDLY: "MSWORD_FRIENDLY",
-        PLAIN_COLUMNS: "PLAIN_COLUMNS",
-        DEFAULT: "DEFAULT",
-    }
     if len(tokens) == 1:
-        print(f"OUTPUT_STYLE = {lookup[options['OUTPUT_STYLE']]}")
-    elif tokens[1].upper() == "MSWORD_FRIENDLY":
-        options["OUTPUT_STYLE"] = MSWORD_FRIENDLY
-    elif tokens[1].upper() == "PLAIN_COLUMNS":
-        options["OUTPUT_STYLE"] = PLAIN_COLUMNS
+        print(f"OUTPUT_STYLE = {options['OUTPUT_STYLE']}")
     else:
-        options["OUTPUT_STYLE"] = DEFAULT
+        options["OUTPUT_STYLE"] = ev.pretty_options(tokens[1])
 
 
 def set_align(tokens: List, options: Dict) -> None:
@@ -86,9 +81,56 @@ def set_csv(_, options: Dict) -> None:
     toggle(options, "OUTPUT_CSV")
 
 
-def set_pager(_, options: Dict) -> None:
-    """Toggle pager output"""
-    toggle(options, "PAGER")
+def set_pager(tokens: List, options: Dict) -> None:
+    """Toggle pager output or pick the pager to use"""
+    if len(tokens) == 1:
+        toggle(options, "PAGER")
+    elif tokens[1].lower() in ("lazy", "rich"):
+        options["PAGER"] = True
+        options["PAGER_TYPE"] = tokens[1].lower()
+        print(f"PAGER {options['PAGER']} PAGER_TYPE {options['PAGER_TYPE']}")
+    else:
+        print(f"Unknown pager {tokens[1]}")
+
+
+def set_format(tokens: List, options: Dict) -> None:
+    """Pick the output file format, auto goes by the file extension"""
+    if len(tokens) == 1:
+        print(f"EXPORT_FORMAT = {options['EXPORT_FORMAT']}")
+    elif tokens[1].lower() in ex.FORMATS:
+        options["EXPORT_FORMAT"] = tokens[1].lower()
+    else:
+        print(f"Unknown format {tokens[1]}, use one of {', '.join(ex.FORMATS)}")
+
+
+def set_large(_, options: Dict) -> None:
+    """Toggle large result (server side cursor) mode"""
+    toggle(options, "LARGE_RESULTS")
+
+
+def set_query_cache(tokens: List, options: Dict) -> None:
+    """:qcache [on|off|clear|ttl n], no argument toggles it"""
+    if len(tokens) == 1:
+        toggle(options, "QUERY_CACHE")
+    elif tokens[1].lower() == "on":
+        options["QUERY_CACHE"] = True
+    elif tokens[1].lower() == "off":
+        options["QUERY_CACHE"] = False
+        qc.invalidate(options)
+    elif tokens[1].lower() == "clear":
+        qc.invalidate(options)
+    elif tokens[1].lower() == "ttl" and len(tokens) > 2 and tokens[2].isdigit():
+        options["QUERY_CACHE_TTL"] = int(tokens[2])
+    elif tokens[1].lower() == "stats":
+        stats = options["QCACHE_STATS"]
+        print(
+            f"entries={len(options['QCACHE'])} bytes={stats['bytes']}"
+            f" hits={stats['hits']} misses={stats['misses']}"
+            f" invalidations={stats['invalidations']}"
+            f" ttl={options['QUERY_CACHE_TTL']}"
+        )
+    else:
+        print(f"Unknown qcache option {' '.join(tokens[1:])}")
 
 
 class DispatchTable:
@@ -103,6 +145,11 @@ class DispatchTable:
         ":hcaps": set_header_caps,
         ":csv": set_csv,
         ":pager": set_pager,
+        ":large": set_large,
+        ":format": set_format,
+        ":qcache": set_query_cache,
+        ":maxrows": pv.maxrows_command,
+        ":serverstats": sx.serverstats_command,
     }
 
     def list_keys(self) -> Iterable:
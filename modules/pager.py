@@ -0,0 +1,121 @@
+""" A built in pager that only pulls rows from the cursor as you page """
+import itertools
+import shutil
+import sys
+from typing import Dict, Iterator, List, Tuple
+import modules.text_table as tt
+
+
+def table_lines(
+    headers: List, batches: Iterator[List], options: Dict, style: str
+) -> Tuple[List, Iterator]:
+    """Lay the table out in the output style, the header (kept at the
+    top of every page) from the first batch and a generator that lays
+    out the rows as they are fetched"""
+    table = tt.TextTable([head[0] for head in headers], style, options)
+    servertype = options["ARGS"].servertype
+    first = next(batches, [])
+    # The first batch is our sample for the column widths, a wider row
+    # later on widens its column below a rule, as streaming output does
+    formats = tt.formatters(headers, servertype, first) if first else []
+    columns = tt.text_columns(first, formats)
+    simple = tt.plain(columns)
+    table.widen(columns, simple)
+
+    def lines() -> Iterator[str]:
+        nonlocal formats
+        if first:
+            yield from table.body(columns, simple)
+        for batch in batches:
+            if not batch:
+                continue
+            if not formats:
+                formats = tt.formatters(headers, servertype, batch)
+            more = tt.text_columns(batch, formats)
+            plain = tt.plain(more)
+            if table.widen(more, plain):
+                yield from table.rule("mid")
+            yield from table.body(more, plain)
+        yield from table.bottom()
+
+    return table.top(), lines()
+
+
+def record_lines(
+    headers: List, batches: Iterator[List], options: Dict
+) -> Iterator[str]:
+    """Column name and value for each result, like default output"""
+    for chunk in tt.record_text(headers, batches, options):
+        yield from chunk.split("\n")
+
+
+def page(header: List[str], lines: Iterator[str]) -> bool:
+    """Show the lines a screen at a time, only pulling more from the
+    iterator when we page past what we have.  Returns False when we
+    quit before the end, so the caller can deal with the rows left"""
+    seen: List[str] = []
+    exhausted = False
+
+    def fill(upto: int) -> None:
+        nonlocal exhausted
+        while exhausted is False and len(seen) < upto:
+            try:
+                seen.append(next(lines))
+            except StopIteration:
+                exhausted = True
+
+    top = 0
+    pattern = ""
+    while True:
+        size = max(shutil.get_terminal_size().lines - len(header) - 2, 1)
+        # One extra so we know if there is another page
+        fill(top + size + 1)
+        for line in header:
+            print(line)
+        for line in seen[top : top + size]:
+            print(line)
+        total = f"{len(seen)}" if exhausted else f"{len(seen)}+"
+        status = f"lines {top + 1}-{min(top + size, len(seen))} of {total}"
+        try:
+            cmd = input(f":{status} [enter|b|g|G|<n>|/text|n|q] ")
+        except EOFError:
+            # Nobody to page for, print the rest as normal output
+            for line in itertools.chain(seen[top + size :], lines):
+                print(line)
+            return True
+
+        if cmd.lower() == "q":
+            return exhausted
+        if cmd in ("", " ", "f"):
+            if top + size < len(seen):
+                top += size
+        elif cmd == "b":
+            top = max(top - size, 0)
+        elif cmd == "g":
+            top = 0
+        elif cmd == "G":
+            fill(sys.maxsize)
+            top = max(len(seen) - size, 0)
+        elif cmd.isdigit():
+            fill(int(cmd))
+            top = min(max(int(cmd) - 1, 0), max(len(seen) - 1, 0))
+        elif cmd[0] == "/" or cmd == "n":
+            if cmd[0] == "/":
+                pattern = cmd[1:]
+            if pattern == "":
+                continue
+            pos = top + 1
+            found = False
+            # Search what we have, then keep fetching until we find it
+            while found is False:
+                fill(pos + 1)
+                if pos >= len(seen):
+                    break
+                if pattern in seen[pos]:
+                    found = True
+                else:
+                    pos += 1
+            if found is True:
+                top = pos
+            else:
+                print(f"Pattern not found: {pattern}")
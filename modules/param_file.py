@@ -0,0 +1,296 @@
+""" go with <file>, run the buffer once for each row of a csv or jsonl
+file, binding the row's columns to the :var: placeholders """
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import threading
+import time
+from typing import Any, Deque, Dict, Iterator, List, Tuple, Union
+import modules.cancel as cx
+import modules.connection as cn
+import modules.execute_query as eq
+import modules.output_fun as of
+import modules.query_cache as qc
+import modules.sql_text as st
+import modules.substitute_vars as sv
+import modules.timing as tm
+
+
+def read_params(filename: str) -> Iterator[Dict]:
+    """Each row of the file as a dict, a csv needs a header row,
+    empty csv fields are nulls"""
+    with open(filename, "r", encoding="utf-8", newline="") as infile:
+        if filename.lower().endswith((".jsonl", ".ndjson", ".json")):
+            for line in infile:
+                if line.strip() != "":
+                    yield json.loads(line)
+        else:
+            for rec in csv.DictReader(infile):
+                yield {key: None if val == "" else val for key, val in rec.items()}
+
+
+def check_params(rows: Iterator[Dict], names: Tuple[str, ...]) -> Iterator[Dict]:
+    """Fail up front when the first row is missing a variable,
+    rather than once for every row"""
+    first = next(rows, None)
+    if first is None:
+        return iter([])
+    missing = [name for name in names if name not in first]
+    if missing:
+        raise ValueError(f"The parameter file has no {', '.join(missing)} column")
+    return itertools.chain([first], rows)
+
+
+def bind(row: Dict, names: Tuple[str, ...], named: bool) -> Union[Dict, Tuple]:
+    """The values for one execution, by name or by position"""
+    missing = [name for name in names if name not in row]
+    if missing:
+        raise ValueError(f"No value for {', '.join(missing)}")
+    if named:
+        return {name: row[name] for name in names}
+    return tuple(row[name] for name in names)
+
+
+def chunks(
+    rows: Iterator[Dict], names: Tuple[str, ...], named: bool, size: int, state: Dict
+) -> Iterator[List[Tuple[int, Union[Dict, Tuple]]]]:
+    """(row number, values) in batches of size, rows that can't be
+    bound are reported straight away"""
+    batch = []
+    for number, row in enumerate(rows, start=1):
+        state["params"] += 1
+        try:
+            batch.append((number, bind(row, names, named)))
+        except ValueError as err:
+            error(state, number, err)
+            continue
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def error(state: Dict, number: int, err: Exception) -> None:
+    """Record a row that failed"""
+    with state["lock"]:
+        state["errors"].append((number, str(err).strip()))
+
+
+def write_many(cursor: Any, servertype: str, sql: str, batch: List) -> List:
+    """executemany the batch the fastest way the driver allows,
+    returns (row number, message) for rows the server rejected"""
+    values = [value for _, value in batch]
+    rejected = []
+    if servertype == "ORACLE":
+        # Bad rows are reported back rather than failing the batch
+        cursor.executemany(sql, values, batcherrors=True)
+        for err in cursor.getbatcherrors():
+            rejected.append((batch[err.offset][0], err.message))
+    elif servertype == "PSQL":
+        import psycopg2.extras
+
+        psycopg2.extras.execute_batch(cursor, sql, values, page_size=len(values))
+    else:
+        cursor.executemany(sql, values)
+
+    return rejected
+
+
+def run_dml(options: Dict, sql: str, batches: Iterator[List], state: Dict) -> None:
+    """One executemany and commit per batch.  A batch that fails is run
+    again a row at a time to find and report the rows that fail"""
+    conn = options["CONN"]
+    servertype = options["ARGS"].servertype
+    cursor = conn.cursor()
+    cn.set_autocommit(conn, servertype, False)
+    try:
+        for batch in batches:
+            if options["SIG_INT"] is True:
+                break
+            try:
+                for number, message in write_many(cursor, servertype, sql, batch):
+                    error(state, number, Exception(message))
+                conn.commit()
+                state["ok"] += len(batch)
+                continue
+            except Exception:
+                conn.rollback()
+                if options["SIG_INT"] is True:
+                    raise
+            for number, values in batch:
+                try:
+                    cursor.execute(sql, values)
+                    conn.commit()
+                    state["ok"] += 1
+                except Exception as err:
+                    conn.rollback()
+                    error(state, number, err)
+    finally:
+        cn.set_autocommit(conn, servertype, True)
+        cursor.close()
+        qc.invalidate(options)
+
+
+def run_selects(cursor: Any, sql: str, batch: List, state: Dict) -> List:
+    """Execute the query for each row of the batch, returns the rows"""
+    rows: List = []
+    for number, values in batch:
+        if state["stop"].is_set():
+            break
+        try:
+            cursor.execute(sql, values)
+            if cursor.description is not None:
+                if state["names"] is None:
+                    state["names"] = [head[0] for head in cursor.description]
+                rows.extend(cursor.fetchall())
+            with state["lock"]:
+                state["ok"] += 1
+        except Exception as err:
+            error(state, number, err)
+    return rows
+
+
+def select_batches(
+    options: Dict, sql: str, batches: Iterator[List], state: Dict
+) -> Iterator[List]:
+    """The result rows of each batch, in order.  With parallel k the
+    batches run on k connections of their own, at most 2k in flight"""
+    workers = options["GO_PARALLEL"]
+    if workers == 0:
+        for batch in batches:
+            if options["SIG_INT"] is True:
+                state["stop"].set()
+                break
+            yield run_selects(options["CURSOR"], sql, batch, state)
+        return
+
+    local = threading.local()
+    conns: List[Any] = []
+
+    def run_batch(batch: List) -> List:
+        """Each worker thread gets its own connection"""
+        if not hasattr(local, "cursor"):
+            conn = cn.open_connection(options)
+            with state["lock"]:
+                conns.append(conn)
+            local.cursor = conn.cursor()
+        return run_selects(local.cursor, sql, batch, state)
+
+    pending: Deque[concurrent.futures.Future] = collections.deque()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        for batch in batches:
+            if options["SIG_INT"] is True:
+                break
+            pending.append(pool.submit(run_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending and options["SIG_INT"] is False:
+            yield pending.popleft().result()
+    finally:
+        # Also reached when the renderer stops early, the workers
+        # stop at the next row
+        state["stop"].set()
+        pool.shutdown(wait=True)
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception as err:
+                of.write_logfile(f"Error: {err}", options, no_print=True)
+
+
+def counted(
+    options: Dict, first: List, results: Iterator[List], state: Dict
+) -> Iterator[List]:
+    """The rows we already have and then the rest, skipping empty
+    batches and counting the rows.  The renderers want at least one"""
+    found = False
+    for batch in itertools.chain([first], results):
+        if batch:
+            found = True
+            state["rows"] += len(batch)
+            tm.count_rows(options, len(batch))
+            yield batch
+    if found is False:
+        yield []
+
+
+def render_selects(
+    options: Dict, sql: str, batches: Iterator[List], state: Dict
+) -> None:
+    """Stream the query results to the screen or output file, the
+    headers come from the first execution that returns any"""
+    results = select_batches(options, sql, batches, state)
+    first: List = []
+    for rows in results:
+        first.extend(rows)
+        if state["names"] is not None:
+            break
+    if state["names"] is None:
+        return
+    with tm.phase(options, "render"):
+        eq.render(
+            eq.describe(state["names"]),
+            options,
+            counted(options, first, results, state),
+        )
+
+
+def run_with_params(options: Dict) -> None:
+    """go with <file> [batch n] [parallel k], run the buffer for
+    each row of the file"""
+    filename = options["GO_WITH"]
+    servertype = options["ARGS"].servertype
+    named = servertype in ("ORACLE", "SQLITE")
+    sql, names = sv.layout(options["SQL_BUFFER"], named)
+    options["SQL_BUFFER"] = sql
+    now = time.perf_counter()
+    state: Dict[str, Any] = {
+        "params": 0,
+        "ok": 0,
+        "rows": 0,
+        "names": None,
+        "errors": [],
+        "lock": threading.Lock(),
+        "stop": threading.Event(),
+    }
+    tm.start_query(options)
+    options["QUERY_RUNNING"] = True
+    try:
+        rows = check_params(read_params(filename), names)
+        batches = chunks(rows, names, named, options["GO_BATCH"], state)
+        if st.returns_rows(sql):
+            render_selects(options, sql, batches, state)
+        else:
+            run_dml(options, sql, batches, state)
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        if options["SIG_INT"] is False:
+            of.write_logfile(f"Error: {err}", options, iserr=True)
+            options["ERROR"] = True
+    finally:
+        options["QUERY_RUNNING"] = False
+    tm.finish_query(options)
+    if options["SIG_INT"] is True:
+        of.write_logfile("Query cancelled, showing the rows fetched so far", options)
+        cx.after_cancel(options)
+
+    elapsed = time.perf_counter() - now
+    rate = state["params"] / elapsed if elapsed > 0 else 0
+    errors = sorted(state["errors"])
+    of.write_logfile(
+        f"Params = {state['params']}\tOk = {state['ok']}\tErrors = {len(errors)}"
+        f"\tRows = {state['rows']}\tElapsed = {elapsed:.4f}\tParams/sec = {rate:.0f}",
+        options,
+    )
+    for number, message in errors[:10]:
+        of.write_logfile(f"Error: row {number}: {message}", options, iserr=True)
+    for number, message in errors[10:]:
+        of.write_logfile(f"Error: row {number}: {message}", options, no_print=True)
+    if len(errors) > 10:
+        of.write_logfile(
+            f"{len(errors) - 10} more errors are in the log file", options, iserr=True
+        )
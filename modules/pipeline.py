@@ -0,0 +1,58 @@
+""" Run a batch producer on its own thread so fetching from the server
+overlaps with rendering or writing what was already fetched """
+import queue
+import threading
+from typing import Any, Iterator, List
+
+# Marks the end of the batches on the queue
+DONE = object()
+
+
+def offer(batches: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put item on the queue, giving up if the consumer has stopped"""
+    while stop.is_set() is False:
+        try:
+            batches.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def produce(
+    source: Iterator[List], batches: queue.Queue, stop: threading.Event
+) -> None:
+    """Producer thread, ends with DONE or the exception that stopped us"""
+    try:
+        for batch in source:
+            if offer(batches, batch, stop) is False:
+                return
+        offer(batches, DONE, stop)
+    except Exception as err:
+        offer(batches, err, stop)
+
+
+def background(source: Iterator[List], depth: int) -> Iterator[List]:
+    """Yield the batches of source, fetched on another thread up to depth
+    batches ahead of us.  A depth of 0 just hands source back"""
+    if depth <= 0:
+        yield from source
+        return
+
+    batches: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    reader = threading.Thread(target=produce, args=(source, batches, stop), daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Also reached when the consumer stops early, the producer
+        # finishes the batch it is on and goes away
+        stop.set()
+        reader.join()
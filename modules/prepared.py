@@ -0,0 +1,203 @@
+""" Reuse the server's parse and plan for statements we run more than
+once, with PREPARE/EXECUTE on PSQL, prepared cursors on MYSQL and the
+drivers' own statement caches on ORACLE and SQLITE """
+import re
+import time
+from typing import Dict, List, Tuple, Union
+import modules.output_fun as of
+import modules.sql_text as st
+
+# Statements the servers will prepare
+PREPARE_KEYWORDS = ("select", "with", "values", "insert", "update", "delete", "merge")
+
+# psycopg2's placeholders, and the escaped % it expects with them
+FORMAT_RE = re.compile(r"%[s%]")
+
+
+def new_stats() -> Dict:
+    """Empty counters for the layout and statement caches"""
+    return {
+        "parse_hits": 0,
+        "parse_misses": 0,
+        "parse_time": 0.0,
+        "prepares": 0,
+        "hits": 0,
+        "saved": 0.0,
+    }
+
+
+def numbered(sql: str) -> str:
+    """%s placeholders to the $1, $2 ... PREPARE wants"""
+    count = 0
+
+    def number(match: re.Match) -> str:
+        nonlocal count
+        if match.group() == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return FORMAT_RE.sub(number, sql)
+
+
+def cacheable(options: Dict, sql: str) -> bool:
+    """Only single plain statements on a driver that can reuse them, large
+    results and previews go through their own streaming cursor"""
+    return (
+        options["PREPARE_SIZE"] > 0
+        and options["LARGE_RESULTS"] is False
+        and (options["ROW_LIMIT"] == 0 or options["ROW_LIMIT_PUSHED"] is True)
+        and options["ARGS"].servertype != "MSSQL"
+        and st.first_keyword(sql) in PREPARE_KEYWORDS
+        # PREPARE takes one statement, a batch runs as it is
+        and ("other", ";") not in st.scan(sql.rstrip().rstrip(";"))
+    )
+
+
+def prepare(options: Dict, entry: Dict, sql: str, values: Union[Dict, Tuple]) -> None:
+    """Prepare the statement on the server"""
+    servertype = options["ARGS"].servertype
+    start = time.perf_counter()
+    if servertype == "PSQL":
+        entry["name"] = f"isql_{options['PREPARE_SEQ']}"
+        options["PREPARE_SEQ"] += 1
+        options["CURSOR"].execute(
+            f"PREPARE {entry['name']} AS {numbered(sql) if values else sql}"
+        )
+        entry["saves"] = time.perf_counter() - start
+    elif servertype == "MYSQL":
+        # The cursor prepares on its first execute and keeps it
+        entry["cursor"] = options["CONN"].cursor(prepared=True)
+    options["PREPARE_STATS"]["prepares"] += 1
+    entry["prepared"] = True
+
+
+def run(options: Dict, entry: Dict, sql: str, values: Union[Dict, Tuple]) -> None:
+    """Execute through the prepared statement"""
+    servertype = options["ARGS"].servertype
+    if servertype == "PSQL":
+        params = ", ".join(["%s"] * len(values))
+        options["CURSOR"].execute(
+            f"EXECUTE {entry['name']}" + (f" ({params})" if values else ""),
+            values or None,
+        )
+    elif servertype == "MYSQL":
+        # Swapped back by submit_query, without closing it
+        options["CURSOR"] = entry["cursor"]
+        options["PREPARED_CURSOR"] = True
+        entry["cursor"].execute(sql, values or ())
+    elif not values:
+        # ORACLE and SQLITE find the statement in their cache by its text
+        options["CURSOR"].execute(sql)
+    else:
+        options["CURSOR"].execute(sql, values)
+
+
+def execute(options: Dict, sql: str, values: Union[Dict, Tuple]) -> None:
+    """Run the statement, preparing it the second time we see it,
+    or straight away when it has parameters"""
+    if not cacheable(options, sql):
+        if not values:
+            options["CURSOR"].execute(sql)
+        else:
+            # We found variables that needed to be substituted
+            options["CURSOR"].execute(sql, values)
+        return
+
+    cache = options["PREPARED"]
+    entry = cache.get(sql)
+    hit = entry is not None and entry["prepared"] is True
+    if entry is None:
+        entry = {"runs": 0, "hits": 0, "prepared": False, "saves": None}
+        cache[sql] = entry
+        while len(cache) > options["PREPARE_SIZE"]:
+            drop(options, next(iter(cache)))
+        # ORACLE and SQLITE cache every statement they run
+        entry["prepared"] = options["ARGS"].servertype in ("ORACLE", "SQLITE")
+    cache.move_to_end(sql)
+    try:
+        if entry["prepared"] is False and (values or entry["runs"] > 0):
+            prepare(options, entry, sql, values)
+        start = time.perf_counter()
+        if entry["prepared"] is True:
+            run(options, entry, sql, values)
+        elif not values:
+            options["CURSOR"].execute(sql)
+        else:
+            options["CURSOR"].execute(sql, values)
+        elapsed = time.perf_counter() - start
+    except Exception:
+        # It may be the statement that is broken, don't keep it
+        drop(options, sql)
+        raise
+
+    entry["runs"] += 1
+    if not hit:
+        entry["first"] = elapsed
+    else:
+        entry["hits"] += 1
+        stats = options["PREPARE_STATS"]
+        stats["hits"] += 1
+        # PSQL timed its PREPARE, elsewhere we estimate against the first run
+        stats["saved"] += (
+            entry["saves"]
+            if entry["saves"] is not None
+            else max(entry["first"] - elapsed, 0.0)
+        )
+
+
+def drop(options: Dict, sql: str) -> None:
+    """Forget a statement, releasing it on the server"""
+    entry = options["PREPARED"].pop(sql, None)
+    if entry is None:
+        return
+    try:
+        if "name" in entry:
+            cursor = options["CONN"].cursor()
+            cursor.execute(f"DEALLOCATE {entry['name']}")
+            cursor.close()
+        elif "cursor" in entry:
+            entry["cursor"].close()
+    except Exception as err:
+        # The connection may be gone, or the statement never made it
+        of.write_logfile(f"Error: {err}", options, no_print=True)
+
+
+def clear(options: Dict) -> None:
+    """Release every prepared statement"""
+    for sql in list(options["PREPARED"]):
+        drop(options, sql)
+
+
+def report(options: Dict) -> List[str]:
+    """Lines showing the hits and the time they saved"""
+    stats = options["PREPARE_STATS"]
+    misses = stats["parse_misses"]
+    per_parse = stats["parse_time"] / misses if misses else 0
+    return [
+        f"Placeholder layouts\thits = {stats['parse_hits']}"
+        f"\tmisses = {stats['parse_misses']}"
+        f"\tparse time saved = {stats['parse_hits'] * per_parse * 1000:.3f} ms",
+        f"Prepared statements\tcached = {len(options['PREPARED'])}"
+        f"/{options['PREPARE_SIZE']}\tprepares = {stats['prepares']}"
+        f"\thits = {stats['hits']}\tplan time saved = {stats['saved'] * 1000:.3f} ms",
+    ]
+
+
+def prepared_command(options: Dict, tokens: List) -> None:
+    """prepared [list|clear], show the statement cache"""
+    words = [token.lower() for token in tokens[1:] if token != ""]
+    if not words:
+        print("\n".join(report(options)))
+    elif words[0] == "list":
+        for sql, entry in options["PREPARED"].items():
+            text = " ".join(sql.split())
+            print(
+                f"runs = {entry['runs']:<6} hits = {entry['hits']:<6}"
+                f" prepared = {entry['prepared']!s:<5}  {text[:60]}"
+            )
+    elif words[0] == "clear":
+        clear(options)
+        options["PREPARE_STATS"] = new_stats()
+    else:
+        print("Usage: prepared [list|clear]")
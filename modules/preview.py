@@ -0,0 +1,128 @@
+""" :maxrows and go preview, fetch the first rows of a result and leave
+the rest on the server, optionally adding the limit to the sql """
+from typing import Any, Dict, List, Optional, Tuple
+import modules.cancel as cx
+import modules.connection as cn
+import modules.output_fun as of
+import modules.sql_text as st
+
+# Words that mean the statement already limits its rows, or that a
+# limit tacked on the end would change what it does
+LIMITED_WORDS = {"limit", "fetch", "top", "offset", "rownum", "into", "for"}
+
+
+def row_limit(options: Dict) -> int:
+    """Rows to show for this execution, 0 shows them all"""
+    if options["GO_PREVIEW"] is not None:
+        return options["GO_PREVIEW"]
+    return options["MAX_ROWS"]
+
+
+def top_position(tokens: List[Tuple[str, str]]) -> int:
+    """The token TOP goes in front of, straight after SELECT [DISTINCT|ALL]"""
+    words = [pos for pos, (kind, _) in enumerate(tokens) if kind == "word"]
+    pos = words[0] + 1
+    if len(words) > 1 and tokens[words[1]][1].lower() in ("distinct", "all"):
+        pos = words[1] + 1
+    return pos
+
+
+def push_down(sql: str, servertype: str, rows: int) -> Optional[str]:
+    """The statement with the row limit added the way the dialect
+    spells it, None when we can't add it safely"""
+    keyword = st.first_keyword(sql)
+    if keyword not in ("select", "with"):
+        return None
+    tokens = list(st.scan(sql.rstrip().rstrip(";")))
+    words = {text.lower() for kind, text in tokens if kind == "word"}
+    if words & LIMITED_WORDS or ("other", ";") in tokens:
+        return None
+
+    body = "".join(text for _, text in tokens)
+    if servertype in ("PSQL", "MYSQL", "SQLITE"):
+        # On its own line, so a trailing -- comment can't swallow it
+        return f"{body}\nLIMIT {rows}"
+    if servertype == "ORACLE":
+        return f"{body}\nFETCH FIRST {rows} ROWS ONLY"
+    if servertype == "MSSQL" and keyword == "select":
+        pos = top_position(tokens)
+        return (
+            "".join(text for _, text in tokens[:pos])
+            + f" TOP ({rows})"
+            + "".join(text for _, text in tokens[pos:])
+        )
+    return None
+
+
+def open_cursor(options: Dict, sql: str) -> Any:
+    """A cursor that streams, so we can stop after the first rows"""
+    servertype = options["ARGS"].servertype
+    limit = options["ROW_LIMIT"]
+    if servertype == "PSQL" and st.declares_cursor(sql):
+        # A cursor WITH HOLD would run the whole query when autocommit
+        # commits it, so this one lives in a transaction until we're done.
+        # Anything DECLARE can't take runs on a plain cursor below
+        cn.set_autocommit(options["CONN"], servertype, False)
+        options["PREVIEW_TXN"] = True
+        cursor = options["CONN"].cursor(name="isql_preview")
+        cursor.itersize = min(options["FETCH_SIZE"], limit + 1)
+        return cursor
+    cursor = cn.large_cursor(options, sql)
+    if servertype == "ORACLE":
+        # Don't have the server send more than we'll show
+        cursor.arraysize = min(options["FETCH_SIZE"], limit + 1)
+        cursor.prefetchrows = cursor.arraysize
+    return cursor
+
+
+def more_rows(options: Dict) -> bool:
+    """Is there a row past the limit"""
+    try:
+        return options["CURSOR"].fetchone() is not None
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        of.write_logfile(f"Error: {err}", options, no_print=True)
+        return False
+
+
+def abandon(options: Dict) -> None:
+    """Stop the server sending the rows we won't show.  PSQL, ORACLE
+    and SQLITE stop when the cursor is closed"""
+    if options["ROW_LIMIT_PUSHED"] is True:
+        # The server only had the one extra row to send
+        return
+    servertype = options["ARGS"].servertype
+    try:
+        if servertype == "MYSQL" and options.get("BACKEND_ID") is not None:
+            # Closing an unbuffered cursor reads the rest off the wire
+            cx.kill(options)
+        elif servertype == "MSSQL":
+            options["CONN"]._conn.cancel()
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        of.write_logfile(f"Error: {err}", options, no_print=True)
+
+
+def finish(options: Dict) -> None:
+    """End the transaction the PSQL preview cursor needed"""
+    if options.pop("PREVIEW_TXN", False) is False:
+        return
+    try:
+        options["CONN"].commit()
+    except Exception as err:
+        of.write_logfile(f"Error: {err}", options, no_print=True)
+    cn.set_autocommit(options["CONN"], options["ARGS"].servertype, True)
+
+
+def maxrows_command(tokens: List, options: Dict) -> None:
+    """:maxrows [n] [push|nopush], show at most n rows of each result"""
+    words = [token.lower() for token in tokens[1:] if token != ""]
+    for word in words:
+        if word.isdigit():
+            options["MAX_ROWS"] = int(word)
+        elif word in ("push", "nopush"):
+            options["ROW_PUSHDOWN"] = word == "push"
+        else:
+            print("Usage: :maxrows [n] [push|nopush], 0 shows every row")
+            return
+    print(f"MAX_ROWS = {options['MAX_ROWS']} PUSHDOWN = {options['ROW_PUSHDOWN']}")
@@ -5,8 +5,18 @@ import time
 import numbers
 import modules.output_fun as of
 import modules.shell as sh
+import modules.snippets as sn
 import modules.output_settings as op
+import modules.bulk_import as bi
 import modules.execute_query as eq
+import modules.export as ex
+import modules.fan_out as fo
+import modules.history as hi
+import modules.load_test as lt
+import modules.param_file as pf
+import modules.script_runner as sr
+import modules.substitute_vars as sv
+import modules.timing as tm
 
 
 def process_input_file(options: Dict, filename: str = "") -> None:
@@ -31,49 +41,144 @@ def handle_go_options(tokens: List, options: Dict) -> Tuple[int, int]:
     repeat = 1
     pause = 0
     token_cnt = len(tokens)
-    if token_cnt == 1:  # There are no more arguments
-        return repeat, pause
-
-    if tokens[1] == ">":
-        options["ARGS"].output = tokens[2]
-        if options["OUTPUT_METHOD"] == "rich":
-            if options["OUTPUT_CSV"] is False:
-                print("** NOTE: rich output not written to output file **")
-                print("** Change to pretty, default, or set CSV **")
-    elif isinstance(int(tokens[1]), numbers.Number):
-        repeat = int(tokens[1])
-        if token_cnt > 2:
-            if tokens[2].lower() == "wait":
-                if token_cnt > 3:
-                    if tokens[3].isdigit() is True:
-                        pause = int(tokens[3])
-                else:
-                    raise ValueError("Invalid wait time specified")
+    pos = 1
+    while pos < token_cnt:
+        token = tokens[pos].lower()
+        if token == "":
+            # Skip the extra spaces
+            pos += 1
+        elif token == ">":
+            if pos + 1 == token_cnt:
+                raise ValueError("No output file specified")
+            options["ARGS"].output = tokens[pos + 1]
+            if options["OUTPUT_METHOD"] == "rich":
+                if ex.output_format(options) == "text":
+                    print("** NOTE: rich output not written to output file **")
+                    print("** Change to pretty, default, or set CSV **")
+            pos += 2
+        elif token == "wait":
+            if pos + 1 == token_cnt or tokens[pos + 1].isdigit() is False:
+                raise ValueError("Invalid wait time specified")
+            pause = int(tokens[pos + 1])
+            pos += 2
+        elif token == "large":
+            # Use a server side cursor for this execution only
+            options["LARGE_RESULTS"] = True
+            pos += 1
+        elif token == "parallel":
+            if pos + 1 == token_cnt or tokens[pos + 1].isdigit() is False:
+                raise ValueError("Invalid number of connections specified")
+            options["GO_PARALLEL"] = int(tokens[pos + 1])
+            pos += 2
+        elif token == "discard":
+            # Fetch the results but don't render them
+            options["GO_DISCARD"] = True
+            pos += 1
+        elif token == "ttl":
+            if pos + 1 == token_cnt or tokens[pos + 1].isdigit() is False:
+                raise ValueError("Invalid ttl specified")
+            options["GO_TTL"] = int(tokens[pos + 1])
+            pos += 2
+        elif token == "on":
+            # Run on every server in the list
+            if pos + 1 == token_cnt:
+                raise ValueError("No server list specified")
+            options["GO_ON"] = tokens[pos + 1]
+            pos += 2
+        elif token == "limit":
+            if pos + 1 == token_cnt or tokens[pos + 1].isdigit() is False:
+                raise ValueError("Invalid server limit specified")
+            options["GO_LIMIT"] = int(tokens[pos + 1])
+            pos += 2
+        elif token == "with":
+            # Run once for each row of a parameter file
+            if pos + 1 == token_cnt:
+                raise ValueError("No parameter file specified")
+            options["GO_WITH"] = tokens[pos + 1]
+            pos += 2
+        elif token == "batch":
+            if pos + 1 == token_cnt or tokens[pos + 1].isdigit() is False:
+                raise ValueError("Invalid batch size specified")
+            options["GO_BATCH"] = max(int(tokens[pos + 1]), 1)
+            pos += 2
+        elif token == "preview":
+            # Only fetch the first rows
+            options["GO_PREVIEW"] = options["MAX_ROWS"] or options["PREVIEW_ROWS"]
+            if pos + 1 < token_cnt and tokens[pos + 1].isdigit():
+                options["GO_PREVIEW"] = int(tokens[pos + 1])
+                pos += 1
+            pos += 1
+        elif token == "sample":
+            # Show a sample of the results from a parallel run
+            options["GO_SAMPLE"] = True
+            pos += 1
+        elif isinstance(int(tokens[pos]), numbers.Number):
+            repeat = int(tokens[pos])
+            pos += 1
 
     return repeat, pause
 
 
 def go_function(options: Dict, tokens: List) -> None:
     """Go signals us to execute the SQL Buffer"""
-    # End the batch, append to history and then execute the query,
-    # reset buffers and line counters
-    options["HISTORY"].append(options["SQL_BUFFER"])
+    # End the batch, execute the query, record it in the history
+    # and reset buffers and line counters
+    sql = options["SQL_BUFFER"]
+    started = time.perf_counter()
     tmp_out = options["ARGS"].output
+    tmp_large = options["LARGE_RESULTS"]
     options["SIG_INT"] = False
     options["ERROR"] = False
+    options["TIMING_TOTALS"] = {}
     try:
         repeat, pause = handle_go_options(tokens, options)
+        if options["GO_WITH"] is not None:
+            # Once per row of the parameter file, parallel k spreads
+            # the queries across connections
+            pf.run_with_params(options)
+            repeat = 0
+        elif options["GO_ON"] is not None:
+            # Fan out, the buffer runs once on each server in the list
+            fo.run_fan_out(options, sv.analyze_query(options))
+            repeat = 0
+        elif options["GO_PARALLEL"] > 0:
+            # Load test, the repeats are spread across connections
+            lt.run_parallel(options, repeat, pause, sv.analyze_query(options))
         # check for repeat and continue unless we get an interrupt or error
-        while (repeat != 0) and (not options["SIG_INT"]) and (not options["ERROR"]):
+        while (
+            (options["GO_PARALLEL"] == 0 or options["GO_WITH"] is not None)
+            and (repeat != 0)
+            and (not options["SIG_INT"])
+            and (not options["ERROR"])
+        ):
             eq.submit_query(options)
             repeat = repeat - 1
             if repeat != 0:
                 time.sleep(pause)
     except ValueError as err:
         of.write_logfile(f"Error: {err}", options)
+    if options["TIMING_ON"] is True and options["TIMING_TOTALS"].get("runs", 0) > 1:
+        print("\n".join(tm.summary(options)))
+    hi.add(
+        options,
+        sql,
+        time.perf_counter() - started,
+        options["TIMING_TOTALS"].get("rows", 0),
+    )
+    options["GO_PARALLEL"] = 0
+    options["GO_SAMPLE"] = False
+    options["GO_DISCARD"] = False
+    options["GO_TTL"] = None
+    options["GO_ON"] = None
+    options["GO_LIMIT"] = 0
+    options["BIND_VALUES"] = None
+    options["GO_WITH"] = None
+    options["GO_PREVIEW"] = None
+    options["GO_BATCH"] = options["IMPORT_BATCH"]
     options["LINE_NO"] = 1
     options["SQL_BUFFER"] = ""
     options["ARGS"].output = tmp_out
+    options["LARGE_RESULTS"] = tmp_large
 
 
 def get_history(tokens: List, options: Dict) -> None:
@@ -87,6 +192,15 @@ def get_history(tokens: List, options: Dict) -> None:
         options["SQL_BUFFER"] = options["HISTORY"][-1]
         print(options["SQL_BUFFER"])
         options["LINE_NO"] += 1
+    elif tokens[0][1] == "?":  # Newest command holding the terms
+        terms = [token for token in [tokens[0][2:]] + tokens[1:] if token != ""]
+        found = hi.latest_match(options, terms) if terms else None
+        if found is None:
+            print("No history matches")
+            return
+        options["SQL_BUFFER"] = found
+        print(options["SQL_BUFFER"])
+        options["LINE_NO"] += 1
     else:
         print(f"Unknown option {tokens[0]}")
 
@@ -104,6 +218,10 @@ def shell_out(input_line: str, options: Dict) -> None:
         sh.load_file(input_line[5:].strip(), options)
     elif input_line[1:5].lower() == "exec":
         process_input_file(options, filename=input_line[5:].strip())
+    elif input_line[1:7].lower() == "import":
+        bi.import_file(input_line[7:].strip(), options)
+    elif input_line[1:4].lower() == "run" and input_line[4:5].strip() == "":
+        sr.run_script(input_line[4:].strip(), options)
     elif input_line[1:4].lower() == "def":
         key, value = input_line[4:].split("=")
         os.putenv(key.strip(), value.strip())
@@ -114,12 +232,13 @@ def shell_out(input_line: str, options: Dict) -> None:
 def get_snippet(tokens: List, options: Dict) -> None:
     """Check for a snippet and load if found"""
     cmd = tokens[0][1:].strip()
-    if cmd in options["CACHE"]:
-        options["SQL_BUFFER"] += "".join(options["CACHE"][cmd])
+    snippets = sn.get_snippet_list(options)
+    if cmd in snippets:
+        options["SQL_BUFFER"] += "".join(sn.get_snippet_text(snippets[cmd]))
         print(options["SQL_BUFFER"])
         options["LINE_NO"] += 1
     elif cmd.lower() == "list":
-        for name in options["CACHE"]:
+        for name in snippets:
             print(name)
     else:
         print(f"{cmd} is not in snippet code cache")
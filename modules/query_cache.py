@@ -0,0 +1,128 @@
+""" Opt in cache of read only query results, so repeated queries
+don't have to go back to the server until they expire or the
+session writes something """
+import pickle
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+import modules.sql_text as st
+
+
+def make_key(options: Dict, sql: str, values: Union[Dict, Tuple]) -> Tuple:
+    """The server and database we are connected to, the normalized
+    sql text and the bound values"""
+    args = options["ARGS"]
+    server = args.sqlitedb if args.servertype == "SQLITE" else args.server
+    database = options["SESSION"]["database"] or args.database
+    bound = tuple(sorted(values.items())) if isinstance(values, dict) else tuple(values)
+    return args.servertype, server, database, st.normalize(sql), bound
+
+
+def check(options: Dict, sql: str, values: Union[Dict, Tuple]) -> Optional[Dict]:
+    """Look for a fresh cached result for this query.  Anything that
+    isn't read only empties the cache, since it may change the data"""
+    options["QCACHE_KEY"] = None
+    if options["QUERY_CACHE"] is False:
+        return None
+    if not st.is_read_only(sql):
+        invalidate(options)
+        return None
+
+    key = make_key(options, sql, values)
+    cache = options["QCACHE"]
+    entry = cache.get(key)
+    if entry is not None and time.time() - entry["time"] > entry["ttl"]:
+        drop(options, key)
+        entry = None
+    if entry is None:
+        # Capture the rows as they are fetched so we can store them
+        options["QCACHE_KEY"] = key
+        options["QCACHE_SETS"] = []
+        options["QCACHE_BYTES"] = 0
+        options["QCACHE_STATS"]["misses"] += 1
+        return None
+
+    cache.move_to_end(key)
+    options["QCACHE_STATS"]["hits"] += 1
+    return entry
+
+
+def start_set(options: Dict, headers: List) -> None:
+    """A new result set is starting"""
+    if options.get("QCACHE_KEY") is not None:
+        options["QCACHE_SETS"].append(
+            {"names": [head[0] for head in headers], "rows": [], "complete": False}
+        )
+
+
+def capture(options: Dict, rows: List, complete: bool) -> None:
+    """Keep the fetched rows, complete is set once we have seen
+    the end of the result set"""
+    if options.get("QCACHE_KEY") is None or not options["QCACHE_SETS"]:
+        return
+    current = options["QCACHE_SETS"][-1]
+    current["rows"].extend(rows)
+    current["complete"] = current["complete"] or complete
+    # A rough size, the real one is checked when we store it
+    options["QCACHE_BYTES"] += len(rows) * len(current["names"]) * 16
+    if options["QCACHE_BYTES"] > options["QUERY_CACHE_SIZE"]:
+        # Too big to ever fit, stop holding on to it
+        options["QCACHE_KEY"] = None
+        options["QCACHE_SETS"] = []
+
+
+def store(options: Dict) -> None:
+    """Save what we captured if we fetched every result set to the end"""
+    key = options.get("QCACHE_KEY")
+    options["QCACHE_KEY"] = None
+    sets = options.pop("QCACHE_SETS", [])
+    if key is None or not sets or not all(item["complete"] for item in sets):
+        return
+
+    data = pickle.dumps(
+        [(item["names"], item["rows"]) for item in sets],
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    if len(data) > options["QUERY_CACHE_SIZE"]:
+        return
+    ttl = options["QUERY_CACHE_TTL"]
+    if options["GO_TTL"] is not None:
+        ttl = options["GO_TTL"]
+    cache = options["QCACHE"]
+    drop(options, key)
+    cache[key] = {"time": time.time(), "ttl": ttl, "data": data}
+    options["QCACHE_STATS"]["bytes"] += len(data)
+    # Evict the least recently used until we are back under the cap
+    while options["QCACHE_STATS"]["bytes"] > options["QUERY_CACHE_SIZE"]:
+        drop(options, next(iter(cache)))
+
+
+def result_sets(entry: Dict) -> List:
+    """Unpack the cached (names, rows) result sets"""
+    return pickle.loads(entry["data"])
+
+
+def drop(options: Dict, key: Tuple) -> None:
+    """Remove one entry"""
+    entry = options["QCACHE"].pop(key, None)
+    if entry is not None:
+        options["QCACHE_STATS"]["bytes"] -= len(entry["data"])
+
+
+def same_server(options: Dict, other: Dict) -> bool:
+    """Do the two sets of options connect to the same server, any
+    database on it may be read through the other"""
+    args, other_args = options["ARGS"], other["ARGS"]
+    if args.servertype != other_args.servertype:
+        return False
+    if args.servertype == "SQLITE":
+        return args.sqlitedb == other_args.sqlitedb
+    return (args.server, args.port) == (other_args.server, other_args.port)
+
+
+def invalidate(options: Dict) -> None:
+    """Something wrote to the database, nothing cached can be trusted"""
+    if options["QCACHE"]:
+        options["QCACHE_STATS"]["invalidations"] += 1
+    options["QCACHE"] = OrderedDict()
+    options["QCACHE_STATS"]["bytes"] = 0
@@ -0,0 +1,122 @@
+""" Keep the rows of the last few result sets on disk so they can be
+redisplayed in any output format without going back to the server """
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+import modules.output_fun as of
+import modules.timing as tm
+
+
+def cache_dir(options: Dict) -> str:
+    """Our private directory for the cache files"""
+    if "RESULTS_CACHE_DIR" not in options:
+        options["RESULTS_CACHE_DIR"] = tempfile.mkdtemp(prefix="isql_cache_")
+    return options["RESULTS_CACHE_DIR"]
+
+
+def start(options: Dict, headers: List) -> None:
+    """Open a new cache entry for the result set we are about to fetch"""
+    if options["CACHE_ENTRIES"] == 0:
+        return
+    options["RESULTS_CACHE_SEQ"] = options.get("RESULTS_CACHE_SEQ", 0) + 1
+    path = os.path.join(cache_dir(options), f"{options['RESULTS_CACHE_SEQ']}.cache")
+    options["CACHE_ENTRY"] = {
+        "id": options["RESULTS_CACHE_SEQ"],
+        "sql": options["SQL_BUFFER"],
+        "names": [head[0] for head in headers],
+        "large": options["LARGE_RESULTS"],
+        "time": time.time(),
+        "path": path,
+        "offsets": [],
+        "rows": 0,
+        "size": 0,
+        "file": open(path, "wb"),
+    }
+
+
+def add(options: Dict, rows: List) -> None:
+    """Append a fetched batch to the open entry"""
+    entry = options.get("CACHE_ENTRY")
+    if entry is None or not rows:
+        return
+    with tm.phase(options, "cache"):
+        begin = entry["file"].tell()
+        pickle.dump(rows, entry["file"], protocol=pickle.HIGHEST_PROTOCOL)
+        end = entry["file"].tell()
+    entry["offsets"].append((begin, end))
+    entry["rows"] += len(rows)
+    entry["size"] = end
+    tm.count_bytes(options, end - begin)
+    if end > options["CACHE_SIZE"]:
+        # This one result is bigger than the whole budget, drop it
+        of.write_logfile("Result too large to cache", options, no_print=True)
+        entry["file"].close()
+        os.remove(entry["path"])
+        del options["CACHE_ENTRY"]
+
+
+def finish(options: Dict) -> None:
+    """Close the open entry, make it the newest and evict as needed"""
+    entry = options.pop("CACHE_ENTRY", None)
+    if entry is None:
+        return
+    entry["file"].close()
+    del entry["file"]
+    cache = options.setdefault("RESULTS_CACHE", OrderedDict())
+    cache[entry["id"]] = entry
+    evict(options)
+
+
+def evict(options: Dict) -> None:
+    """Drop the least recently used entries until we are in budget"""
+    cache = options.get("RESULTS_CACHE", OrderedDict())
+    total = sum(entry["size"] for entry in cache.values())
+    while cache and (
+        len(cache) > options["CACHE_ENTRIES"] or total > options["CACHE_SIZE"]
+    ):
+        _, entry = cache.popitem(last=False)
+        total -= entry["size"]
+        try:
+            os.remove(entry["path"])
+        except OSError as err:
+            of.write_logfile(f"Error: {err}", options, no_print=True)
+
+
+def entries(options: Dict) -> List[Dict]:
+    """The cached entries, newest query first"""
+    cache = options.get("RESULTS_CACHE", OrderedDict())
+    return sorted(cache.values(), key=lambda entry: entry["id"], reverse=True)
+
+
+def lookup(options: Dict, index: int) -> Optional[Dict]:
+    """Find the entry by its position in the list, 1 is the newest,
+    and mark it as recently used"""
+    cached = entries(options)
+    if index < 1 or index > len(cached):
+        return None
+    entry = cached[index - 1]
+    options["RESULTS_CACHE"].move_to_end(entry["id"])
+    return entry
+
+
+def read(entry: Dict) -> Iterator[List]:
+    """Memory map the entry and unpickle it a batch at a time"""
+    if entry["size"] == 0:
+        return
+    with open(entry["path"], "rb") as cache_file:
+        with mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for begin, end in entry["offsets"]:
+                yield pickle.loads(mapped[begin:end])
+
+
+def clear(options: Dict) -> None:
+    """Remove the cache files, used on exit"""
+    if "RESULTS_CACHE_DIR" in options:
+        shutil.rmtree(options["RESULTS_CACHE_DIR"], ignore_errors=True)
+        del options["RESULTS_CACHE_DIR"]
+    options["RESULTS_CACHE"] = OrderedDict()
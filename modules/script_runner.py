@@ -0,0 +1,420 @@
+""" Run a (possibly huge) sql script file, streaming it through a lexer
+that splits it into statements and committing them in batches """
+import codecs
+import gzip
+import itertools
+import os
+import re
+import time
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+import modules.cancel as cx
+import modules.connection as cn
+import modules.output_fun as of
+import modules.pipeline as pl
+import modules.query_cache as qc
+import modules.sql_text as st
+
+USAGE = "Usage: @run <file> [commit n] [continue] [go]"
+
+# Bytes read from the file at a time
+BLOCK_SIZE = 1048576
+
+# Flush the pending statements early once they hold this much text
+MAX_PENDING = 16 * 1048576
+
+# Everything up to the next thing the splitter has to act on: plain text,
+# quoted strings and comments are skipped in one go, strings and comments
+# that don't end in the text we have yet stop it at their opening.  A go
+# line includes the line break before it, so the text starts with one
+TOKEN_SQL = r"""
+    (?:
+        [^;'"`\[\-/$\n]+
+        |{single}|{double}|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?\*/
+        |(?<!\w)(?P<tag>\$(?:[A-Za-z_]\w*)?\$).*?(?P=tag)
+        |-(?!-)|/(?!\*)|(?<=\w)\$|\$(?!(?:[A-Za-z_]\w*)?\$)
+        |\n(?![ \t]*go[ \t]*(?:\r?\n|\Z))
+    )*
+    (?:
+        (?P<go>\n[ \t]*go[ \t]*(?=\r?\n|\Z))
+        |(?P<semi>;)
+        |(?P<open>['"`\[]|/\*|\$(?:[A-Za-z_]\w*)?\$)
+        |(?P<end>\Z)
+    )
+"""
+FLAGS = re.DOTALL | re.IGNORECASE | re.VERBOSE
+TOKEN_RE = re.compile(
+    TOKEN_SQL.format(single=r"'(?:[^']|'')*'", double=r'"(?:[^"]|"")*"'), FLAGS
+)
+# MYSQL also escapes quotes with a backslash
+BACKSLASH_TOKEN_RE = re.compile(
+    TOKEN_SQL.format(
+        single=r"'(?:[^'\\]|''|\\.)*'", double=r'"(?:[^"\\]|""|\\.)*"'
+    ),
+    FLAGS,
+)
+
+# The rest of a quoted string or comment, after its opening
+CLOSE_RE = {
+    "'": re.compile(r"(?:[^']|'')*'"),
+    '"': re.compile(r'(?:[^"]|"")*"'),
+    "`": re.compile(r"[^`]*`"),
+    "[": re.compile(r"[^\]]*\]"),
+    "/*": re.compile(r".*?\*/", re.DOTALL),
+}
+BACKSLASH_CLOSE_RE = {
+    "'": re.compile(r"(?:[^'\\]|''|\\.)*'", re.DOTALL),
+    '"': re.compile(r'(?:[^"\\]|""|\\.)*"', re.DOTALL),
+}
+
+# Nothing but whitespace and comments
+BLANK_RE = re.compile(r"(?:\s+|--[^\n]*|/\*.*?\*/)*", re.DOTALL)
+
+# Statements with a BEGIN ... END body that holds its own ;
+BLOCK_RE = re.compile(
+    r"(?:\s+|--[^\n]*|/\*.*?\*/)*(?:create|alter)\s+(?:or\s+(?:replace|alter)\s+)?"
+    r"(?:definer\s*=\s*\S+\s+)?(?:temp(?:orary)?\s+)?"
+    r"(?:trigger|procedure|proc|function|package|type\s+body)\b",
+    re.DOTALL | re.IGNORECASE,
+)
+
+# Words after BEGIN that start a transaction, not a block
+BEGIN_TRANSACTION = ("tran", "transaction", "distributed")
+
+# Words after END that close a statement we don't count
+END_OTHER = ("if", "loop", "while", "repeat")
+
+# Transaction control in the script, we do our own
+TRANSACTION_RE = re.compile(
+    r"\s*(?:(?:begin|start)(?:\s+(?:transaction|work|deferred|immediate|exclusive))?"
+    r"|(?:commit|end|rollback)(?:\s+(?:transaction|work))?)\s*",
+    re.IGNORECASE,
+)
+
+
+class ScriptError(Exception):
+    """A statement failed and we are not continuing"""
+
+    def __init__(self, line: int, err: Exception) -> None:
+        super().__init__(f"line {line}: {str(err).strip()}")
+        self.line = line
+
+
+def parse_run(line: str, options: Dict) -> Tuple[str, Dict]:
+    """<file> [commit n] [continue] [go]"""
+    tokens = line.split()
+    if not tokens:
+        raise ValueError(USAGE)
+    settings = {
+        "commit": options["SCRIPT_COMMIT"],
+        "continue": options["SCRIPT_CONTINUE"],
+        "go": False,
+    }
+    pos = 1
+    while pos < len(tokens):
+        name = tokens[pos].lower()
+        if name in ("continue", "go"):
+            settings[name] = True
+            pos += 1
+        elif name == "commit" and pos + 1 < len(tokens):
+            if tokens[pos + 1].isdigit() is False:
+                raise ValueError(f"Invalid commit size {tokens[pos + 1]}")
+            settings["commit"] = int(tokens[pos + 1])
+            pos += 2
+        else:
+            raise ValueError(USAGE)
+    settings["commit"] = max(settings["commit"], 1)
+
+    return tokens[0], settings
+
+
+def read_blocks(infile: BinaryIO, state: Dict) -> Iterator[str]:
+    """The file as text, a block at a time, counting the bytes read"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = infile.read(BLOCK_SIZE)
+        state["bytes"] += len(data)
+        if not data:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(data)
+
+
+def in_block(sql: str) -> bool:
+    """Is the ; at the end of this text inside a BEGIN ... END (or
+    CASE ... END) of a trigger, procedure or function body"""
+    words = [text.lower() for kind, text in st.scan(sql) if kind == "word"]
+    depth = 0
+    for pos, word in enumerate(words):
+        after = words[pos + 1] if pos + 1 < len(words) else ""
+        if word == "begin" and after not in BEGIN_TRANSACTION:
+            depth += 1
+        elif word == "case" and (pos == 0 or words[pos - 1] != "end"):
+            depth += 1
+        elif word == "end" and after not in END_OTHER:
+            depth -= 1
+    return depth > 0
+
+
+def split_statements(
+    blocks: Iterator[str], servertype: str, go_only: bool = False
+) -> Iterator[Tuple[int, str]]:
+    """(line number, statement) for each statement in the text, they end
+    with a ; or a line with just go on it (only go when go_only is set).
+    Quotes, identifiers, comments and PSQL $$ bodies are skipped over, as
+    are the ; inside the BEGIN ... END of a trigger or procedure"""
+    token_re = BACKSLASH_TOKEN_RE if servertype == "MYSQL" else TOKEN_RE
+    close_re = dict(CLOSE_RE)
+    if servertype == "MYSQL":
+        close_re.update(BACKSLASH_CLOSE_RE)
+    text = "\n"
+    start = 0  # Where the statement we are in started
+    pos = 0
+    line = 0  # The line start is on
+    inside: Optional[str] = None  # The opening of the string we are in
+    for block in itertools.chain(blocks, [None]):
+        if block is None:
+            end = len(text)
+        else:
+            # Drop the statements we are done with once per block
+            text = text[start:] + block
+            pos -= start
+            start = 0
+            # Stop at the last line break, we can't tell if a go line
+            # follows it until we have the next block
+            end = max(text.rfind("\n"), 0)
+        while pos < end:
+            if inside is not None:
+                if inside in close_re:
+                    match = close_re[inside].match(text, pos, end)
+                    found = -1 if match is None else match.end()
+                else:
+                    found = text.find(inside, pos, end)
+                    found = -1 if found == -1 else found + len(inside)
+                if found == -1:
+                    # None of these can end on a line break, so carry on
+                    # with the next block
+                    pos = end
+                    break
+                pos = found
+                inside = None
+                continue
+            match = token_re.match(text, pos, end)
+            kind = match.lastgroup
+            if kind == "open":
+                inside = match.group(kind)
+            elif (
+                kind == "semi"
+                and BLOCK_RE.match(text, start, end) is not None
+                and in_block(text[start : match.start(kind)])
+            ):
+                pass
+            elif kind == "go" or (kind == "semi" and go_only is False):
+                sql = text[start : match.start(kind)]
+                if BLANK_RE.fullmatch(sql) is None:
+                    lead = len(sql) - len(sql.lstrip())
+                    yield line + sql.count("\n", 0, lead), sql.strip()
+                line += text.count("\n", start, match.end())
+                start = match.end()
+            pos = match.end()
+    sql = text[start:]
+    if BLANK_RE.fullmatch(sql) is None:
+        lead = len(sql) - len(sql.lstrip())
+        yield line + sql.count("\n", 0, lead), sql.strip()
+
+
+def progress(options: Dict, state: Dict, final: bool = False) -> None:
+    """Show statements/sec and MB/sec every IMPORT_PROGRESS seconds"""
+    now = time.perf_counter()
+    if final is False and now - state["last"] < options["IMPORT_PROGRESS"]:
+        return
+    state["last"] = now
+    elapsed = now - state["start"]
+    rate = state["statements"] / elapsed if elapsed > 0 else 0
+    mbytes = state["bytes"] / 1048576
+    speed = mbytes / elapsed if elapsed > 0 else 0
+    done = f" ({100 * state['bytes'] / state['size']:.0f}%)" if state["size"] else ""
+    if options["ARGS"].quiet is not True:
+        print(
+            f"\rStatements = {state['statements']}  Stmts/sec = {rate:.0f}"
+            f"  MB = {mbytes:.1f}{done}  MB/sec = {speed:.1f}  ",
+            end="",
+            flush=True,
+        )
+        if final is True:
+            print()
+
+
+def execute(cursor: Any, sql: str) -> None:
+    """Run one statement, reading any rows it returns"""
+    cursor.execute(sql)
+    if cursor.description is not None:
+        # Some drivers won't run the next statement until the rows are read
+        cursor.fetchall()
+
+
+def run_one(conn: Any, cursor: Any, sql: str, servertype: str) -> None:
+    """Run and commit a single statement"""
+    if servertype == "SQLITE":
+        conn.executescript(sql)
+    else:
+        execute(cursor, sql)
+        conn.commit()
+
+
+def flush(
+    conn: Any, cursor: Any, pending: List, settings: Dict, options: Dict, state: Dict
+) -> None:
+    """Run the pending statements as one transaction.  If it fails they
+    are run again one at a time, committing each, to find the statement
+    that failed, which stops us unless we are continuing past errors"""
+    servertype = options["ARGS"].servertype
+    try:
+        if servertype == "SQLITE":
+            # One executescript per batch is SQLITE's fast path
+            conn.executescript(
+                "BEGIN;\n" + "".join(f"{sql}\n;\n" for _, sql in pending) + "COMMIT;"
+            )
+        else:
+            for _, sql in pending:
+                execute(cursor, sql)
+            conn.commit()
+        state["statements"] += len(pending)
+        return
+    except Exception:
+        conn.rollback()
+        if options["SIG_INT"] is True:
+            raise
+
+    for line, sql in pending:
+        if options["SIG_INT"] is True:
+            raise ScriptError(line, Exception("Cancelled"))
+        try:
+            run_one(conn, cursor, sql, servertype)
+            state["statements"] += 1
+        except Exception as err:
+            conn.rollback()
+            if settings["continue"] is False or options["SIG_INT"] is True:
+                raise ScriptError(line, err) from err
+            state["errors"].append((line, str(err).strip()))
+            of.write_logfile(f"Error: line {line}: {err}", options, no_print=True)
+
+
+def run_statements(
+    statements: Iterator[Tuple[int, str]], settings: Dict, options: Dict, state: Dict
+) -> None:
+    """Send the statements in batches of commit, or less when they are big"""
+    conn = options["CONN"]
+    servertype = options["ARGS"].servertype
+    cursor = conn.cursor()
+    cn.set_autocommit(conn, servertype, False)
+    pending: List[Tuple[int, str]] = []
+    size = 0
+    options["QUERY_RUNNING"] = True
+    try:
+        for line, sql in statements:
+            if options["SIG_INT"] is True:
+                break
+            if TRANSACTION_RE.fullmatch(sql):
+                continue
+            pending.append((line, sql))
+            size += len(sql)
+            if len(pending) >= settings["commit"] or size >= MAX_PENDING:
+                flush(conn, cursor, pending, settings, options, state)
+                pending = []
+                size = 0
+                progress(options, state)
+        if pending and options["SIG_INT"] is False:
+            flush(conn, cursor, pending, settings, options, state)
+    finally:
+        options["QUERY_RUNNING"] = False
+        cn.set_autocommit(conn, servertype, True)
+        cursor.close()
+
+
+def run_script(line: str, options: Dict) -> None:
+    """@run file.sql[.gz] [commit n] [continue] [go]"""
+    try:
+        filename, settings = parse_run(line, options)
+    except ValueError as err:
+        print(f"Error: {err}")
+        return
+
+    options["SIG_INT"] = False
+    now = time.perf_counter()
+    state = {
+        "start": now,
+        "last": now,
+        "statements": 0,
+        "bytes": 0,
+        "size": 0,
+        "errors": [],
+    }
+    try:
+        if filename.endswith(".gz"):
+            infile = gzip.open(filename, "rb")
+        else:
+            infile = open(filename, "rb")
+            state["size"] = os.path.getsize(filename)
+    except OSError as err:
+        of.write_logfile(f"Error: {err}", options, iserr=True)
+        return
+    try:
+        with infile:
+            # Reading and decoding the file overlaps with the server's work
+            blocks = pl.background(
+                read_blocks(infile, state), options["PIPELINE_DEPTH"]
+            )
+            run_statements(
+                split_statements(blocks, options["ARGS"].servertype, settings["go"]),
+                settings,
+                options,
+                state,
+            )
+    except ScriptError as err:
+        progress(options, state, final=True)
+        of.write_logfile(f"Error: {err}", options, iserr=True)
+        of.write_logfile(
+            f"{filename} stopped at line {err.line}, the statements before it"
+            " were committed",
+            options,
+            iserr=True,
+        )
+        return
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        progress(options, state, final=True)
+        if options["SIG_INT"] is True:
+            of.write_logfile("Script cancelled", options)
+            of.write_logfile(
+                "Statements since the last commit were rolled back", options
+            )
+            cx.after_cancel(options)
+        else:
+            of.write_logfile(f"Error: {err}", options, iserr=True)
+        return
+    finally:
+        # Whatever was committed before a failure changed the data
+        qc.invalidate(options)
+
+    progress(options, state, final=True)
+    if options["SIG_INT"] is True:
+        of.write_logfile("Script cancelled", options)
+        cx.after_cancel(options)
+    elapsed = time.perf_counter() - state["start"]
+    rate = state["statements"] / elapsed if elapsed > 0 else 0
+    speed = state["bytes"] / 1048576 / elapsed if elapsed > 0 else 0
+    errors = state["errors"]
+    of.write_logfile(
+        f"Ran {state['statements']} statements from {filename}"
+        f"\tElapsed = {elapsed:.4f}\tStatements/sec = {rate:.0f}"
+        f"\tMB/sec = {speed:.1f}\tErrors = {len(errors)}",
+        options,
+    )
+    for err_line, error in errors[:10]:
+        of.write_logfile(f"Error: line {err_line}: {error}", options, iserr=True)
+    if len(errors) > 10:
+        of.write_logfile(
+            f"{len(errors) - 10} more errors are in the log file", options, iserr=True
+        )
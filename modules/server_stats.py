@@ -0,0 +1,224 @@
+""" :serverstats, the server's own counters for each query (reads, buffer
+hits, cpu) shown under the results and written to the log """
+import re
+from typing import Any, Dict, List, Tuple
+import modules.output_fun as of
+
+# Where each dialect's counters come from
+SOURCES = {
+    "PSQL": "the pg_stat_statements extension",
+    "MSSQL": "SET STATISTICS IO and TIME",
+    "MYSQL": "SHOW SESSION STATUS",
+    "ORACLE": "select on v$mystat and v$statname",
+}
+
+
+# pg_stat_statements columns, summed over the entries of our user and
+# database.  The server has no per session figures, so other sessions of
+# the same user running at the same time are counted too, and an entry
+# evicted while the query ran can take the totals backwards
+PSQL_COUNTERS = (
+    "shared_blks_hit",
+    "shared_blks_read",
+    "shared_blks_dirtied",
+    "shared_blks_written",
+    "temp_blks_read",
+    "temp_blks_written",
+)
+
+# Renamed and added in PSQL 13
+PSQL_13_COUNTERS = ("total_exec_time", "wal_records", "wal_bytes")
+PSQL_12_COUNTERS = ("total_time",)
+
+# pg_stat_statements(false) leaves the query texts on disk
+PSQL_SQL = (
+    "select {sums} from pg_stat_statements(false) s where s.userid ="
+    " (select oid from pg_roles where rolname = current_user) and s.dbid ="
+    " (select oid from pg_database where datname = current_database())"
+)
+
+# Session status counters, the SHOW itself adds a little to some of them
+MYSQL_COUNTERS = (
+    "Handler_read_first",
+    "Handler_read_key",
+    "Handler_read_next",
+    "Handler_read_rnd",
+    "Handler_read_rnd_next",
+    "Handler_write",
+    "Handler_update",
+    "Handler_delete",
+    "Select_scan",
+    "Select_full_join",
+    "Sort_rows",
+    "Sort_merge_passes",
+    "Created_tmp_tables",
+    "Created_tmp_disk_tables",
+)
+
+# v$mystat statistics, CPU is in hundredths of a second
+ORACLE_COUNTERS = (
+    "session logical reads",
+    "consistent gets",
+    "db block gets",
+    "physical reads",
+    "redo size",
+    "sorts (memory)",
+    "sorts (disk)",
+    "CPU used by this session",
+)
+
+MSSQL_ON = "SET STATISTICS IO ON; SET STATISTICS TIME ON"
+MSSQL_OFF = "SET STATISTICS TIME OFF; SET STATISTICS IO OFF"
+
+# Table 't'. Scan count 1, logical reads 5, physical reads 0, ...
+MSSQL_IO_RE = re.compile(r"^Table '[^']*'\. (?P<counts>.*?)\.?$", re.M)
+MSSQL_TIME_RE = re.compile(r"CPU time = (\d+) ms,\s+elapsed time = (\d+) ms")
+
+
+def is_statistics(text: str) -> bool:
+    """Is this an MSSQL STATISTICS IO or TIME message"""
+    return bool(MSSQL_IO_RE.search(text) or MSSQL_TIME_RE.search(text))
+
+
+def psql_counters(options: Dict) -> Tuple[str, ...]:
+    """The pg_stat_statements columns this server version has"""
+    if options["CONN"].server_version >= 130000:
+        return PSQL_COUNTERS + PSQL_13_COUNTERS
+    return PSQL_COUNTERS + PSQL_12_COUNTERS
+
+
+def quoted(names: Tuple[str, ...]) -> str:
+    """The names as a sql list of literals"""
+    return ", ".join(f"'{name}'" for name in names)
+
+
+def query(options: Dict, sql: str, values: Any = None) -> List[Tuple]:
+    """Run a statement on a cursor of its own, the query's cursor
+    may still be holding rows"""
+    cursor = options["CONN"].cursor()
+    try:
+        if values is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql, values)
+        return cursor.fetchall() if cursor.description is not None else []
+    finally:
+        cursor.close()
+
+
+def snapshot(options: Dict) -> Dict[str, float]:
+    """The counters as they stand"""
+    servertype = options["ARGS"].servertype
+    if servertype == "PSQL":
+        names = psql_counters(options)
+        sums = ", ".join(f"sum({name})" for name in names)
+        rows = list(zip(names, query(options, PSQL_SQL.format(sums=sums))[0]))
+    elif servertype == "MYSQL":
+        rows = query(
+            options,
+            f"SHOW SESSION STATUS WHERE Variable_name IN ({quoted(MYSQL_COUNTERS)})",
+        )
+    else:
+        rows = query(
+            options,
+            "select n.name, m.value from v$mystat m join v$statname n"
+            " on n.statistic# = m.statistic#"
+            f" where n.name in ({quoted(ORACLE_COUNTERS)})",
+        )
+    return {name: float(value or 0) for name, value in rows}
+
+
+def mssql_counters(messages: List[str]) -> Dict[str, float]:
+    """Totals of the STATISTICS IO and TIME messages, across tables"""
+    counters: Dict[str, float] = {}
+    for text in messages:
+        for match in MSSQL_IO_RE.finditer(text):
+            for part in match["counts"].split(", "):
+                name, _, value = part.lower().rpartition(" ")
+                if value.isdigit():
+                    counters[name] = counters.get(name, 0.0) + int(value)
+        for cpu, elapsed in MSSQL_TIME_RE.findall(text):
+            prefix = "compile " if "parse and compile" in text else ""
+            for name, value in (("cpu ms", cpu), ("elapsed ms", elapsed)):
+                name = prefix + name
+                counters[name] = counters.get(name, 0.0) + int(value)
+    return counters
+
+
+def begin(options: Dict) -> None:
+    """Take the counters before the query runs"""
+    servertype = options["ARGS"].servertype
+    if options["SERVER_STATS"] is False or servertype not in SOURCES:
+        return
+    try:
+        if servertype == "MSSQL":
+            # The message handler keeps them for us rather than printing them
+            options["SERVER_MESSAGES"] = []
+            query(options, MSSQL_ON)
+            options["SERVER_BASE"] = {}
+        else:
+            options["SERVER_BASE"] = snapshot(options)
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        options["SERVER_MESSAGES"] = None
+        options["SERVER_STATS"] = False
+        of.write_logfile(
+            f"Error: server stats need {SOURCES[servertype]}, turning them off: {err}",
+            options,
+            iserr=True,
+        )
+
+
+def end(options: Dict, report: bool) -> None:
+    """Work out what the query cost the server and report it"""
+    base = options.pop("SERVER_BASE", None)
+    if base is None:
+        return
+    counters = {}
+    try:
+        if options["ARGS"].servertype == "MSSQL":
+            # Turning them off has its own compile time message
+            messages = options["SERVER_MESSAGES"][:]
+            query(options, MSSQL_OFF)
+            counters = mssql_counters(messages)
+        elif report is True:
+            after = snapshot(options)
+            # Never below 0, entries can be evicted while the query runs
+            counters = {
+                name: max(after[name] - base.get(name, 0.0), 0.0) for name in after
+            }
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        of.write_logfile(f"Error: {err}", options, no_print=True)
+    finally:
+        options["SERVER_MESSAGES"] = None
+    counters = {name: value for name, value in counters.items() if value}
+    if report is False or not counters:
+        return
+    # For the journal
+    options["SERVER_COUNTERS"] = counters
+    of.write_logfile(
+        "Server: "
+        + " ".join(
+            f"{name}={value:.3f}" if value % 1 else f"{name}={value:.0f}"
+            for name, value in counters.items()
+        ),
+        options,
+        no_print=options["ARGS"].quiet,
+    )
+
+
+def serverstats_command(tokens: List, options: Dict) -> None:
+    """:serverstats [on|off], no argument toggles it"""
+    words = [token.lower() for token in tokens[1:] if token != ""]
+    if not words:
+        options["SERVER_STATS"] = not options["SERVER_STATS"]
+    elif words == ["on"] or words == ["off"]:
+        options["SERVER_STATS"] = words[0] == "on"
+    else:
+        print("Usage: :serverstats [on|off]")
+        return
+    servertype = options["ARGS"].servertype
+    if options["SERVER_STATS"] is True and servertype not in SOURCES:
+        print(f"{servertype} doesn't report per query counters")
+    print(f"SERVER_STATS = {options['SERVER_STATS']}")
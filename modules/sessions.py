@@ -0,0 +1,250 @@
+""" Keep several named connections open and switch between them,
+each with its own buffer, history and output settings """
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+import modules.connection as cn
+import modules.env_vars as ev
+import modules.output_fun as of
+import modules.prepared as ps
+
+USAGE = (
+    "Usage: session [list] | open <name> [-T type] [-S server] [-U user]"
+    " [-P password] [-D database] [-p port] [-F sqlitedb] | use <name> | close <name>"
+)
+
+# Everything that belongs to a session rather than to isql as a whole
+SESSION_KEYS = (
+    "ARGS",
+    "CONN",
+    "CURSOR",
+    "BACKEND_ID",
+    "SESSION",
+    "ERROR",
+    "SQL_BUFFER",
+    "LINE_NO",
+    "HISTORY",
+    "CACHE",
+    "OUTPUT_METHOD",
+    "OUTPUT_STYLE",
+    "OUTPUT_ALIGN",
+    "OUTPUT_HEADER",
+    "OUTPUT_BORDER",
+    "HEADER_STYLE",
+    "OUTPUT_CSV",
+    "EXPORT_FORMAT",
+    "PAGER",
+    "PAGER_TYPE",
+    "LARGE_RESULTS",
+    "MAX_ROWS",
+    "ROW_PUSHDOWN",
+    "SERVER_STATS",
+    "QCACHE",
+    "QCACHE_STATS",
+    "PREPARED",
+    "PREPARE_STATS",
+)
+
+# Cheapest statement each server will answer
+PING_SQL = {"ORACLE": "select 1 from dual"}
+
+
+def save_state(options: Dict) -> Dict:
+    """Take the current session out of options"""
+    state = {key: options.get(key) for key in SESSION_KEYS}
+    state["LAST_USED"] = time.time()
+    return state
+
+
+def load_state(options: Dict, state: Dict) -> None:
+    """Make state the current session"""
+    for key in SESSION_KEYS:
+        options[key] = state[key]
+
+
+def new_state(options: Dict) -> Dict:
+    """A new session starts with the current output settings,
+    but an empty buffer, history and query cache"""
+    state = save_state(options)
+    state.update(
+        {
+            "SESSION": {"database": "", "user": "", "schema": "", "stale": True},
+            "ERROR": False,
+            "SQL_BUFFER": "",
+            "LINE_NO": 1,
+            "HISTORY": [],
+            "CACHE": None,
+            "QCACHE": OrderedDict(),
+            "QCACHE_STATS": {"hits": 0, "misses": 0, "invalidations": 0, "bytes": 0},
+            "PREPARED": OrderedDict(),
+            "PREPARE_STATS": ps.new_stats(),
+        }
+    )
+    return state
+
+
+def ping(state: Dict) -> None:
+    """Run a trivial statement so the server and any firewalls in
+    between don't drop an idle connection"""
+    sql = PING_SQL.get(state["ARGS"].servertype, "select 1")
+    cursor = state["CONN"].cursor()
+    try:
+        cursor.execute(sql)
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def keepalive(options: Dict, stop: threading.Event) -> None:
+    """Background thread, ping the sessions that have sat idle
+    for SESSION_KEEPALIVE seconds"""
+    interval = options["SESSION_KEEPALIVE"]
+    while stop.wait(min(interval, 30)) is False:
+        with options["SESSION_LOCK"]:
+            for name, state in options["SESSIONS"].items():
+                if state.get("LOST") or time.time() - state["LAST_USED"] < interval:
+                    continue
+                try:
+                    ping(state)
+                    state["LAST_USED"] = time.time()
+                except Exception as err:
+                    # Reconnect when someone switches back to it
+                    state["LOST"] = True
+                    of.write_logfile(
+                        f"Session {name} keepalive failed: {err}",
+                        options,
+                        no_print=True,
+                    )
+
+
+def start_keepalive(options: Dict) -> None:
+    """Start the keepalive thread with the first extra session"""
+    if options["SESSION_KEEPALIVE"] <= 0 or "SESSION_STOP" in options:
+        return
+    options["SESSION_STOP"] = threading.Event()
+    threading.Thread(
+        target=keepalive, args=(options, options["SESSION_STOP"]), daemon=True
+    ).start()
+
+
+def open_session(options: Dict, name: str, tokens: List) -> None:
+    """Connect a new session and switch to it"""
+    if name == options["SESSION_NAME"] or name in options["SESSIONS"]:
+        print(f"Session {name} is already open")
+        return
+    try:
+        args, rest = ev.connection_args(options, tokens)
+    except ValueError as err:
+        print(f"Error: {err}")
+        return
+    if rest or args.servertype not in cn.ConnectionDispatchTable.dispatch:
+        print(USAGE)
+        return
+
+    current = save_state(options)
+    state = new_state(options)
+    state["ARGS"] = args
+    load_state(options, state)
+    try:
+        options["CONN"] = cn.open_connection(options)
+        options["CURSOR"] = options["CONN"].cursor()
+        options["BACKEND_ID"] = cn.backend_id(options)
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        if options["CONN"] is not current["CONN"]:
+            # Connected, but the cursor or backend id failed, the error
+            # is ours to report and the new connection ours to close
+            of.write_logfile(f"Error: {err}", options, iserr=True)
+            try:
+                if options["CURSOR"] is not current["CURSOR"]:
+                    options["CURSOR"].close()
+                options["CONN"].close()
+            except Exception as close_err:
+                of.write_logfile(f"Error: {close_err}", options, no_print=True)
+        # Stay where we were
+        load_state(options, current)
+        return
+    with options["SESSION_LOCK"]:
+        options["SESSIONS"][options["SESSION_NAME"]] = current
+    options["SESSION_NAME"] = name
+    start_keepalive(options)
+    of.write_logfile(f"Opened session {name}", options)
+
+
+def use_session(options: Dict, name: str) -> None:
+    """Switch to an open session, reconnecting if it was lost"""
+    if name == options["SESSION_NAME"]:
+        return
+    with options["SESSION_LOCK"]:
+        if name not in options["SESSIONS"]:
+            print(f"No session named {name}")
+            return
+        state = options["SESSIONS"].pop(name)
+        options["SESSIONS"][options["SESSION_NAME"]] = save_state(options)
+    options["SESSION_NAME"] = name
+    load_state(options, state)
+    if state.get("LOST"):
+        of.write_logfile(f"Session {name} was lost, reconnecting", options)
+        cn.connect(options, True)
+
+
+def close_session(options: Dict, name: str) -> None:
+    """Disconnect a session other than the current one"""
+    if name == options["SESSION_NAME"]:
+        print("Switch to another session before closing this one")
+        return
+    with options["SESSION_LOCK"]:
+        state = options["SESSIONS"].pop(name, None)
+    if state is None:
+        print(f"No session named {name}")
+        return
+    try:
+        state["CURSOR"].close()
+        state["CONN"].close()
+    except Exception as err:
+        of.write_logfile(f"Error: {err}", options, no_print=True)
+    of.write_logfile(f"Closed session {name}", options)
+
+
+def list_sessions(options: Dict) -> None:
+    """Show each session and how long it has been idle"""
+    now = time.time()
+    rows = [(options["SESSION_NAME"], save_state(options), "*")]
+    with options["SESSION_LOCK"]:
+        rows += [(name, state, " ") for name, state in options["SESSIONS"].items()]
+    for name, state, marker in rows:
+        args = state["ARGS"]
+        where = args.sqlitedb if args.servertype == "SQLITE" else args.server
+        database = state["SESSION"]["database"] or args.database or ""
+        idle = now - state["LAST_USED"] if marker == " " else 0
+        lost = " (lost)" if state.get("LOST") else ""
+        print(
+            f"{marker} {name}\t{args.servertype}\t{where}\t{args.user}"
+            f"\t{database}\tidle = {idle:.0f}s{lost}"
+        )
+
+
+def close_all(options: Dict) -> None:
+    """Close every session but the current one, used on exit"""
+    if "SESSION_STOP" in options:
+        options["SESSION_STOP"].set()
+    for name in list(options["SESSIONS"]):
+        close_session(options, name)
+
+
+def session_command(options: Dict, tokens: List) -> None:
+    """session [list] | open <name> [connection flags] | use <name> | close <name>"""
+    words = [token for token in tokens[1:] if token != ""]
+    if not words or words[0].lower() == "list":
+        list_sessions(options)
+    elif len(words) < 2:
+        print(USAGE)
+    elif words[0].lower() == "open":
+        open_session(options, words[1], words[2:])
+    elif words[0].lower() == "use":
+        use_session(options, words[1])
+    elif words[0].lower() == "close":
+        close_session(options, words[1])
+    else:
+        print(USAGE)
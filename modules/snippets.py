@@ -5,7 +5,10 @@ import pathlib
 
 
 def get_snippet_list(options: Dict) -> Dict:
-    """get the snippets for our servertype"""
+    """Index the snippets for our servertype the first time one is used,
+    the text is only read when the snippet is loaded"""
+    if options.get("CACHE") is not None:
+        return options["CACHE"]
     snippet_dict = {}
     path = os.path.join(
         options["HOME"], options["SNIPPETS_PATH"], options["ARGS"].servertype
@@ -22,8 +25,9 @@ def get_snippet_list(options: Dict) -> Dict:
         name, _ = os.path.splitext(tail)
         if options["ARGS"].quiet is None:
             print("\t", name)
-        snippet_dict[str(name)] = get_snippet_text(str(snippet))
+        snippet_dict[str(name)] = str(snippet)
 
+    options["CACHE"] = snippet_dict
     return snippet_dict
 
 
@@ -0,0 +1,150 @@
+""" Lightweight inspection of the sql text in the buffer """
+import re
+from typing import Iterator, Tuple
+
+# Skip any leading whitespace and comments to find the first keyword
+LEADING_RE = re.compile(r"^(?:\s+|--[^\n]*|/\*.*?\*/)*(\w+)", re.DOTALL)
+
+# Split the text into comments, quoted strings and identifiers, words,
+# numbers, whitespace and everything else
+TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+    |(?P<string>'(?:[^']|'')*(?:'|\Z))
+    |(?P<ident>"(?:[^"]|"")*(?:"|\Z)|`[^`]*(?:`|\Z)|\[[^\]]*(?:\]|\Z))
+    |(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+    |(?P<word>\w+)
+    |(?P<space>\s+)
+    |(?P<other>.)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+# A parenthesized list of literals, once fingerprint has replaced them
+LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+# Statements that hand back a result set
+ROW_KEYWORDS = (
+    "select",
+    "with",
+    "values",
+    "table",
+    "show",
+    "explain",
+    "pragma",
+    "describe",
+    "desc",
+)
+
+# Statements that can only read
+READ_KEYWORDS = ("select", "with", "values", "table", "show")
+
+# Statements a PSQL server side cursor can be declared for
+CURSOR_KEYWORDS = ("select", "with", "values", "table")
+
+# Words that mean the statement changes something
+WRITE_WORDS = {
+    "insert",
+    "update",
+    "delete",
+    "merge",
+    "create",
+    "alter",
+    "drop",
+    "truncate",
+    "into",
+    "exec",
+    "execute",
+    "call",
+    "grant",
+    "revoke",
+    "lock",
+}
+
+# Statements that can change the database, user or schema of the session
+SESSION_KEYWORDS = ("use", "set", "reset", "revert")
+
+
+def first_keyword(sql: str) -> str:
+    """Return the first keyword of the statement in lower case"""
+    match = LEADING_RE.match(sql)
+    if match is None:
+        return ""
+    return match.group(1).lower()
+
+
+def returns_rows(sql: str) -> bool:
+    """Is this a statement that produces a result set"""
+    return first_keyword(sql) in ROW_KEYWORDS
+
+
+def scan(sql: str) -> Iterator[Tuple[str, str]]:
+    """Break the sql up into (kind, text) tokens"""
+    for match in TOKEN_RE.finditer(sql):
+        yield match.lastgroup or "other", match.group()
+
+
+def normalize(sql: str) -> str:
+    """Drop the comments and collapse whitespace outside of quotes,
+    so the same query typed differently looks the same"""
+    parts = []
+    for kind, text in scan(sql):
+        if kind in ("comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(text)
+
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def fingerprint(sql: str) -> str:
+    """The normalized text with the literals taken out and lists of
+    them collapsed, so runs with different values group together"""
+    parts = []
+    for kind, text in scan(sql):
+        if kind in ("comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        elif kind in ("string", "number"):
+            parts.append("?")
+        elif kind == "word":
+            parts.append(text.lower())
+        else:
+            parts.append(text)
+
+    return LIST_RE.sub("(?+)", "".join(parts).strip().rstrip(";").strip())
+
+
+def is_read_only(sql: str) -> bool:
+    """Only reads, so the results can be reused until something writes"""
+    if first_keyword(sql) not in READ_KEYWORDS:
+        return False
+    for kind, text in scan(sql):
+        if kind == "word" and text.lower() in WRITE_WORDS:
+            return False
+    return True
+
+
+def declares_cursor(sql: str) -> bool:
+    """Can the statement be the query of a PSQL DECLARE ... CURSOR,
+    a single read only select, with, values or table"""
+    if first_keyword(sql) not in CURSOR_KEYWORDS or not is_read_only(sql):
+        return False
+    return ("other", ";") not in scan(sql.rstrip().rstrip(";"))
+
+
+def changes_session(sql: str) -> bool:
+    """Could any statement in the text change the session database,
+    user or schema (USE, SET search_path, ALTER SESSION, EXECUTE AS)"""
+    words = []
+    for kind, text in scan(sql):
+        if kind == "other" and text == ";":
+            words = []
+        elif kind == "word" and len(words) < 2:
+            words.append(text.lower())
+            if words[0] in SESSION_KEYWORDS:
+                return True
+            if words in (["alter", "session"], ["execute", "as"], ["exec", "as"]):
+                return True
+    return False
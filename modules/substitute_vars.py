@@ -1,37 +1,58 @@
 """ Handle the ability to support placeholders in sql
 and substitute for values """
 import re
+import time
+from functools import lru_cache
 from typing import Union, Dict, Tuple
-from rich.console import Console
+import modules.output_fun as of
 
+# Our variables are bracketed by : like :var:
+VAR_RE = re.compile(r":([A-Za-z_]\w*):")
 
-console = Console()
+
+@lru_cache(maxsize=256)
+def layout(sql: str, named: bool) -> Tuple[str, Tuple[str, ...]]:
+    """The sql rewritten for the driver's placeholders and the variable
+    names in the order they appear, cached per sql text"""
+    names = tuple(match.group(1) for match in VAR_RE.finditer(sql))
+    if not names:
+        return sql, names
+    if named:
+        # SQLITE supports named substitutions which I prefer
+        return VAR_RE.sub(r":\1", sql), names
+    return VAR_RE.sub("%s", sql), names
 
 
 def analyze_query(options: Dict) -> Union[Dict, Tuple]:
     """Find all the variable definitions and substitute for them"""
-    # Our variables are bracketed by : like :var:
-    matches = re.findall(r":.+:", options["SQL_BUFFER"])
-    if options["ARGS"].servertype in ("ORACLE", "SQLITE"):
-        # SQLITE supports named substitutions which I prefer
-        local_vars = {}
-        if matches:
-            # We will prompt for the values for each variable
-            for item in matches:
-                local_vars[item[1:-1]] = console.input(f"{item}? ")
-            for item in matches:
-                options["SQL_BUFFER"] = re.sub(
-                    item, f":{item[1:-1]}", options["SQL_BUFFER"]
-                )
-        ret_val = local_vars
-    else:  # options["ARGS"].servertype in ("MSSQL", "PSQL", "MYSQL"):
-        local_var_list = []
-        if matches:
-            # We will prompt for the values for each variable
-            for item in matches:
-                local_var_list.append(console.input(f"{item}? "))
-            for item in matches:
-                options["SQL_BUFFER"] = re.sub(item, "%s", options["SQL_BUFFER"])
-        ret_val = tuple(local_var_list)
+    bound = options["BIND_VALUES"]
+    if bound is not None and bound[0] == options["SQL_BUFFER"]:
+        # A repeat of a go we already prompted for
+        return bound[1]
+
+    stats = options["PREPARE_STATS"]
+    start = time.perf_counter()
+    misses = layout.cache_info().misses
+    sql, names = layout(
+        options["SQL_BUFFER"], options["ARGS"].servertype in ("ORACLE", "SQLITE")
+    )
+    if layout.cache_info().misses > misses:
+        stats["parse_misses"] += 1
+        stats["parse_time"] += time.perf_counter() - start
+    else:
+        stats["parse_hits"] += 1
+    options["SQL_BUFFER"] = sql
+
+    # We will prompt for the values for each variable, once per name
+    local_vars: Dict = {}
+    for name in names:
+        if name not in local_vars:
+            local_vars[name] = of.get_console().input(f":{name}:? ", emoji=False)
+    ret_val: Union[Dict, Tuple] = local_vars
+    if options["ARGS"].servertype not in ("ORACLE", "SQLITE"):
+        # MSSQL, PSQL and MYSQL take the values by position
+        ret_val = tuple(local_vars[name] for name in names)
+    if names:
+        options["BIND_VALUES"] = (sql, ret_val)
 
     return ret_val
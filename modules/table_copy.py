@@ -0,0 +1,291 @@
+""" Stream a result set from the current connection in to a table on
+another connection, reading and writing at the same time """
+import datetime
+import decimal
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import modules.bulk_import as bi
+import modules.column_types as ct
+import modules.connection as cn
+import modules.env_vars as ev
+import modules.output_fun as of
+import modules.pipeline as pl
+import modules.query_cache as qc
+import modules.substitute_vars as sv
+
+USAGE = (
+    "Usage: copy [-T type] [-S server] [-U user] [-P password] [-D database]"
+    " [-p port] [-F sqlitedb] [from <table>] into <table> [create] [batch n]"
+)
+
+# Column types to use when we create the target table
+DDL_TYPES = {
+    "MSSQL": {
+        "bool": "BIT",
+        "int": "BIGINT",
+        "float": "FLOAT",
+        "decimal": "DECIMAL(38, 10)",
+        "str": "NVARCHAR(MAX)",
+        "bytes": "VARBINARY(MAX)",
+        "datetime": "DATETIME2",
+        "date": "DATE",
+        "time": "TIME",
+    },
+    "PSQL": {
+        "bool": "BOOLEAN",
+        "int": "BIGINT",
+        "float": "DOUBLE PRECISION",
+        "decimal": "NUMERIC",
+        "str": "TEXT",
+        "bytes": "BYTEA",
+        "datetime": "TIMESTAMP",
+        "date": "DATE",
+        "time": "TIME",
+    },
+    "MYSQL": {
+        "bool": "BOOLEAN",
+        "int": "BIGINT",
+        "float": "DOUBLE",
+        "decimal": "DECIMAL(38, 10)",
+        "str": "LONGTEXT",
+        "bytes": "LONGBLOB",
+        "datetime": "DATETIME(6)",
+        "date": "DATE",
+        "time": "TIME(6)",
+    },
+    "ORACLE": {
+        "bool": "NUMBER(1)",
+        "int": "NUMBER(19)",
+        "float": "BINARY_DOUBLE",
+        "decimal": "NUMBER",
+        "str": "VARCHAR2(4000)",
+        "bytes": "BLOB",
+        "datetime": "TIMESTAMP",
+        "date": "DATE",
+        "time": "VARCHAR2(20)",
+    },
+    "SQLITE": {
+        "bool": "INTEGER",
+        "int": "INTEGER",
+        "float": "REAL",
+        "decimal": "NUMERIC",
+        "str": "TEXT",
+        "bytes": "BLOB",
+        "datetime": "TIMESTAMP",
+        "date": "DATE",
+        "time": "TEXT",
+    },
+}
+
+
+def parse_copy(tokens: List, options: Dict) -> Tuple[Dict, Dict]:
+    """Split the command into the target connection options and the copy
+    settings, raises ValueError if it doesn't make sense"""
+    args, rest = ev.connection_args(options, tokens[1:])
+    if args.servertype not in DDL_TYPES:
+        raise ValueError(f"Unknown connection type: {args.servertype}")
+    settings = {
+        "from": None,
+        "into": None,
+        "create": False,
+        "batch": options["FETCH_SIZE"],
+    }
+    pos = 0
+    while pos < len(rest):
+        name = rest[pos].lower()
+        if name == "create":
+            settings["create"] = True
+            pos += 1
+            continue
+        if name not in settings or pos + 1 == len(rest):
+            raise ValueError(USAGE)
+        if name == "batch":
+            if rest[pos + 1].isdigit() is False:
+                raise ValueError(f"Invalid batch size {rest[pos + 1]}")
+            settings["batch"] = max(int(rest[pos + 1]), 1)
+        else:
+            settings[name] = rest[pos + 1]
+        pos += 2
+    if settings["into"] is None:
+        raise ValueError(USAGE)
+    if settings["from"] is None and options["SQL_BUFFER"].strip() == "":
+        raise ValueError("Nothing to copy, the buffer is empty")
+
+    # The target connection is opened with its own copy of the options
+    target = dict(options)
+    target["ARGS"] = args
+    return target, settings
+
+
+def create_sql(table: str, headers: List, kinds: List, servertype: str) -> str:
+    """CREATE TABLE from the source description"""
+    types = DDL_TYPES[servertype]
+    columns = ", ".join(
+        f"{head[0]} {types[kind]}" for head, kind in zip(headers, kinds)
+    )
+    return f"CREATE TABLE {table} ({columns})"
+
+
+def adapt(value: Any) -> Any:
+    """SQLITE can't bind decimals or (from python 3.12) dates"""
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, memoryview):
+        return bytes(value)
+    return value
+
+
+def source_batches(cursor: Any, first: List, size: int) -> Iterator[List]:
+    """The source rows in batches, starting with any we already fetched"""
+    if first:
+        yield first
+    while True:
+        batch = cursor.fetchmany(size)
+        if not batch:
+            break
+        yield batch
+
+
+def next_batch(batches: Iterator[List], state: Dict) -> Optional[List]:
+    """Take the next batch from the reader, timing how long we wait"""
+    start = time.perf_counter()
+    batch = next(batches, None)
+    state["wait"] += time.perf_counter() - start
+    return batch
+
+
+def consume(
+    conn: Any, batches: Iterator[List], headers: List, settings: Dict, options: Dict
+) -> None:
+    """Writer side, insert each batch as it arrives, committing every
+    IMPORT_COMMIT rows"""
+    servertype = settings["target_type"]
+    state = settings["state"]
+    names = [head[0] for head in headers]
+    cursor = conn.cursor()
+    batch = next_batch(batches, state)
+    if settings["create"] is True:
+        kinds = ct.column_kinds(headers, options["ARGS"].servertype, batch or [])
+        cursor.execute(create_sql(settings["into"], headers, kinds, servertype))
+    cn.set_autocommit(conn, servertype, False)
+    since_commit = 0
+    try:
+        while batch is not None and options["SIG_INT"] is False:
+            if servertype == "SQLITE":
+                batch = [tuple(adapt(value) for value in rec) for rec in batch]
+            state["errors"].extend(
+                bi.write_batch(cursor, servertype, settings["into"], names, batch)
+            )
+            state["rows"] += len(batch)
+            since_commit += len(batch)
+            if 0 < options["IMPORT_COMMIT"] <= since_commit:
+                conn.commit()
+                since_commit = 0
+                state["committed"] = state["rows"]
+            bi.progress(options, state)
+            batch = next_batch(batches, state)
+        if options["SIG_INT"] is True:
+            # Cancelled, only what was committed already stays
+            conn.rollback()
+        else:
+            conn.commit()
+            state["committed"] = state["rows"]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cn.set_autocommit(conn, servertype, True)
+        cursor.close()
+
+
+def copy_table(options: Dict, tokens: List) -> None:
+    """copy [connection flags] [from <table>] into <table> [create] [batch n]
+    copies the buffer (or from table) to a table on another connection"""
+    try:
+        target, settings = parse_copy(tokens, options)
+    except ValueError as err:
+        print(f"Error: {err}")
+        return
+    values: Union[Dict, Tuple] = ()
+    if settings["from"] is None:
+        values = sv.analyze_query(options)
+        sql = options["SQL_BUFFER"]
+    else:
+        sql = f"SELECT * FROM {settings['from']}"
+    settings["target_type"] = target["ARGS"].servertype
+    options["SIG_INT"] = False
+
+    now = time.perf_counter()
+    state = {
+        "start": now,
+        "last": now,
+        "rows": 0,
+        "committed": 0,
+        "wait": 0.0,
+        "errors": [],
+    }
+    settings["state"] = state
+    source = None
+    conn = None
+    batches = None
+    try:
+        conn = cn.open_connection(target)
+        source = cn.large_cursor(options, sql)
+        if not values:
+            source.execute(sql)
+        else:
+            source.execute(sql, values)
+        first = []
+        if source.description is None and getattr(source, "name", None):
+            # A PSQL named cursor only describes itself after a fetch
+            first = source.fetchmany(settings["batch"])
+        if source.description is None:
+            raise ValueError("The source query did not return any rows")
+        headers = source.description
+        # The reader thread fetches while we write
+        batches = pl.background(
+            source_batches(source, first, settings["batch"]), options["COPY_QUEUE"]
+        )
+        consume(conn, batches, headers, settings, options)
+    except Exception as err:
+        # We have to be generic because we support multiple DBMS libraries
+        bi.progress(options, state, final=True)
+        of.write_logfile(f"Error: {err}", options, iserr=True)
+        of.write_logfile(
+            f"Copy in to {settings['into']} stopped, uncommitted rows rolled back",
+            options,
+            iserr=True,
+        )
+        return
+    finally:
+        if batches is not None:
+            batches.close()
+        if source is not None:
+            source.close()
+        if conn is not None:
+            conn.close()
+        if qc.same_server(options, target):
+            # We wrote to a table our cached results may have read
+            qc.invalidate(options)
+
+    bi.progress(options, state, final=True)
+    if options["SIG_INT"] is True:
+        of.write_logfile(
+            f"Copy cancelled, {state['committed']} rows committed to"
+            f" {settings['into']}, rows since the last commit were rolled back",
+            options,
+        )
+        return
+    elapsed = time.perf_counter() - state["start"]
+    rate = state["rows"] / elapsed if elapsed > 0 else 0
+    of.write_logfile(
+        f"Copied {state['rows']} rows into {settings['into']}"
+        f"\tElapsed = {elapsed:.4f}\tRows/sec = {rate:.0f}"
+        f"\tWaiting on source = {state['wait']:.4f}"
+        f"\tRejected = {len(state['errors'])}",
+        options,
+    )
+    for error in state["errors"][:10]:
+        of.write_logfile(f"Rejected {error}", options, iserr=True)
@@ -0,0 +1,294 @@
+""" Lay result sets out as text tables in the prettytable and rich
+styles.  Each value is turned into text once, by a formatter picked
+for its column, and the finished text feeds the screen and the file """
+import itertools
+import unicodedata
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+import modules.column_types as ct
+
+# Padding either side of a value, whether there are horizontal rules,
+# then (left, fill, junction, right) for the rules and (left, between,
+# right) for the rows.  These match the prettytable styles of the same name
+STYLES = {
+    "DEFAULT": {
+        "pad": (1, 1),
+        "rules": True,
+        "top": ("+", "-", "+", "+"),
+        "head": ("|", "|", "|"),
+        "mid": ("+", "-", "+", "+"),
+        "body": ("|", "|", "|"),
+        "bottom": ("+", "-", "+", "+"),
+    },
+    "MSWORD_FRIENDLY": {
+        "pad": (1, 1),
+        "rules": False,
+        "head": ("|", "|", "|"),
+        "body": ("|", "|", "|"),
+    },
+    "PLAIN_COLUMNS": {
+        "pad": (0, 8),
+        "rules": True,
+        "top": ("+", "-", "+", "+"),
+        "head": ("|", "|", "|"),
+        "mid": ("+", "-", "+", "+"),
+        "body": ("|", "|", "|"),
+        "bottom": ("+", "-", "+", "+"),
+    },
+    # The heavy headed box rich draws its tables with
+    "RICH": {
+        "pad": (1, 1),
+        "rules": True,
+        "top": ("┏", "━", "┳", "┓"),
+        "head": ("┃", "┃", "┃"),
+        "mid": ("┡", "━", "╇", "┩"),
+        "body": ("│", "│", "│"),
+        "bottom": ("└", "─", "┴", "┘"),
+    },
+}
+
+# prettytable's HCAPS settings
+HEADER_STYLES: Dict[Any, Callable[[str], str]] = {
+    "cap": str.capitalize,
+    "title": str.title,
+    "upper": str.upper,
+    "lower": str.lower,
+}
+
+
+def text_of(value: Any) -> str:
+    """Text columns mostly hold text already"""
+    return value if value.__class__ is str else str(value)
+
+
+def formatters(headers: List, servertype: str, sample: List) -> List[Callable]:
+    """The function that turns each column's values into text,
+    picked from the type codes or the sample once per result set"""
+    return [
+        text_of if kind == "str" else str
+        for kind in ct.column_kinds(headers, servertype, sample)
+    ]
+
+
+def display_width(text: str) -> int:
+    """Columns the text takes on a terminal, wide east asian
+    characters take two and combining characters none"""
+    if text.isascii():
+        return len(text)
+    return sum(
+        0
+        if unicodedata.combining(char)
+        else 2
+        if unicodedata.east_asian_width(char) in "WF"
+        else 1
+        for char in text
+    )
+
+
+def justify(text: str, width: int, align: str) -> str:
+    """Pad the text out to width, centering the way str.center does"""
+    excess = width - display_width(text)
+    if align == "l":
+        return text + " " * excess
+    if align == "r":
+        return " " * excess + text
+    left = excess // 2 + (excess & width & 1)
+    return " " * left + text + " " * (excess - left)
+
+
+def text_columns(batch: List, formats: List[Callable]) -> List[List[str]]:
+    """The batch as columns of text"""
+    return [list(map(fmt, column)) for fmt, column in zip(formats, zip(*batch))]
+
+
+def plain(columns: List[List[str]]) -> bool:
+    """No multi line or wide characters, so len is the width"""
+    return all(
+        text.isascii() and "\n" not in text for text in map("".join, columns)
+    )
+
+
+def column_widths(columns: List[List[str]], simple: bool) -> List[int]:
+    """The widest value in each column"""
+    if simple:
+        return [max(map(len, column), default=0) for column in columns]
+    return [
+        max(
+            (display_width(line) for text in column for line in text.split("\n")),
+            default=0,
+        )
+        for column in columns
+    ]
+
+
+class TextTable:
+    """Lays out the rows of one result set.  The widths are taken from
+    the rows seen first, a later row that is wider widens its column"""
+
+    def __init__(self, names: List[str], style: str, options: Dict) -> None:
+        self.style = STYLES[style]
+        self.align = options["OUTPUT_ALIGN"] if style != "RICH" else "l"
+        self.border = options["OUTPUT_BORDER"] or style == "RICH"
+        self.header = options["OUTPUT_HEADER"] or style == "RICH"
+        caps = HEADER_STYLES.get(options["HEADER_STYLE"]) if style != "RICH" else None
+        self.names = [caps(name) for name in names] if caps else list(names)
+        self.widths = [
+            display_width(name) if self.header else 0 for name in self.names
+        ]
+        self.template = ""
+
+    def compile(self) -> None:
+        """A str.format template for a row of single line values at the
+        current widths, centered values are padded before formatting"""
+        left, between, right = self.row_chars("body")
+        lpad, rpad = (" " * pad for pad in self.style["pad"])
+        spec = {"l": "<", "r": ">"}.get(self.align, "")
+        self.template = (
+            left
+            + between.join(
+                f"{lpad}{{:{spec}{width if spec else ''}}}{rpad}"
+                for width in self.widths
+            )
+            + right
+        )
+
+    def row_chars(self, part: str) -> Tuple[str, str, str]:
+        """The verticals of a row, none without a border"""
+        if not self.border:
+            return "", "", ""
+        return self.style[part]
+
+    def rule(self, part: str) -> List[str]:
+        """A horizontal rule, none without a border or in styles without"""
+        if not self.border or self.style["rules"] is False:
+            return []
+        left, fill, junction, right = self.style[part]
+        lpad, rpad = self.style["pad"]
+        return [
+            left
+            + junction.join(fill * (width + lpad + rpad) for width in self.widths)
+            + right
+        ]
+
+    def line(self, values: List[str], part: str) -> str:
+        """One line of a row, values padded one at a time"""
+        left, between, right = self.row_chars(part)
+        lpad, rpad = (" " * pad for pad in self.style["pad"])
+        return (
+            left
+            + between.join(
+                lpad + justify(value, width, self.align) + rpad
+                for value, width in zip(values, self.widths)
+            )
+            + right
+        )
+
+    def row_lines(self, values: List[str]) -> List[str]:
+        """A row with values that run over several lines"""
+        cells = [value.split("\n") for value in values]
+        return [
+            self.line(list(parts), "body")
+            for parts in itertools.zip_longest(*cells, fillvalue="")
+        ]
+
+    def widen(self, columns: List[List[str]], simple: bool) -> bool:
+        """Take in the widths of a batch, True if any column grew"""
+        grew = False
+        for i, width in enumerate(column_widths(columns, simple)):
+            if width > self.widths[i]:
+                self.widths[i] = width
+                grew = True
+        if grew or not self.template:
+            self.compile()
+        return grew
+
+    def top(self) -> List[str]:
+        """The lines above the first row"""
+        lines = self.rule("top")
+        if self.header:
+            lines.append(self.line(self.names, "head"))
+            lines.extend(self.rule("mid"))
+        return lines
+
+    def body(self, columns: List[List[str]], simple: bool) -> List[str]:
+        """The lines for the rows of a batch"""
+        rows = zip(*columns)
+        if simple:
+            fmt = self.template.format
+            if self.align == "c":
+                widths = self.widths
+                return [
+                    fmt(*[value.center(width) for value, width in zip(row, widths)])
+                    for row in rows
+                ]
+            return [fmt(*row) for row in rows]
+        lines: List[str] = []
+        for row in rows:
+            lines.extend(self.row_lines(list(row)))
+        return lines
+
+    def bottom(self) -> List[str]:
+        """The lines below the last row"""
+        return self.rule("bottom")
+
+
+def table_text(
+    headers: List,
+    batches: Iterator[List],
+    options: Dict,
+    style: str,
+    streaming: bool,
+) -> Iterator[str]:
+    """The table a block of lines at a time.  Streaming yields each
+    batch as it arrives, otherwise the rows are held so every column is
+    exactly as wide as its widest value, as prettytable does"""
+    table = TextTable([head[0] for head in headers], style, options)
+    formats: List[Callable] = []
+    held: List[Tuple[List[List[str]], bool]] = []
+    started = False
+    for batch in batches:
+        if not batch:
+            continue
+        if not formats:
+            formats = formatters(headers, options["ARGS"].servertype, batch)
+        columns = text_columns(batch, formats)
+        simple = plain(columns)
+        grew = table.widen(columns, simple)
+        if not streaming:
+            held.append((columns, simple))
+            continue
+        lines = []
+        if not started:
+            lines = table.top()
+            started = True
+        elif grew:
+            # Wider than the rows already shown, start a new section
+            lines = table.rule("mid")
+        lines.extend(table.body(columns, simple))
+        yield "\n".join(lines)
+
+    if not table.template:
+        table.compile()
+    lines = [] if started else table.top()
+    for columns, simple in held:
+        lines.extend(table.body(columns, simple))
+    lines.extend(table.bottom())
+    if lines:
+        yield "\n".join(lines)
+
+
+def record_text(headers: List, batches: Iterator[List], options: Dict) -> Iterator[str]:
+    """The column name and value for each row, a batch at a time"""
+    names = [head[0] for head in headers]
+    formats: List[Callable] = []
+    row_sep = "-----------------------------"
+    for batch in batches:
+        if not batch:
+            continue
+        if not formats:
+            formats = formatters(headers, options["ARGS"].servertype, batch)
+        labels = [f"{name} :: " for name in names]
+        lines = []
+        for row in zip(*text_columns(batch, formats)):
+            lines.extend(map(str.__add__, labels, row))
+            lines.append(row_sep)
+        yield "\n".join(lines)
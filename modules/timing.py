@@ -0,0 +1,136 @@
+""" Time each phase of running a query """
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+# The order we report the phases in.  fetch_wait is time the renderer
+# spent waiting on the reader thread, fetch is the reader's own time
+PHASES = (
+    "substitute",
+    "execute",
+    "first_row",
+    "fetch",
+    "fetch_wait",
+    "render",
+    "cache",
+    "file",
+)
+
+
+def start_query(options: Dict) -> None:
+    """Reset the timings for a new execution"""
+    options["TIMING"] = {
+        "start": time.perf_counter(),
+        "phases": {},
+        "stacks": {},  # One per thread, fetching may run on its own
+        "rows": 0,
+        "bytes": 0,
+        # The reader thread and the renderer both add to the totals
+        "lock": threading.Lock(),
+    }
+
+
+@contextmanager
+def phase(options: Dict, name: str) -> Iterator[None]:
+    """Time a phase, time spent in nested phases is only counted
+    against the nested phase"""
+    timing = options["TIMING"]
+    if not timing:
+        start_query(options)
+        timing = options["TIMING"]
+    stack = timing["stacks"].setdefault(threading.get_ident(), [])
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        with timing["lock"]:
+            timing["phases"][name] = timing["phases"].get(name, 0.0) + elapsed - nested
+        if stack:
+            stack[-1] += elapsed
+
+
+def count_rows(options: Dict, rows: int) -> None:
+    """Count fetched rows, the first ones mark our time to first row"""
+    timing = options["TIMING"]
+    if timing and rows > 0:
+        with timing["lock"]:
+            if "first_row" not in timing["phases"]:
+                timing["phases"]["first_row"] = time.perf_counter() - timing["start"]
+            timing["rows"] += rows
+
+
+def count_bytes(options: Dict, written: int) -> None:
+    """Count bytes written to the cache and output file"""
+    if options["TIMING"]:
+        with options["TIMING"]["lock"]:
+            options["TIMING"]["bytes"] += written
+
+
+def finish_query(options: Dict) -> None:
+    """Close out the timings for this execution, add them to the
+    running totals and report if the user asked for it"""
+    timing = options["TIMING"]
+    timing["phases"]["total"] = time.perf_counter() - timing["start"]
+    totals = options["TIMING_TOTALS"]
+    totals["runs"] = totals.get("runs", 0) + 1
+    totals["rows"] = totals.get("rows", 0) + timing["rows"]
+    totals["bytes"] = totals.get("bytes", 0) + timing["bytes"]
+    for name, secs in timing["phases"].items():
+        stats = totals.setdefault(name, {"sum": 0.0, "min": secs, "max": secs})
+        stats["sum"] += secs
+        stats["min"] = min(stats["min"], secs)
+        stats["max"] = max(stats["max"], secs)
+
+    if options["TIMING_ON"] is True:
+        parts = [
+            f"{name}={timing['phases'][name] * 1000:.3f}ms"
+            for name in PHASES + ("total",)
+            if name in timing["phases"]
+        ]
+        parts.append(f"rows={timing['rows']}")
+        parts.append(f"bytes={timing['bytes']}")
+        print("Timing: " + " ".join(parts))
+
+
+def summary(options: Dict) -> List[str]:
+    """Format the running totals"""
+    totals = options["TIMING_TOTALS"]
+    if not totals:
+        return ["No timings collected"]
+
+    runs = totals["runs"]
+    lines = [
+        f"Runs = {runs}\tRows = {totals['rows']}\tBytes = {totals['bytes']}",
+        f"{'phase':<12}{'avg ms':>12}{'min ms':>12}{'max ms':>12}{'total ms':>12}",
+    ]
+    for name in PHASES + ("total",):
+        if name in totals:
+            stats = totals[name]
+            lines.append(
+                f"{name:<12}{stats['sum'] / runs * 1000:>12.3f}"
+                f"{stats['min'] * 1000:>12.3f}{stats['max'] * 1000:>12.3f}"
+                f"{stats['sum'] * 1000:>12.3f}"
+            )
+
+    return lines
+
+
+def set_timing(options: Dict, tokens: List) -> None:
+    """timing [on|off|show|reset], no argument toggles the summary"""
+    if len(tokens) == 1:
+        options["TIMING_ON"] = not options["TIMING_ON"]
+        print(f"TIMING_ON {options['TIMING_ON']}")
+    elif tokens[1].lower() == "on":
+        options["TIMING_ON"] = True
+    elif tokens[1].lower() == "off":
+        options["TIMING_ON"] = False
+    elif tokens[1].lower() == "show":
+        print("\n".join(summary(options)))
+    elif tokens[1].lower() == "reset":
+        options["TIMING_TOTALS"] = {}
+    else:
+        print(f"Unknown timing option {tokens[1]}")
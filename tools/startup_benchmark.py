@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+  Time how long isql.py takes to start, run a trivial statement and exit,
+  the way cron jobs calling isql.py -Q do.
+
+  It also checks that nothing we load lazily (the other drivers,
+  rich, prettytable) was imported on the way, and exits with 1 if
+  it was or if the median run is slower than --max-ms
+
+  usage: tools/startup_benchmark.py [--runs n] [--max-ms n] [--top n]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+ISQL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "isql.py"
+)
+
+COMMAND = [
+    sys.executable,
+    ISQL,
+    "-T", "SQLITE",
+    "-F", ":memory:",
+    "-S", "bench",
+    "-U", "bench",
+    "-P", "bench",
+    "-q",
+    "-Q", "create temp table startup (a int)",
+]
+
+# None of these are needed to run a query against SQLITE with -q
+LAZY_MODULES = (
+    "pymssql",
+    "psycopg2",
+    "mysql.connector",
+    "oracledb",
+    "rich.console",
+    "rich.markdown",
+    "prettytable",
+    "asyncio",
+)
+
+
+def time_runs(runs: int) -> List[float]:
+    """Wall clock milliseconds of each run"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(COMMAND, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def import_times() -> List[Tuple[str, int]]:
+    """Cumulative import time in microseconds of each module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + COMMAND[1:],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules.append((name.strip(), int(cumulative)))
+
+    return modules
+
+
+def main() -> int:
+    """Run the benchmark and report"""
+    parser = argparse.ArgumentParser(description="isql.py startup benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="number of runs")
+    parser.add_argument("--max-ms", type=float, help="fail if the median is slower")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports shown")
+    args = parser.parse_args()
+
+    timings = time_runs(args.runs)
+    median = statistics.median(timings)
+    print(
+        f"runs = {args.runs}\tmin = {min(timings):.1f} ms"
+        f"\tmedian = {median:.1f} ms\tmax = {max(timings):.1f} ms"
+    )
+
+    modules = import_times()
+    print("Slowest imports (cumulative):")
+    for name, usecs in sorted(modules, key=lambda item: item[1], reverse=True)[
+        : args.top
+    ]:
+        print(f"  {usecs / 1000:>8.1f} ms  {name}")
+
+    status = 0
+    loaded = [name for name, _ in modules if name in LAZY_MODULES]
+    if loaded:
+        print(f"FAIL: imported at startup: {', '.join(loaded)}")
+        status = 1
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"FAIL: median {median:.1f} ms is over {args.max_ms:.1f} ms")
+        status = 1
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())